@@ -1,4 +1,6 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.utils.html import format_html
 from django.urls import reverse
@@ -6,7 +8,64 @@ from django.utils.safestring import mark_safe
 from django.http import HttpResponseRedirect
 from django.contrib import messages
 from django.utils import timezone
-from .models import User
+from .models import User, UserCounter, UserImport
+
+
+def _user_totals(request):
+    # One read of the counters per request, shared by the filters and the badge
+    if not hasattr(request, '_user_totals'):
+        request._user_totals = UserCounter.objects.totals()
+    return request._user_totals
+
+
+class CountedPaginator(Paginator):
+    """Takes the unfiltered total from UserCounter instead of counting the table"""
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            return UserCounter.objects.totals()['total']
+        return super().count
+
+
+class CountedFilter(admin.SimpleListFilter):
+    """A list filter labelled with counts from UserCounter instead of COUNT queries"""
+    choices_list = ()
+
+    def lookups(self, request, model_admin):
+        counts = _user_totals(request)[self.parameter_name]
+        return [(value, f'{label} ({counts.get(value, 0)})') for value, label in self.choices_list]
+
+    def queryset(self, request, queryset):
+        if self.value() is not None:
+            return queryset.filter(**{self.parameter_name: self.value()})
+        return queryset
+
+
+class RoleFilter(CountedFilter):
+    title = 'role'
+    parameter_name = 'role'
+    choices_list = User.ROLE_CHOICES
+
+
+class ApprovalStatusFilter(CountedFilter):
+    title = 'approval status'
+    parameter_name = 'approval_status'
+    choices_list = User.APPROVAL_STATUS_CHOICES
+
+
+class ActiveFilter(CountedFilter):
+    title = 'active'
+    parameter_name = 'is_active'
+    choices_list = ((True, 'Yes'), (False, 'No'))
+
+    def lookups(self, request, model_admin):
+        return [(int(value), label) for value, label in super().lookups(request, model_admin)]
+
+    def queryset(self, request, queryset):
+        if self.value() is not None:
+            return queryset.filter(is_active=self.value() == '1')
+        return queryset
 
 
 @admin.register(User)
@@ -15,7 +74,11 @@ class UserAdmin(BaseUserAdmin):
         'username', 'email', 'role', 'approval_status_display',
         'is_active', 'created_at', 'action_buttons'
     )
-    list_filter = ('role', 'approval_status', 'is_active', 'is_staff')
+    list_filter = (RoleFilter, ApprovalStatusFilter, ActiveFilter, 'is_staff')
+    # Filter counts come from UserCounter; never count the table per choice
+    show_facets = admin.ShowFacets.NEVER
+    show_full_result_count = False
+    paginator = CountedPaginator
     search_fields = ('username', 'email', 'first_name', 'last_name')
     ordering = ('-created_at',)
 
@@ -77,6 +140,12 @@ class UserAdmin(BaseUserAdmin):
     action_buttons.short_description = 'Actions'
     action_buttons.allow_tags = True
 
+    def changelist_view(self, request, extra_context=None):
+        """Show the number of users awaiting approval in the title"""
+        pending = _user_totals(request)['approval_status'].get('pending', 0)
+        extra_context = {'title': f'Select user to change ({pending} pending approval)', **(extra_context or {})}
+        return super().changelist_view(request, extra_context)
+
     def get_urls(self):
         """Add custom URLs for approve/reject actions"""
         from django.urls import path
@@ -249,6 +318,14 @@ class UserAdmin(BaseUserAdmin):
         return readonly
 
 
+@admin.register(UserImport)
+class UserImportAdmin(admin.ModelAdmin):
+    list_display = ('id', 'role', 'approval_status', 'requested_by', 'created_at', 'finished_at')
+    list_filter = ('finished_at',)
+    exclude = ('csv',)
+    readonly_fields = ('role', 'approval_status', 'requested_by', 'report', 'error', 'finished_at')
+
+
 # Custom admin site configuration
 admin.site.site_header = "User Management System"
 admin.site.site_title = "User Admin"
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from . import signals
+
+        User = self.get_model('User')
+        post_save.connect(signals.superuser_saved, sender=User)
+        post_delete.connect(signals.superuser_deleted, sender=User)
+        post_delete.connect(signals.uncount_user, sender=User)
@@ -0,0 +1,308 @@
+"""
+Bulk import of user accounts from CSV.
+
+The CSV is read as a stream in chunks of `batch_size` rows. Each chunk is
+validated in memory. Its usernames and emails are then checked against the
+database with one IN query each. Its passwords are hashed in a process
+pool, because PBKDF2 is CPU bound and one core only manages a couple of
+hashes per second. Finally the chunk is written with a single bulk_create.
+The admins get one summary email for the whole import instead of one per
+account.
+
+Columns: username and email are required. The optional columns are
+password, password_hash (already hashed by a Django hasher and stored as
+is), role, first_name, last_name and phone. A row with neither password
+column gets an unusable password; the user sets one through a password
+reset.
+
+The HTTP endpoint only queues a UserImport; the run_user_imports command
+runs the queue, so the process pool is never forked from a web worker.
+"""
+import csv
+import io
+import logging
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import django
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import UserCounter, UserImport
+from .notifications import send_import_summary
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+# Admin accounts are never created in bulk
+ROLES = {'user', 'lab_owner'}
+APPROVAL_STATUSES = {'pending', 'approved'}
+MAX_REPORTED_ERRORS = 1000
+EXISTING_ERRORS = {'username': 'A user with that username already exists.', 'email': 'Email already exists'}
+RACED_ERRORS = {
+    'username': 'Username registered while the import was running.',
+    'email': 'Email registered while the import was running.',
+}
+
+
+def _init_worker():
+    # Forked workers inherit the configured project; spawned ones do not
+    if not apps.ready:
+        django.setup()
+
+
+@contextmanager
+def hashing_pool(workers=None):
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        yield None
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        yield pool
+
+
+def hash_passwords(passwords, pool=None):
+    if pool is None:
+        return [make_password(password) for password in passwords]
+    return list(pool.map(make_password, passwords, chunksize=16))
+
+
+def _count(users):
+    # bulk_create skips User.save(), which keeps the counters otherwise
+    for key, count in Counter(user.counter_key() for user in users).items():
+        UserCounter.objects.adjust(*key, count)
+
+
+def check_columns(fieldnames):
+    missing = {'username', 'email'} - set(fieldnames or ())
+    if missing:
+        raise ValueError(f"CSV is missing the column(s): {', '.join(sorted(missing))}")
+
+
+def _clean_row(row, default_role):
+    """A validated dict of User fields for one CSV row, or a dict of errors"""
+    errors = {}
+    username = (row.get('username') or '').strip()
+    email = (row.get('email') or '').strip()
+    role = (row.get('role') or '').strip() or default_role
+    password, password_hash = row.get('password') or '', (row.get('password_hash') or '').strip()
+
+    if not username:
+        errors['username'] = 'This field is required.'
+    elif len(username) > 150:
+        errors['username'] = 'Ensure this field has no more than 150 characters.'
+    try:
+        validate_email(email)
+    except ValidationError:
+        errors['email'] = 'Enter a valid email address.'
+    if role not in ROLES:
+        errors['role'] = f'"{role}" is not a valid role.'
+    if password:
+        try:
+            validate_password(password)
+        except ValidationError as e:
+            errors['password'] = ' '.join(e.messages)
+    elif password_hash:
+        try:
+            identify_hasher(password_hash)
+        except ValueError:
+            errors['password_hash'] = 'Unknown password hash format.'
+    if errors:
+        return None, errors
+
+    return {
+        'username': username,
+        'email': email,
+        'role': role,
+        'first_name': (row.get('first_name') or '').strip()[:150],
+        'last_name': (row.get('last_name') or '').strip()[:150],
+        'phone': (row.get('phone') or '').strip()[:15] or None,
+        'password': password,
+        'password_hash': password_hash,
+    }, None
+
+
+class Importer:
+    def __init__(self, role='user', approval_status='approved', batch_size=1000, pool=None, approved_by=None):
+        if role not in ROLES:
+            raise ValueError(f'Unknown role {role!r}')
+        if approval_status not in APPROVAL_STATUSES:
+            raise ValueError(f'approval_status must be one of {sorted(APPROVAL_STATUSES)}')
+        self.role = role
+        self.approval_status = approval_status
+        self.batch_size = batch_size
+        self.pool = pool
+        self.approved_by = approved_by
+        self.created = 0
+        self.skipped = 0
+        self.errors = []
+        self._seen_usernames, self._seen_emails = set(), set()
+
+    def skip(self, line, username, errors):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'username': username, 'errors': errors})
+
+    def run(self, lines):
+        """Import CSV text lines (a text file object works); returns the report"""
+        reader = csv.DictReader(lines)
+        check_columns(reader.fieldnames)
+
+        chunk = []
+        for row in reader:
+            chunk.append((reader.line_num, row))
+            if len(chunk) >= self.batch_size:
+                self._import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._import_chunk(chunk)
+        return self.report()
+
+    def report(self):
+        return {'created': self.created, 'skipped': self.skipped, 'errors': self.errors}
+
+    def _import_chunk(self, chunk):
+        rows = []
+        for line, row in chunk:
+            data, errors = _clean_row(row, self.role)
+            if errors is None:
+                # Duplicates within the file itself
+                if data['username'] in self._seen_usernames:
+                    errors = {'username': 'Duplicate username in this file.'}
+                elif data['email'] in self._seen_emails:
+                    errors = {'email': 'Duplicate email in this file.'}
+            if errors:
+                self.skip(line, row.get('username'), errors)
+                continue
+            self._seen_usernames.add(data['username'])
+            self._seen_emails.add(data['email'])
+            rows.append((line, data))
+
+        rows = self._drop_taken(
+            [(line, data['username'], data['email'], data) for line, data in rows], EXISTING_ERRORS,
+        )
+        to_hash = [data['password'] for *_, data in rows if data['password']]
+        hashes = iter(hash_passwords(to_hash, self.pool))
+
+        users = []
+        approval = {'approval_status': self.approval_status, 'is_active': False}
+        if self.approval_status == 'approved':
+            approval.update(is_active=True, approved_by=self.approved_by, approved_at=timezone.now())
+        for line, username, email, data in rows:
+            password = data.pop('password')
+            password_hash = data.pop('password_hash')
+            user = User(**approval, **data)
+            if password:
+                user.password = next(hashes)
+            elif password_hash:
+                user.password = password_hash
+            else:
+                user.set_unusable_password()
+            users.append((line, username, email, user))
+        self._insert(users)
+
+    def _drop_taken(self, rows, messages):
+        """
+        Set-based collision check of (line, username, email, item) rows
+        against accounts in the database: rows whose username or email is
+        taken are skipped, with the error on the field that collided.
+        """
+        taken_usernames = set(
+            User.objects.filter(username__in=[username for _, username, _, _ in rows])
+            .values_list('username', flat=True)
+        )
+        taken_emails = set(
+            User.objects.filter(email__in=[email for _, _, email, _ in rows])
+            .values_list('email', flat=True)
+        )
+        kept = []
+        for row in rows:
+            line, username, email, _ = row
+            if username in taken_usernames:
+                self.skip(line, username, {'username': messages['username']})
+            elif email in taken_emails:
+                self.skip(line, username, {'email': messages['email']})
+            else:
+                kept.append(row)
+        return kept
+
+    def _insert(self, rows):
+        while True:
+            users = [user for *_, user in rows]
+            try:
+                with transaction.atomic():
+                    User.objects.bulk_create(users, batch_size=self.batch_size)
+                    _count(users)
+                break
+            except IntegrityError:
+                # Someone registered one of these names meanwhile: drop the
+                # collisions and retry without them, until the chunk goes in
+                kept = self._drop_taken(rows, RACED_ERRORS)
+                if len(kept) == len(rows):
+                    raise
+                rows = kept
+                for user in users:
+                    # Ids handed out by the rolled back insert
+                    user.pk = None
+        self.created += len(users)
+
+
+def queue_import(text, role='user', approval_status='approved', requested_by=None):
+    """Check the options and the header of an uploaded CSV and queue it for run_pending"""
+    if role not in ROLES:
+        raise ValueError(f'Unknown role {role!r}')
+    if approval_status not in APPROVAL_STATUSES:
+        raise ValueError(f'approval_status must be one of {sorted(APPROVAL_STATUSES)}')
+    check_columns(next(csv.reader(io.StringIO(text, newline='')), None))
+    return UserImport.objects.create(
+        csv=text, role=role, approval_status=approval_status, requested_by=requested_by,
+    )
+
+
+def run_pending(workers=None):
+    """
+    Run every queued UserImport, oldest first. A failed import is recorded
+    on the job and tried again next time; rows it already created are then
+    skipped as existing.
+    """
+    finished = 0
+    for job in UserImport.objects.filter(finished_at__isnull=True).order_by('created_at'):
+        try:
+            job.report = import_users(
+                io.StringIO(job.csv, newline=''), role=job.role, approval_status=job.approval_status,
+                workers=workers, approved_by=job.requested_by,
+            )
+        except ValueError as e:
+            # A bad file or option: trying again will not help
+            job.error = str(e)
+        except Exception as e:
+            logger.exception('User import %s failed', job.pk)
+            UserImport.objects.filter(pk=job.pk).update(error=str(e))
+            continue
+        job.csv, job.finished_at = '', timezone.now()
+        job.save(update_fields=['csv', 'report', 'error', 'finished_at'])
+        finished += 1
+        if job.report:
+            logger.info('User import %s: %s created, %s skipped', job.pk, job.report['created'], job.report['skipped'])
+    return finished
+
+
+def import_users(lines, role='user', approval_status='approved', batch_size=1000, workers=None,
+                 approved_by=None, notify=True):
+    """Import users from CSV lines and email the admins one summary"""
+    with hashing_pool(workers) as pool:
+        report = Importer(role, approval_status, batch_size, pool, approved_by).run(lines)
+    if notify and report['created']:
+        try:
+            send_import_summary(report, approval_status)
+        except Exception as e:
+            logger.warning('Failed to send the bulk import summary: %s', e)
+    return report
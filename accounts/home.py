@@ -0,0 +1,159 @@
+"""
+The app's home screen in one request: the user's profile, their upcoming
+appointments, laboratories and the most booked tests.
+
+The client used to make one call per section, each paying for a round
+trip, JWT decoding and a user lookup. Here the user is resolved once and
+the sections that read the database run at the same time, in threads
+(like appointments.sharding.scatter_gather). Each section has its own
+ETag. Sections whose tag the client sends in If-None-Match are left out
+of the response and listed under `not_modified`.
+
+The section ETags are not hashes of the content, which would mean
+loading it all first, but of a validator per section that one aggregate
+query can produce (see _VALIDATORS), so unchanged sections are never
+queried or rendered.
+"""
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, Max, Min, Q
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from appointments import sharding
+from appointments.models import Appointment
+from appointments.serializers import AppointmentSerializer
+from core.concurrency import etag_for
+from core.projections import get_projection
+from core.renderers import FastJSONRenderer
+from labs.models import Laboratory
+from labs.serializers import LaboratorySerializer
+from tests import typeahead
+from .serializers import UserProfileSerializer
+
+_renderer = FastJSONRenderer()
+
+
+def section_limits(params):
+    """Rows per list section: settings.HOME_SECTION_LIMITS, overridden by ?<section>=N (0 skips it)"""
+    limits = dict(settings.HOME_SECTION_LIMITS)
+    for name in limits:
+        if name in params:
+            try:
+                limits[name] = int(params[name])
+            except ValueError:
+                raise ValidationError({name: 'Enter a whole number.'})
+            if not 0 <= limits[name] <= settings.HOME_MAX_SECTION_LIMIT:
+                raise ValidationError({name: f'Must be between 0 and {settings.HOME_MAX_SECTION_LIMIT}.'})
+    return limits
+
+
+def upcoming_appointments(user, limit):
+    """The user's next appointments that are not cancelled, at active labs"""
+    projection = get_projection(AppointmentSerializer)
+    queryset = (
+        Appointment.objects.filter(user=user, appointment_time__gte=timezone.now())
+        .exclude(status='cancelled')
+        .exclude(lab_test__in=sharding.lab_test_ids(lab__is_active=False))
+        .order_by('appointment_time', 'id')
+    )
+    # Trailing sort columns are ignored by the projection converter
+    values = queryset.values_list(*projection.lookups, 'appointment_time', 'id')[:limit]
+    rows = sharding.scatter_gather(values, key=lambda row: (row[-2], row[-1]))
+    return projection.data(rows[:limit])
+
+
+def laboratories(user, limit):
+    projection = get_projection(LaboratorySerializer)
+    return projection.serialize(Laboratory.objects.filter(is_active=True).order_by('name', 'id')[:limit])
+
+
+def popular_tests(user, limit):
+    """Most booked tests first, from the in-memory typeahead index"""
+    return typeahead.get_index().results[:limit]
+
+
+_LOADERS = {
+    'appointments': upcoming_appointments,
+    'labs': laboratories,
+    'tests': popular_tests,
+}
+
+
+def _load(loader, user, limit):
+    try:
+        return loader(user, limit)
+    finally:
+        # Worker threads open their own connections
+        connections.close_all()
+
+
+def _appointments_state(user, limit):
+    # Any change to the user's bookings moves the count or updated_at; the
+    # next upcoming time moves when one starts and drops off the list
+    queryset = (
+        Appointment.objects.filter(user=user).order_by().values('user')
+        .annotate(
+            count=Count('id'), changed=Max('updated_at'),
+            next=Min('appointment_time', filter=Q(appointment_time__gte=timezone.now())),
+        )
+        .values_list('count', 'changed', 'next')
+    )
+    # Bookings at labs that are offboarded disappear too
+    return [limit, _labs_state(user, limit), *sharding.scatter_gather(queryset)]
+
+
+def _labs_state(user, limit):
+    # Offboarding bumps updated_at, so this moves whenever the list may change
+    state = Laboratory.objects.aggregate(changed=Max('updated_at'), active=Count('id', filter=Q(is_active=True)))
+    return [limit, state['changed'], state['active']]
+
+
+def _tests_state(user, limit):
+    # Served from memory, so the rows themselves are the cheapest validator
+    return popular_tests(user, limit)
+
+
+# Cheap stand-ins for each section's content, from which its ETag is made
+# before deciding whether to load it
+_VALIDATORS = {
+    'appointments': _appointments_state,
+    'labs': _labs_state,
+    'tests': _tests_state,
+}
+
+
+def section_etag(name, state):
+    return f'"{name}-{hashlib.md5(_renderer.render(state)).hexdigest()[:16]}"'
+
+
+def combined_etag(etags):
+    digest = hashlib.md5('|'.join(sorted(etags.values())).encode()).hexdigest()[:16]
+    return f'"home-{digest}"'
+
+
+def section_etags(user, limits):
+    """{section: etag} for the profile and each section with a non-zero limit"""
+    # Same validator as the profile endpoint
+    etags = {'profile': etag_for(user)}
+    for name, validator in _VALIDATORS.items():
+        if limits.get(name):
+            etags[name] = section_etag(name, validator(user, limits[name]))
+    return etags
+
+
+def build(user, limits, skip=()):
+    """{section: data} for the profile and the sections with a limit, except those in skip"""
+    data = {}
+    if 'profile' not in skip:
+        data['profile'] = UserProfileSerializer(user).data
+    wanted = [name for name in _LOADERS if limits.get(name) and name not in skip]
+    if wanted:
+        with ThreadPoolExecutor(max_workers=len(wanted)) as pool:
+            futures = {name: pool.submit(_load, _LOADERS[name], user, limits[name]) for name in wanted}
+            for name, future in futures.items():
+                data[name] = future.result()
+    return data
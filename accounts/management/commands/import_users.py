@@ -0,0 +1,38 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.bulk_import import import_users
+
+
+class Command(BaseCommand):
+    help = 'Create user accounts from a CSV file (see accounts.bulk_import for the columns)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file, or '-' for standard input")
+        parser.add_argument('--role', default='user', help='Role for rows without one')
+        parser.add_argument('--approval-status', default='approved', choices=['approved', 'pending'])
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=None, help='Password hashing processes (default: all cores)')
+        parser.add_argument('--no-notify', action='store_true', help='Do not email the admins a summary')
+
+    def handle(self, *args, **options):
+        fh = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8-sig', newline='')
+        try:
+            report = import_users(
+                fh,
+                role=options['role'],
+                approval_status=options['approval_status'],
+                batch_size=options['batch_size'],
+                workers=options['workers'],
+                notify=not options['no_notify'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            if fh is not sys.stdin:
+                fh.close()
+
+        for error in report['errors']:
+            self.stderr.write(f"line {error['line']} ({error['username']}): {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(f"Created {report['created']} user(s), skipped {report['skipped']}"))
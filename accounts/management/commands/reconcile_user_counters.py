@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import UserCounter
+
+
+class Command(BaseCommand):
+    help = 'Recount users by role, approval status and is_active and repair UserCounter'
+
+    def handle(self, *args, **options):
+        fixes = UserCounter.objects.reconcile()
+        for (role, approval_status, is_active), (was, now) in sorted(fixes.items()):
+            state = 'active' if is_active else 'inactive'
+            self.stdout.write(f'{role}/{approval_status}/{state}: {was} -> {now}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Fixed {len(fixes)} counter(s)' if fixes else 'Counters are correct'
+        ))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.bulk_import import run_pending
+from accounts.models import UserImport
+
+
+class Command(BaseCommand):
+    help = 'Run the CSV imports queued through the bulk import endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Password hashing processes (default: all cores)')
+        parser.add_argument('--watch', type=float, default=None, metavar='SECONDS',
+                            help='Keep running, checking for new imports every SECONDS')
+
+    def handle(self, *args, **options):
+        while True:
+            finished = run_pending(options['workers'])
+            remaining = UserImport.objects.filter(finished_at__isnull=True).count()
+            self.stdout.write(f'Finished {finished} import(s), {remaining} remaining')
+            if options['watch'] is None:
+                break
+            time.sleep(options['watch'])
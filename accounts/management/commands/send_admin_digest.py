@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts.models import AdminDigest
+from accounts.notifications import admin_recipients, digest_message, pending_users, send_digest
+
+
+class Command(BaseCommand):
+    help = 'Email each superuser one summary of the users who registered since the last one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Print the digest instead of sending it')
+
+    def handle(self, *args, **options):
+        until = timezone.now()
+        last = AdminDigest.objects.first()
+        pending = pending_users().filter(created_at__lte=until)
+        new_users = pending
+        if last is not None:
+            new_users = new_users.filter(created_at__gt=last.covers_until)
+
+        listed = settings.ADMIN_DIGEST_MAX_LISTED
+        new_count = new_users.count()
+        if not new_count:
+            self.stdout.write('No new registrations since the last digest')
+            return
+        recipients = admin_recipients()
+        if not recipients:
+            self.stderr.write('No superuser has an email address; nothing sent')
+            return
+
+        subject, body = digest_message(new_count, pending.count(), list(new_users[:listed]))
+        if options['dry_run']:
+            self.stdout.write(f"To: {', '.join(recipients)}\nSubject: {subject}\n\n{body}")
+            return
+
+        send_digest(recipients, subject, body)
+        AdminDigest.objects.create(covers_until=until, registrations=new_count, recipients=len(recipients))
+        self.stdout.write(self.style.SUCCESS(
+            f'Sent a digest of {new_count} registration(s) to {len(recipients)} admin(s)'
+        ))
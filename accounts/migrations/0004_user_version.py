@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_user_approval_status_user_approved_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
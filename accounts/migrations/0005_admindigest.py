@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_user_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdminDigest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('covers_until', models.DateTimeField(db_index=True)),
+                ('registrations', models.PositiveIntegerField()),
+                ('recipients', models.PositiveIntegerField()),
+                ('sent_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-covers_until'],
+            },
+        ),
+    ]
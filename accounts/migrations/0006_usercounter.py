@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:14
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_users(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    UserCounter = apps.get_model('accounts', 'UserCounter')
+    alias = schema_editor.connection.alias
+    rows = (
+        User.objects.using(alias).order_by().values_list('role', 'approval_status', 'is_active')
+        .annotate(count=Count('id'))
+    )
+    UserCounter.objects.using(alias).bulk_create(
+        UserCounter(role=role, approval_status=approval_status, is_active=is_active, count=count)
+        for role, approval_status, is_active, count in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_admindigest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(max_length=20)),
+                ('approval_status', models.CharField(max_length=20)),
+                ('is_active', models.BooleanField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('role', 'approval_status', 'is_active'), name='usercounter_key')],
+            },
+        ),
+        migrations.RunPython(count_users, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_usercounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('csv', models.TextField()),
+                ('role', models.CharField(default='user', max_length=20)),
+                ('approval_status', models.CharField(default='approved', max_length=20)),
+                ('report', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -1,10 +1,122 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import IntegrityError, models, router, transaction
+from django.db.models import Count, F
 from django.core.mail import send_mail
 from django.conf import settings
+from core.models import VersionedModel
 
 
-class User(AbstractUser):
+class AdminDigest(models.Model):
+    """
+    A registration summary sent to the admins; the newest one marks which
+    registrations the next summary should cover.
+    """
+    covers_until = models.DateTimeField(db_index=True)
+    registrations = models.PositiveIntegerField()
+    recipients = models.PositiveIntegerField()
+    sent_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-covers_until']
+
+    def __str__(self):
+        return f"Digest of {self.registrations} registration(s) until {self.covers_until:%Y-%m-%d %H:%M}"
+
+
+class UserImport(models.Model):
+    """
+    A CSV uploaded to the bulk import endpoint, waiting for the
+    run_user_imports command (see accounts.bulk_import). Hashing the
+    passwords needs a process pool, which web workers should not fork, so
+    the request only stores the file.
+    """
+    csv = models.TextField()
+    role = models.CharField(max_length=20, default='user')
+    approval_status = models.CharField(max_length=20, default='approved')
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    report = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        state = 'finished' if self.finished_at else 'queued'
+        return f"User import {self.pk} ({state})"
+
+
+class UserCounterManager(models.Manager):
+    def adjust(self, role, approval_status, is_active, delta):
+        """Add delta to one counter; call inside the transaction that changed the users"""
+        if not delta:
+            return
+        key = {'role': role, 'approval_status': approval_status, 'is_active': is_active}
+        if self.filter(**key).update(count=F('count') + delta):
+            return
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(count=delta, **key)
+        except IntegrityError:
+            # Created concurrently
+            self.filter(**key).update(count=F('count') + delta)
+
+    def totals(self):
+        """User counts by role, by approval status and by is_active, from the counters alone"""
+        totals = {'total': 0, 'role': {}, 'approval_status': {}, 'is_active': {True: 0, False: 0}}
+        for role, approval_status, is_active, count in self.values_list('role', 'approval_status', 'is_active', 'count'):
+            totals['total'] += count
+            totals['role'][role] = totals['role'].get(role, 0) + count
+            totals['approval_status'][approval_status] = totals['approval_status'].get(approval_status, 0) + count
+            totals['is_active'][is_active] += count
+        return totals
+
+    def reconcile(self):
+        """Recount from the user table; returns {(role, approval_status, is_active): (was, now)} for the fixes"""
+        with transaction.atomic(using=self.db):
+            stored = {
+                (role, approval_status, is_active): count
+                for role, approval_status, is_active, count
+                in self.select_for_update().values_list('role', 'approval_status', 'is_active', 'count')
+            }
+            actual = {
+                (role, approval_status, is_active): count
+                for role, approval_status, is_active, count
+                in User.objects.using(self.db).order_by().values_list('role', 'approval_status', 'is_active')
+                .annotate(count=Count('id'))
+            }
+            fixes = {
+                key: (stored.get(key, 0), actual.get(key, 0))
+                for key in stored.keys() | actual.keys() if stored.get(key, 0) != actual.get(key, 0)
+            }
+            for (role, approval_status, is_active), (was, now) in fixes.items():
+                self.adjust(role, approval_status, is_active, now - was)
+        return fixes
+
+
+class UserCounter(models.Model):
+    """
+    Number of users per (role, approval status, is_active), so the admin
+    filters and the pending approvals badge never count the user table.
+    Kept in step by User.save() and the user post_delete signal within the
+    same transaction; bulk writes adjust it themselves, and the
+    reconcile_user_counters command repairs drift from QuerySet.update().
+    """
+    role = models.CharField(max_length=20)
+    approval_status = models.CharField(max_length=20)
+    is_active = models.BooleanField()
+    count = models.IntegerField(default=0)
+
+    objects = UserCounterManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['role', 'approval_status', 'is_active'], name='usercounter_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.role}/{self.approval_status}/{'active' if self.is_active else 'inactive'}: {self.count}"
+
+
+class User(AbstractUser, VersionedModel):
     ROLE_CHOICES = [
         ('superuser', 'Superuser'),
         ('admin', 'Admin'),
@@ -43,13 +155,67 @@ class User(AbstractUser):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    COUNTED_FIELDS = ('role', 'approval_status', 'is_active')
+
+    # Only the profile endpoint, with If-Match, checks the version
+    check_loaded_version = False
+
+    # UserCounter key and is_superuser as last read from the database
+    _counted = None
+    _was_superuser = None
+
     def __str__(self):
         return f"{self.username} ({self.get_role_display()}) - {self.get_approval_status_display()}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(name in field_names for name in cls.COUNTED_FIELDS):
+            instance._counted = instance.counter_key()
+        if 'is_superuser' in field_names:
+            instance._was_superuser = values[field_names.index('is_superuser')]
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using, fields, from_queryset)
+        # Loading a deferred field refreshes just that field
+        if fields is None or set(self.COUNTED_FIELDS) <= set(fields):
+            self._counted = self.counter_key()
+        if fields is None or 'is_superuser' in fields:
+            self._was_superuser = self.is_superuser
+
+    def counter_key(self):
+        return (self.role, self.approval_status, self.is_active)
+
+    def save(self, *args, **kwargs):
+        """Save, moving the user between UserCounter rows when the key changes"""
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not set(update_fields) & set(self.COUNTED_FIELDS):
+            return super().save(*args, **kwargs)
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            counted = self._counted
+            if not self._state.adding and counted is None:
+                # Loaded without the counted fields
+                counted = User.objects.using(using).filter(pk=self.pk).values_list(*self.COUNTED_FIELDS).first()
+            super().save(*args, **kwargs)
+            key = self.counter_key()
+            if key != counted:
+                counters = UserCounter.objects.db_manager(using)
+                if counted is not None:
+                    counters.adjust(*counted, -1)
+                counters.adjust(*key, 1)
+        self._counted = key
+
     @property
     def is_approved(self):
         return self.approval_status == 'approved'
 
+    @property
+    def is_admin(self):
+        """Staff, superusers and users with an admin role see everything"""
+        return self.is_staff or self.is_superuser or self.role in ('admin', 'superuser')
+
     def send_approval_email(self):
         """Send email when user is approved"""
         subject = 'Account Approved - Welcome!'
@@ -92,8 +258,8 @@ class User(AbstractUser):
 
     def send_admin_notification_email(self):
         """Send notification to superusers when new user registers"""
-        superusers = User.objects.filter(is_superuser=True)
-        admin_emails = [user.email for user in superusers if user.email]
+        from .notifications import admin_recipients
+        admin_emails = admin_recipients()
 
         if admin_emails:
             subject = 'New User Registration Pending Approval'
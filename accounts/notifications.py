@@ -0,0 +1,90 @@
+"""
+Admin notifications for new registrations.
+
+In 'immediate' mode (settings.ADMIN_NOTIFICATION_MODE) every registration
+emails the superusers straight away. In 'digest' mode registrations only
+create the pending user; the send_admin_digest command, run periodically,
+sends each superuser one summary of the pending users instead.
+
+Both modes read the recipients from a cached list, which the User signals
+in accounts.signals drop whenever a superuser is added, changed or removed.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.mail import send_mail, send_mass_mail
+
+ADMIN_RECIPIENTS_CACHE_KEY = 'accounts:admin_recipients'
+
+
+def digest_mode():
+    return settings.ADMIN_NOTIFICATION_MODE == 'digest'
+
+
+def admin_recipients():
+    """Email addresses of every superuser, cached"""
+    recipients = cache.get(ADMIN_RECIPIENTS_CACHE_KEY)
+    if recipients is None:
+        recipients = list(
+            get_user_model().objects.filter(is_superuser=True).exclude(email='')
+            .order_by('pk').values_list('email', flat=True)
+        )
+        cache.set(ADMIN_RECIPIENTS_CACHE_KEY, recipients, settings.ADMIN_RECIPIENTS_CACHE_TIMEOUT)
+    return recipients
+
+
+def forget_admin_recipients():
+    cache.delete(ADMIN_RECIPIENTS_CACHE_KEY)
+
+
+def pending_users():
+    """Users awaiting approval, newest first (as listed by PendingUsersView)"""
+    return get_user_model().objects.filter(approval_status='pending').order_by('-created_at')
+
+
+def digest_message(new_count, pending_count, listed_users):
+    """Subject and body of a digest of new_count registrations"""
+    subject = f'{new_count} new registration(s) pending approval'
+    lines = [
+        f'{new_count} user(s) registered since the last summary; '
+        f'{pending_count} account(s) are awaiting approval in total.',
+        '',
+    ]
+    for user in listed_users:
+        lines.append(
+            f"- {user.username} <{user.email}>, {user.get_role_display()}, "
+            f"registered {user.created_at.strftime('%Y-%m-%d %H:%M')}"
+        )
+    if new_count > len(listed_users):
+        lines.append(f'- ... and {new_count - len(listed_users)} more')
+    lines += [
+        '',
+        'Login to the admin panel to approve or reject these users:',
+        f'{settings.FRONTEND_URL}/admin/pending-users',
+    ]
+    return subject, '\n'.join(lines)
+
+
+def send_digest(recipients, subject, body):
+    """One message per admin over a single SMTP connection"""
+    return send_mass_mail(
+        [(subject, body, settings.DEFAULT_FROM_EMAIL, [email]) for email in recipients],
+        fail_silently=False,
+    )
+
+
+def send_import_summary(report, approval_status):
+    """One email to all admins about a bulk import"""
+    recipients = admin_recipients()
+    if not recipients:
+        return
+    lines = [f"{report['created']} account(s) were imported ({approval_status}); {report['skipped']} row(s) were skipped."]
+    if approval_status == 'pending':
+        lines += ['', 'Review them at:', f'{settings.FRONTEND_URL}/admin/pending-users']
+    send_mail(
+        f"Bulk import: {report['created']} new account(s)",
+        '\n'.join(lines),
+        settings.DEFAULT_FROM_EMAIL,
+        recipients,
+        fail_silently=False,
+    )
@@ -3,7 +3,11 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from django.utils import timezone
+from .models import UserImport
+from .notifications import digest_mode
+import logging
 
+logger = logging.getLogger(__name__)
 User = get_user_model()
 
 
@@ -87,12 +91,14 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
 
         user = User.objects.create_user(**validated_data)
 
-        # Send notification to admins
+        # Notify admins now, unless they get periodic digests instead
+        if digest_mode():
+            return user
         try:
             user.send_admin_notification_email()
         except Exception as e:
             # Log error but don't fail registration
-            print(f"Failed to send admin notification: {e}")
+            logger.warning('Failed to send admin notification for %s: %s', user.username, e)
 
         return user
 
@@ -133,7 +139,7 @@ class UserApprovalSerializer(serializers.ModelSerializer):
             try:
                 instance.send_approval_email()
             except Exception as e:
-                print(f"Failed to send approval email: {e}")
+                logger.warning('Failed to send approval email to %s: %s', instance.username, e)
 
         elif action == 'reject':
             instance.approval_status = 'rejected'
@@ -145,6 +151,12 @@ class UserApprovalSerializer(serializers.ModelSerializer):
             try:
                 instance.send_rejection_email()
             except Exception as e:
-                print(f"Failed to send rejection email: {e}")
+                logger.warning('Failed to send rejection email to %s: %s', instance.username, e)
 
-        return instance
\ No newline at end of file
+        return instance
+
+
+class UserImportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserImport
+        fields = ('id', 'role', 'approval_status', 'report', 'error', 'created_at', 'finished_at')
@@ -0,0 +1,26 @@
+from .models import UserCounter
+from .notifications import forget_admin_recipients
+
+
+def superuser_saved(sender, instance, created, **kwargs):
+    """
+    Drop the cached admin recipients when a superuser is added, demoted or
+    edited (their email may have changed). Whether the user was a superuser
+    comes from User.from_db; if it was not loaded, assume they might have
+    been. QuerySet.update() bypasses this; the cache timeout bounds how
+    stale the list can get then.
+    """
+    was_superuser = instance._was_superuser
+    if instance.is_superuser or was_superuser or (was_superuser is None and not created):
+        forget_admin_recipients()
+    instance._was_superuser = instance.is_superuser
+
+
+def superuser_deleted(sender, instance, **kwargs):
+    if instance.is_superuser:
+        forget_admin_recipients()
+
+
+def uncount_user(sender, instance, using, **kwargs):
+    # Runs inside the deletion's transaction
+    UserCounter.objects.db_manager(using).adjust(*(instance._counted or instance.counter_key()), -1)
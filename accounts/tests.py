@@ -1,3 +1,548 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core import mail
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db.models import Count
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.settings import api_settings
+
+from core import testing
+from core.middleware import ConcurrencyLimitMiddleware, GZipMiddleware
+from core.throttling import TokenBucket
+from . import bulk_import, home as home_screen
+from .models import AdminDigest, UserCounter, UserImport
+
+
+class ProfileConcurrencyTests(TestCase):
+    """
+    If-Match on the profile, with and without gzip weakening the ETag.
+    Gzip's random padding is turned off so that small bodies always compress.
+    """
+
+    def setUp(self):
+        self.user = testing.create_user()
+        self.client = testing.api_client(self.user)
+
+    def get_etag(self, **headers):
+        response = self.client.get(reverse('get_user_profile'), **headers)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def update(self, etag, first_name):
+        return self.client.patch(reverse('update_user_profile'), {'first_name': first_name}, HTTP_IF_MATCH=etag)
+
+    def test_if_match_with_a_strong_etag(self):
+        etag = self.get_etag()
+        self.assertFalse(etag.startswith('W/'))
+        response = self.update(etag, 'Ada')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(GZIP_MIN_LENGTH=0)
+    @mock.patch.object(GZipMiddleware, 'max_random_bytes', 0)
+    def test_if_match_with_a_gzip_weakened_etag(self):
+        etag = self.get_etag(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(etag.startswith('W/'))
+        self.assertEqual(self.update(etag, 'Ada').status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Ada')
+
+    @override_settings(GZIP_MIN_LENGTH=0)
+    @mock.patch.object(GZipMiddleware, 'max_random_bytes', 0)
+    def test_stale_etags_are_refused(self):
+        for headers in ({}, {'HTTP_ACCEPT_ENCODING': 'gzip'}):
+            etag = self.get_etag(**headers)
+            self.assertEqual(self.update(etag, 'Ada').status_code, 200)
+            self.assertEqual(self.update(etag, 'Grace').status_code, 412)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Ada')
+
+    def test_other_saves_are_not_version_checked(self):
+        stale = get_user_model().objects.get(pk=self.user.pk)
+        etag = self.get_etag()
+        self.assertEqual(self.update(etag, 'Ada').status_code, 200)
+        # An admin approving from a page loaded before the profile change
+        stale.approval_status = 'approved'
+        stale.save()
+        self.assertEqual(stale.version, self.user.version + 2)
+        self.assertNotEqual(self.get_etag(), etag)
+        self.assertEqual(self.update(etag, 'Grace').status_code, 412)
+
+    def test_login_with_a_stale_user(self):
+        response = self.client.post(
+            reverse('token_obtain_pair'), {'username': self.user.username, 'password': 'secret-pass-123'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.user.first_name = 'Ada'
+        self.user.save()
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('core.throttling.time')
+        patcher.start().time.side_effect = lambda: self.now
+        self.addCleanup(patcher.stop)
+        self.bucket = TokenBucket(3, 1.0, LocMemCache('buckets', {}))
+        self.bucket.cache.clear()
+
+    def consume(self, ident='client'):
+        return self.bucket.consume(ident)
+
+    def test_bursts_up_to_capacity(self):
+        self.assertEqual([self.consume()[0] for _ in range(4)], [True, True, True, False])
+        self.assertEqual(self.consume(), (False, 1.0))
+        self.assertTrue(self.consume('other client')[0])
+
+    def test_refills_at_the_rate(self):
+        for _ in range(3):
+            self.consume()
+        self.now += 1
+        self.assertEqual(self.consume(), (True, 0))
+        self.assertFalse(self.consume()[0])
+        self.now += 0.5
+        allowed, wait = self.consume()
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 0.5)
+
+    def test_idle_time_does_not_bank_more_than_capacity(self):
+        self.consume()
+        self.now += 30
+        self.assertEqual([self.consume()[0] for _ in range(4)], [True, True, True, False])
+
+
+@mock.patch.dict(api_settings.DEFAULT_THROTTLE_RATES, {'login': '100/min', 'login_username': '2/min'})
+class LoginThrottleTests(TestCase):
+    """Logins are limited per username whatever address they come from"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = testing.create_user(username='alice')
+
+    def setUp(self):
+        cache.clear()
+
+    def login(self, username, address='10.0.0.1', password='wrong'):
+        return self.client.post(
+            reverse('token_obtain_pair'), {'username': username, 'password': password}, REMOTE_ADDR=address,
+        )
+
+    def test_per_username_bucket(self):
+        self.assertEqual(self.login('alice').status_code, 401)
+        self.assertEqual(self.login('alice', '10.0.0.2').status_code, 401)
+        for username, address in (('alice', '10.0.0.3'), ('ALICE', '10.0.0.4')):
+            response = self.login(username, address, password='secret-pass-123')
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response)
+        self.assertEqual(self.login('bob').status_code, 401)
+
+
+class LoadSheddingTests(SimpleTestCase):
+    def request(self):
+        return RequestFactory().get('/inner/')
+
+    @override_settings(MAX_CONCURRENT_REQUESTS=1, LOAD_SHED_RETRY_AFTER=2)
+    def test_requests_over_the_budget_get_503(self):
+        inner = []
+
+        def view(request):
+            if request.path == '/':
+                # Arrives while this request holds the only slot
+                inner.append(middleware(self.request()))
+            return HttpResponse('ok')
+
+        middleware = ConcurrencyLimitMiddleware(view)
+        self.assertEqual(middleware(RequestFactory().get('/')).status_code, 200)
+        self.assertEqual(inner[0].status_code, 503)
+        self.assertEqual(inner[0]['Retry-After'], '2')
+        # The slot was released
+        self.assertEqual(middleware(self.request()).status_code, 200)
+
+    @override_settings(MAX_CONCURRENT_REQUESTS=1)
+    def test_streams_hold_their_slot_until_closed(self):
+        middleware = ConcurrencyLimitMiddleware(lambda request: StreamingHttpResponse(iter([b'a', b'b'])))
+        response = middleware(self.request())
+        self.assertEqual(middleware(self.request()).status_code, 503)
+        b''.join(response.streaming_content)
+        response.close()
+        self.assertEqual(middleware(self.request()).status_code, 200)
+
+    @override_settings(MAX_CONCURRENT_REQUESTS=0)
+    def test_a_budget_of_zero_disables_it(self):
+        middleware = ConcurrencyLimitMiddleware(
+            lambda request: middleware(self.request()) if request.path == '/' else HttpResponse('ok'),
+        )
+        self.assertEqual(middleware(RequestFactory().get('/')).status_code, 200)
+
+
+@mock.patch('accounts.signals.forget_admin_recipients')
+class AdminRecipientsCacheTests(TestCase):
+    """The cached superuser list is dropped only when superusers change"""
+
+    def test_loading_users_runs_no_extra_queries(self, forget):
+        testing.create_user(), testing.create_admin()
+        with self.assertNumQueries(1):
+            users = list(get_user_model().objects.only('id', 'username'))
+        self.assertEqual(len(users), 2)
+
+    def test_promoting_and_demoting(self, forget):
+        user = testing.create_user()
+        self.assertFalse(forget.called)
+        user = get_user_model().objects.get(pk=user.pk)
+        user.first_name = 'Ada'
+        user.save()
+        self.assertFalse(forget.called)
+        user.is_superuser = True
+        user.save()
+        self.assertEqual(forget.call_count, 1)
+        user = get_user_model().objects.get(pk=user.pk)
+        user.is_superuser = False
+        user.save()
+        self.assertEqual(forget.call_count, 2)
+        user.save()
+        self.assertEqual(forget.call_count, 2)
+
+    def test_new_superusers(self, forget):
+        testing.create_admin()
+        self.assertEqual(forget.call_count, 1)
+
+    def test_users_loaded_without_is_superuser_are_assumed_to_matter(self, forget):
+        pk = testing.create_user().pk
+        user = get_user_model().objects.only('id', 'first_name').get(pk=pk)
+        user.first_name = 'Ada'
+        user.save()
+        self.assertEqual(forget.call_count, 1)
+
+
+class BulkImportTests(TestCase):
+    header = 'username,email,password,role\n'
+
+    def run_import(self, rows, **options):
+        return bulk_import.import_users(
+            (self.header + rows).splitlines(keepends=True), workers=1, notify=False, **options,
+        )
+
+    def errors(self, report):
+        return {error['line']: error['errors'] for error in report['errors']}
+
+    def test_rows_are_validated(self):
+        report = self.run_import(
+            'ann,ann@example.com,Str0ng-pass-1,\n'
+            ',nobody@example.com,,\n'
+            'bob,not-an-email,,\n'
+            'cat,cat@example.com,,admin\n'
+            'dan,dan@example.com,123,\n'
+            'eve,eve@example.com,,lab_owner\n'
+        )
+        self.assertEqual((report['created'], report['skipped']), (2, 4))
+        self.assertEqual(set(self.errors(report)), {3, 4, 5, 6})
+        self.assertIn('username', self.errors(report)[3])
+        self.assertIn('email', self.errors(report)[4])
+        self.assertIn('role', self.errors(report)[5])
+        self.assertIn('password', self.errors(report)[6])
+        users = get_user_model().objects.in_bulk(['ann', 'eve'], field_name='username')
+        self.assertTrue(users['ann'].check_password('Str0ng-pass-1'))
+        self.assertFalse(users['eve'].has_usable_password())
+        self.assertEqual(users['eve'].role, 'lab_owner')
+
+    def test_missing_columns(self):
+        with self.assertRaisesMessage(ValueError, 'email'):
+            bulk_import.import_users(['username\n', 'ann\n'], workers=1, notify=False)
+
+    def test_duplicates_report_the_field_that_collided(self):
+        testing.create_user(username='taken', email='taken@example.com')
+        report = self.run_import(
+            'taken,new@example.com,,\n'
+            'new,taken@example.com,,\n'
+            'ann,ann@example.com,,\n'
+            'ann,other@example.com,,\n'
+            'bob,ann@example.com,,\n',
+            batch_size=2,
+        )
+        self.assertEqual((report['created'], report['skipped']), (1, 4))
+        self.assertEqual(
+            {line: list(errors) for line, errors in self.errors(report).items()},
+            {2: ['username'], 3: ['email'], 5: ['username'], 6: ['email']},
+        )
+
+    def test_names_registered_during_the_import_are_skipped(self):
+        def register_meanwhile(passwords, pool=None):
+            testing.create_user(username='late', email='bob@example.com')
+            return [make_password(password) for password in passwords]
+
+        with mock.patch.object(bulk_import, 'hash_passwords', register_meanwhile):
+            report = self.run_import('ann,ann@example.com,Str0ng-pass-1,\nbob,bob@example.com,Str0ng-pass-2,\n')
+        self.assertEqual(report['created'], 1)
+        self.assertEqual(self.errors(report), {3: {'email': bulk_import.RACED_ERRORS['email']}})
+        self.assertTrue(get_user_model().objects.filter(username='ann').exists())
+
+    def test_counters_follow_the_import(self):
+        testing.create_user()
+        before = UserCounter.objects.totals()
+        self.run_import('ann,ann@example.com,,\nbob,bob@example.com,,lab_owner\n', approval_status='pending')
+        totals = UserCounter.objects.totals()
+        self.assertEqual(totals['total'], before['total'] + 2)
+        self.assertEqual(totals['total'], get_user_model().objects.count())
+        self.assertEqual(totals['approval_status']['pending'], before['approval_status'].get('pending', 0) + 2)
+        self.assertEqual(totals['is_active'][False], before['is_active'][False] + 2)
+        self.assertEqual(UserCounter.objects.reconcile(), {})
+
+
+class BulkImportEndpointTests(TestCase):
+    def setUp(self):
+        self.admin = testing.create_admin()
+        self.client = testing.api_client(self.admin)
+
+    def upload(self, content, **data):
+        file = SimpleUploadedFile('users.csv', content.encode(), content_type='text/csv')
+        return self.client.post(reverse('bulk_import_users'), {'file': file, **data}, format='multipart')
+
+    def test_the_upload_is_queued_and_run_by_the_command(self):
+        response = self.upload('username,email\nann,ann@example.com\n', approval_status='pending')
+        self.assertEqual(response.status_code, 202)
+        self.assertIsNone(response.json()['report'])
+        self.assertFalse(get_user_model().objects.filter(username='ann').exists())
+
+        self.assertEqual(bulk_import.run_pending(workers=1), 1)
+        job = self.client.get(reverse('user_import', args=[response.json()['id']])).json()
+        self.assertEqual(job['report']['created'], 1)
+        self.assertIsNotNone(job['finished_at'])
+        ann = get_user_model().objects.get(username='ann')
+        self.assertEqual(ann.approval_status, 'pending')
+        self.assertEqual(bulk_import.run_pending(workers=1), 0)
+
+    def test_bad_uploads_are_refused_before_queueing(self):
+        self.assertEqual(self.upload('username\nann\n').status_code, 400)
+        self.assertEqual(self.upload('username,email\n', role='admin').status_code, 400)
+        with override_settings(USER_IMPORT_MAX_BYTES=10):
+            self.assertEqual(self.upload('username,email\nann,ann@example.com\n').status_code, 400)
+        self.assertFalse(UserImport.objects.exists())
+
+    def test_admins_only(self):
+        client = testing.api_client(testing.create_user())
+        self.assertEqual(client.post(reverse('bulk_import_users')).status_code, 403)
+
+
+class UserCounterTests(TestCase):
+    """UserCounter must always agree with a real count of the user table"""
+
+    def setUp(self):
+        self.admin = testing.create_admin()
+        self.client = testing.api_client(self.admin)
+
+    def assertCountsMatch(self):
+        actual = {
+            field: dict(get_user_model().objects.order_by().values_list(field).annotate(count=Count('id')))
+            for field in ('role', 'approval_status', 'is_active')
+        }
+        totals = UserCounter.objects.totals()
+        self.assertEqual(totals['total'], get_user_model().objects.count())
+        for field, counts in actual.items():
+            self.assertEqual({key: n for key, n in totals[field].items() if n}, counts, field)
+
+    def test_approve_and_reject(self):
+        pending = [testing.create_user(approval_status='pending', is_active=False) for _ in range(3)]
+        self.assertEqual(self.client.get(reverse('user_counts')).json()['pending'], 3)
+        for user, action in zip(pending, ('approve', 'reject')):
+            response = self.client.patch(reverse('approve_user', args=[user.pk]), {'action': action}, format='json')
+            self.assertEqual(response.status_code, 200)
+        self.assertCountsMatch()
+        counts = self.client.get(reverse('user_counts')).json()
+        self.assertEqual(counts['pending'], 1)
+        self.assertEqual(counts['by_approval_status']['rejected'], 1)
+
+    def test_deactivate_and_change_role(self):
+        user = testing.create_user()
+        user.is_active = False
+        user.save()
+        self.assertCountsMatch()
+        # Loaded without the counted fields, and saved with them
+        user = get_user_model().objects.only('id', 'first_name').get(pk=user.pk)
+        user.role = 'lab_owner'
+        user.save()
+        self.assertCountsMatch()
+        user.first_name = 'Ada'
+        with self.assertNumQueries(1):
+            user.save(update_fields=['first_name'])
+        self.assertCountsMatch()
+
+    def test_delete(self):
+        users = [testing.create_user(), testing.create_user(approval_status='pending', is_active=False)]
+        users[0].delete()
+        self.assertCountsMatch()
+        get_user_model().objects.filter(pk=users[1].pk).delete()
+        self.assertCountsMatch()
+
+    def test_reconcile_repairs_drift(self):
+        testing.create_user(), testing.create_user()
+        # QuerySet.update() skips User.save()
+        get_user_model().objects.filter(role='user').update(is_active=False)
+        self.assertEqual(UserCounter.objects.totals()['is_active'][False], 0)
+
+        fixes = UserCounter.objects.reconcile()
+        self.assertEqual(fixes, {('user', 'approved', True): (2, 0), ('user', 'approved', False): (0, 2)})
+        self.assertCountsMatch()
+        out = StringIO()
+        call_command('reconcile_user_counters', stdout=out)
+        self.assertIn('Counters are correct', out.getvalue())
+
+
+class HomeTests(TransactionTestCase):
+    # The sections load in threads, which must see committed rows
+
+    def setUp(self):
+        cache.clear()
+        self.user = testing.create_user()
+        self.client = testing.api_client(self.user)
+        self.lab_test = testing.create_lab_test()
+        testing.create_appointment(self.user, self.lab_test)
+
+    def home(self, etags=(), **params):
+        headers = {'HTTP_IF_NONE_MATCH': ', '.join(etags)} if etags else {}
+        return self.client.get(reverse('home'), params, **headers)
+
+    def test_sections_and_etags(self):
+        body = self.home().json()
+        self.assertEqual(set(body['etags']), {'profile', 'appointments', 'labs', 'tests'})
+        self.assertEqual(body['not_modified'], [])
+        self.assertEqual(len(body['appointments']), 1)
+        self.assertEqual([lab['id'] for lab in body['labs']], [self.lab_test.lab_id])
+
+    def test_unchanged_sections_are_not_loaded(self):
+        etags = self.home().json()['etags']
+        loaders = {name: mock.Mock(wraps=loader) for name, loader in home_screen._LOADERS.items()}
+        with mock.patch.dict(home_screen._LOADERS, loaders):
+            body = self.home([etags['labs'], etags['appointments']]).json()
+        self.assertEqual(sorted(body['not_modified']), ['appointments', 'labs'])
+        self.assertNotIn('labs', body)
+        self.assertIn('tests', body)
+        self.assertFalse(loaders['labs'].called or loaders['appointments'].called)
+        self.assertTrue(loaders['tests'].called)
+
+    def test_changes_move_the_section_etags(self):
+        etags = self.home().json()['etags']
+        testing.create_lab()
+        testing.create_appointment(self.user, self.lab_test)
+        body = self.home(etags.values()).json()
+        self.assertEqual(sorted(body['not_modified']), ['profile', 'tests'])
+        self.assertEqual(len(body['labs']), 2)
+        self.assertEqual(len(body['appointments']), 2)
+
+        # Offboarding the lab hides its bookings
+        etags = body['etags']
+        self.lab_test.lab.offboard()
+        body = self.home(etags.values()).json()
+        self.assertEqual(body['appointments'], [])
+        self.assertEqual(len(body['labs']), 1)
+
+    def test_not_modified(self):
+        response = self.home()
+        self.assertEqual(self.home([response['ETag']]).status_code, 304)
+        self.assertEqual(self.home([f"W/{response['ETag']}"]).status_code, 304)
+        self.assertEqual(self.home(response.json()['etags'].values()).status_code, 304)
+
+    def test_a_zero_limit_skips_the_section(self):
+        loaders = {name: mock.Mock(wraps=loader) for name, loader in home_screen._LOADERS.items()}
+        with mock.patch.dict(home_screen._LOADERS, loaders):
+            body = self.home(labs=0, tests=0).json()
+        self.assertNotIn('labs', body)
+        self.assertNotIn('labs', body['etags'])
+        self.assertFalse(loaders['labs'].called or loaders['tests'].called)
+        self.assertEqual(len(body['appointments']), 1)
+        self.assertEqual(self.home(appointments=-1).status_code, 400)
+
+
+class AdminDigestTests(TestCase):
+    """send_admin_digest covers each registration in exactly one digest"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.admins = [testing.create_admin(), testing.create_admin()]
+        self.until = timezone.now()
+
+    def register(self, created_at):
+        user = testing.create_user(approval_status='pending')
+        get_user_model().objects.filter(pk=user.pk).update(created_at=created_at)
+        return user
+
+    def send(self, until, *args):
+        out = StringIO()
+        with mock.patch('accounts.management.commands.send_admin_digest.timezone.now', return_value=until):
+            call_command('send_admin_digest', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_each_admin_gets_one_summary(self):
+        users = [self.register(self.until - timedelta(minutes=n)) for n in (1, 2)]
+        self.send(self.until)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), sorted(a.email for a in self.admins))
+        for user in users:
+            self.assertIn(user.username, mail.outbox[0].body)
+        digest = AdminDigest.objects.get()
+        self.assertEqual((digest.covers_until, digest.registrations, digest.recipients), (self.until, 2, 2))
+
+    def test_registrations_are_neither_sent_twice_nor_skipped(self):
+        first = self.register(self.until)
+        second = self.register(self.until + timedelta(microseconds=1))
+        self.send(self.until)
+        self.assertIn(first.username, mail.outbox[0].body)
+        self.assertNotIn(second.username, mail.outbox[0].body)
+
+        mail.outbox = []
+        later = self.until + timedelta(minutes=5)
+        self.send(later)
+        self.assertIn(second.username, mail.outbox[0].body)
+        self.assertNotIn(first.username, mail.outbox[0].body)
+        self.assertEqual(AdminDigest.objects.first().registrations, 1)
+
+        mail.outbox = []
+        self.assertIn('No new registrations', self.send(later + timedelta(minutes=5)))
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(AdminDigest.objects.count(), 2)
+
+    def test_dry_run_sends_and_records_nothing(self):
+        user = self.register(self.until)
+        self.assertIn(user.username, self.send(self.until, '--dry-run'))
+        self.assertEqual(mail.outbox, [])
+        self.assertFalse(AdminDigest.objects.exists())
+
+
+class RegistrationTests(TestCase):
+    def register(self, username):
+        return testing.api_client().post(reverse('user_register'), {
+            'username': username, 'email': f'{username}@example.com',
+            'password': 'a-long-pass-123', 'confirm_password': 'a-long-pass-123',
+        }, format='json')
+
+    def test_admins_are_emailed_per_registration(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        testing.create_admin()
+        with override_settings(ADMIN_NOTIFICATION_MODE='immediate'):
+            self.assertEqual(self.register('ann').status_code, 201)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_digest_mode_skips_the_registration_email(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        testing.create_admin()
+        with override_settings(ADMIN_NOTIFICATION_MODE='digest'):
+            self.assertEqual(self.register('ann').status_code, 201)
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(get_user_model().objects.get(username='ann').approval_status, 'pending')
+
+    def test_a_body_that_is_not_an_object_is_a_validation_error(self):
+        client = testing.api_client()
+        for body in ([{'username': 'ann'}], 'ann'):
+            response = client.post(reverse('user_register'), body, format='json')
+            self.assertEqual(response.status_code, 400)
@@ -0,0 +1,25 @@
+from core.throttling import IPTokenBucketThrottle, UsernameTokenBucketThrottle
+
+
+class RegisterIPThrottle(IPTokenBucketThrottle):
+    scope = 'register'
+
+
+class RegisterUsernameThrottle(UsernameTokenBucketThrottle):
+    scope = 'register_username'
+
+
+class LoginIPThrottle(IPTokenBucketThrottle):
+    scope = 'login'
+
+
+class LoginUsernameThrottle(UsernameTokenBucketThrottle):
+    scope = 'login_username'
+
+
+class ApprovalStatusIPThrottle(IPTokenBucketThrottle):
+    scope = 'approval_status'
+
+
+class ApprovalStatusUsernameThrottle(UsernameTokenBucketThrottle):
+    scope = 'approval_status_username'
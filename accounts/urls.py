@@ -1,14 +1,12 @@
 from django.urls import path
-from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
-    TokenRefreshView,
-)
+from rest_framework_simplejwt.views import TokenRefreshView
+from core.async_views import async_read_view
 from . import views
 from .views import register_user
 
 urlpatterns = [
     # Authentication endpoints
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('token/', views.ThrottledTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 
     # User registration and status
@@ -16,10 +14,15 @@ urlpatterns = [
     path('check-status/<str:username>/', views.check_approval_status, name='check_approval_status'),
 
     # Profile endpoints
-    path('profile/', views.get_user_profile, name='get_user_profile'),
+    path('profile/', async_read_view('get_user_profile', views.AsyncProfileView, views.get_user_profile),
+         name='get_user_profile'),
     path('profile/update/', views.update_user_profile, name='update_user_profile'),
+    path('home/', views.home, name='home'),
 
     # Admin endpoints
     path('pending-users/', views.PendingUsersView.as_view(), name='pending_users'),
+    path('user-counts/', views.user_counts, name='user_counts'),
     path('approve-user/<int:pk>/', views.UserApprovalView.as_view(), name='approve_user'),
+    path('bulk-import/', views.bulk_import_users, name='bulk_import_users'),
+    path('bulk-import/<int:pk>/', views.UserImportView.as_view(), name='user_import'),
 ]
\ No newline at end of file
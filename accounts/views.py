@@ -1,15 +1,31 @@
 from rest_framework import status, generics
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, parser_classes, permission_classes, throttle_classes
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from core.async_views import AsyncReadView
+from core.concurrency import PreconditionFailed, etag_for, expected_version, parse_etags
+from core.idempotency import idempotent
+from core.models import VersionConflict
+from . import home as home_screen
+from .bulk_import import queue_import
+from .models import UserCounter, UserImport
+from .notifications import pending_users
+from .throttles import (
+    ApprovalStatusIPThrottle, ApprovalStatusUsernameThrottle, LoginIPThrottle,
+    LoginUsernameThrottle, RegisterIPThrottle, RegisterUsernameThrottle,
+)
 from .serializers import (
     UserRegistrationSerializer,
     UserSerializer,
     PendingUserSerializer,
     UserApprovalSerializer,
-    UserProfileSerializer  # Add this new serializer
+    UserProfileSerializer,  # Add this new serializer
+    UserImportSerializer,
 )
 import logging
 
@@ -19,17 +35,21 @@ User = get_user_model()
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([RegisterIPThrottle, RegisterUsernameThrottle])
+@idempotent
 def register_user(request):
     """
     Register a new user (pending approval)
     """
-    logger.info(f"Registration attempt with data: {request.data}")
+    # Never log request.data as a whole: it carries the plain-text password
+    username = request.data.get('username') if isinstance(request.data, dict) else None
+    logger.info('Registration attempt for username=%s', username)
 
     serializer = UserRegistrationSerializer(data=request.data)
     if serializer.is_valid():
         try:
             user = serializer.save()
-            logger.info(f"User created successfully: {user.username} (pending approval)")
+            logger.info('User created successfully: %s (pending approval)', user.username)
 
             return Response({
                 'message': 'Registration successful! Your account is pending approval.',
@@ -37,13 +57,13 @@ def register_user(request):
                 'status': 'pending_approval'
             }, status=status.HTTP_201_CREATED)
 
-        except Exception as e:
-            logger.error(f"Error creating user: {str(e)}")
+        except Exception:
+            logger.exception('Error creating user')
             return Response({
                 'error': 'Failed to create user account'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    logger.error(f"Validation errors: {serializer.errors}")
+    logger.warning('Registration validation failed', extra={'errors': serializer.errors})
     return Response({
         'errors': serializer.errors,
         'detail': 'Validation failed'
@@ -52,6 +72,7 @@ def register_user(request):
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@throttle_classes([ApprovalStatusIPThrottle, ApprovalStatusUsernameThrottle])
 def check_approval_status(request, username):
     """
     Check if a user's account is approved
@@ -77,45 +98,150 @@ def get_user_profile(request):
     """
     try:
         serializer = UserProfileSerializer(request.user)
-        return Response(serializer.data, status=status.HTTP_200_OK)
-    except Exception as e:
-        logger.error(f"Error fetching user profile: {str(e)}")
+        return Response(serializer.data, status=status.HTTP_200_OK, headers={'ETag': etag_for(request.user)})
+    except Exception:
+        logger.exception('Error fetching user profile')
         return Response({
             'error': 'Failed to fetch user profile'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def home(request):
+    """
+    Everything the home screen needs in one response: profile, upcoming
+    appointments, labs and popular tests (see accounts.home). Limit the
+    lists with ?appointments=, ?labs= and ?tests= (0 leaves one out). Send
+    the section ETags from `etags` back in If-None-Match; unchanged
+    sections are omitted and listed in `not_modified`, and if nothing
+    changed the response is a 304.
+    """
+    limits = home_screen.section_limits(request.query_params)
+    etags = home_screen.section_etags(request.user, limits)
+    combined = home_screen.combined_etag(etags)
+    known = set(parse_etags(request.headers.get('If-None-Match')))
+    not_modified = [name for name, etag in etags.items() if etag in known]
+    if combined in known or len(not_modified) == len(etags):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': combined})
+    data = home_screen.build(request.user, limits, skip=not_modified)
+    return Response({**data, 'etags': etags, 'not_modified': not_modified}, headers={'ETag': combined})
+
+
+class AsyncProfileView(AsyncReadView):
+    """
+    Async read path for get_user_profile (see core.async_views)
+    """
+
+    async def get(self, request):
+        return self.render(UserProfileSerializer(request.user).data, {'ETag': etag_for(request.user)})
+
+
 @api_view(['PUT', 'PATCH'])
 @permission_classes([IsAuthenticated])
 def update_user_profile(request):
     """
     Update current user's profile
+
+    Honours If-Match with the ETag from get_user_profile, answering 412 when
+    the profile was changed elsewhere in the meantime.
     """
     try:
+        user = request.user
+        user._expected_version = expected_version(request, user)
         serializer = UserProfileSerializer(
-            request.user,
+            user,
             data=request.data,
             partial=request.method == 'PATCH'
         )
 
         if serializer.is_valid():
-            serializer.save()
+            try:
+                serializer.save()
+            except VersionConflict:
+                raise PreconditionFailed()
             return Response({
                 'message': 'Profile updated successfully',
                 'user': serializer.data
-            }, status=status.HTTP_200_OK)
+            }, status=status.HTTP_200_OK, headers={'ETag': etag_for(user)})
 
         return Response({
             'errors': serializer.errors
         }, status=status.HTTP_400_BAD_REQUEST)
 
-    except Exception as e:
-        logger.error(f"Error updating user profile: {str(e)}")
+    except PreconditionFailed:
+        raise
+    except Exception:
+        logger.exception('Error updating user profile')
         return Response({
             'error': 'Failed to update user profile'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+@parser_classes([MultiPartParser])
+def bulk_import_users(request):
+    """
+    Queue an uploaded CSV (multipart field `file`) for import, see
+    accounts.bulk_import for the columns. Optional fields: `role` for rows
+    without one and `approval_status` ('approved' or 'pending'). The
+    run_user_imports command does the work; poll the returned job for the
+    report.
+    """
+    upload = request.FILES.get('file')
+    if upload is None:
+        return Response({'error': 'Upload the CSV as the "file" field'}, status=status.HTTP_400_BAD_REQUEST)
+    if upload.size > settings.USER_IMPORT_MAX_BYTES:
+        return Response(
+            {'error': f'The CSV may be at most {settings.USER_IMPORT_MAX_BYTES} bytes; use the import_users command'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    try:
+        job = queue_import(
+            upload.read().decode('utf-8-sig'),
+            role=request.data.get('role', 'user'),
+            approval_status=request.data.get('approval_status', 'approved'),
+            requested_by=request.user,
+        )
+    except (ValueError, UnicodeDecodeError) as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    logger.info('Bulk import %s queued by %s', job.pk, request.user.username)
+    return Response(UserImportSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class UserImportView(generics.RetrieveAPIView):
+    """A queued bulk import; `report` is set once it has run (admin only)"""
+    queryset = UserImport.objects.all()
+    serializer_class = UserImportSerializer
+    permission_classes = [IsAdminUser]
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def user_counts(request):
+    """
+    User counts by role, approval status and active flag (admin only), read
+    from UserCounter; `pending` is the approvals badge.
+    """
+    totals = UserCounter.objects.totals()
+    return Response({
+        'total': totals['total'],
+        'pending': totals['approval_status'].get('pending', 0),
+        'by_role': totals['role'],
+        'by_approval_status': totals['approval_status'],
+        'active': totals['is_active'][True],
+        'inactive': totals['is_active'][False],
+    })
+
+
+class ThrottledTokenObtainPairView(TokenObtainPairView):
+    """
+    Obtain a JWT pair, rate limited per client address and per username
+    """
+    throttle_classes = [LoginIPThrottle, LoginUsernameThrottle]
+
+
 class PendingUsersView(generics.ListAPIView):
     """
     List all pending users (admin only)
@@ -124,7 +250,7 @@ class PendingUsersView(generics.ListAPIView):
     permission_classes = [IsAdminUser]
 
     def get_queryset(self):
-        return User.objects.filter(approval_status='pending').order_by('-created_at')
+        return pending_users()
 
 
 class UserApprovalView(generics.UpdateAPIView):
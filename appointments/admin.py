@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Appointment
+from .models import Appointment, AppointmentSeries, WaitlistEntry
 
 @admin.register(Appointment)
 class AppointmentAdmin(admin.ModelAdmin):
@@ -7,3 +7,19 @@ class AppointmentAdmin(admin.ModelAdmin):
     list_filter = ('status', 'appointment_time')
     search_fields = ('user__username', 'lab_test__test__name')
 
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'lab_test', 'day', 'window_start', 'window_end', 'priority', 'status', 'created_at')
+    list_filter = ('status', 'day')
+    search_fields = ('user__username', 'lab_test__test__name')
+    raw_id_fields = ('user', 'lab_test', 'appointment')
+
+
+@admin.register(AppointmentSeries)
+class AppointmentSeriesAdmin(admin.ModelAdmin):
+    list_display = ('user', 'lab_test', 'start', 'interval_days', 'count', 'materialized', 'next_at', 'status')
+    list_filter = ('status',)
+    search_fields = ('user__username', 'lab_test__test__name')
+    raw_id_fields = ('user', 'lab_test')
+    readonly_fields = ('materialized', 'next_at', 'created_at', 'updated_at')
@@ -0,0 +1,262 @@
+"""
+Demand analytics for a laboratory: weekday x hour heatmaps, utilization
+and busy hours per lab test, and moving-average forecasts.
+
+The appointments are read as integer columns (start time as epoch
+seconds, computed by the database, lab test id and a cancelled flag),
+fetched in chunks of settings.ANALYTICS_CHUNK_SIZE rows, so no model
+instances or datetime objects are built per row. Everything after that
+is NumPy: each row gets a flat cell index and np.bincount counts all the
+cells in one pass.
+
+Chunking bounds the round trips, not the memory: the chunks are joined
+into whole-window arrays, 24 bytes per appointment (twice that while
+concatenating) plus a few temporaries of the same size, so a million
+appointments take some 100 MB at peak. The window is capped by ?since=
+and settings.ANALYTICS_DEFAULT_DAYS; a much larger history would need
+the bincounts accumulated chunk by chunk instead.
+
+Times are bucketed in the current time zone with one UTC offset per day;
+only on the days a DST change happens are offsets worked out per quarter
+hour.
+
+Results are cached under ical.lab_state(), which moves whenever one of
+the lab's appointments changes.
+"""
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import BigIntegerField, Case, Count, Func, IntegerField, Max, Value, When
+from django.utils import timezone
+
+from labs.models import LabTest
+from .ical import lab_state
+from .models import Appointment
+
+HOURS = 24
+DAYS = 7
+CELLS = DAYS * HOURS
+QUARTER = 15 * 60
+DAY = 24 * 60 * 60
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class EpochSeconds(Func):
+    """Seconds since 1970-01-01 UTC of a datetime column"""
+    output_field = BigIntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # julianday() rather than strftime('%s'), whose % the backend would
+        # take for a placeholder; rounded because the product is a float
+        template = 'CAST(ROUND((julianday(%(expressions)s) - 2440587.5) * 86400) AS INTEGER)'
+        return self.as_sql(compiler, connection, template=template, **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='CAST(EXTRACT(EPOCH FROM %(expressions)s) AS BIGINT)', **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='UNIX_TIMESTAMP(%(expressions)s)', **extra_context)
+
+
+def columns(queryset, chunk_size=None):
+    """
+    (epochs, lab_test_ids, cancelled) arrays for the appointments in
+    queryset; the whole result is held in memory
+    """
+    chunk_size = chunk_size or settings.ANALYTICS_CHUNK_SIZE
+    values = queryset.order_by().values_list(
+        EpochSeconds('appointment_time'),
+        'lab_test_id',
+        Case(When(status='cancelled', then=Value(1)), default=Value(0), output_field=IntegerField()),
+    )
+    # Straight from the cursor: the columns are plain integers, so the
+    # per-row work of ValuesListIterable buys nothing but time
+    sql, params = values.query.get_compiler(using=values.db).as_sql()
+    chunks = []
+    with connections[values.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.int64))
+    if not chunks:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, bool)
+    data = np.concatenate(chunks)
+    return data[:, 0], data[:, 1], data[:, 2].astype(bool)
+
+
+def utc_offsets(epochs):
+    """Seconds to add to each epoch for local time in the current time zone"""
+    tz = timezone.get_current_timezone()
+    if not len(epochs):
+        return np.zeros(0, np.int64)
+    days = epochs // DAY
+    first = int(days.min())
+    # Offsets at the start of every day in range, plus the day after the last
+    day_offsets = np.array([
+        int(datetime.fromtimestamp(day * DAY, tz).utcoffset().total_seconds())
+        for day in range(first, int(days.max()) + 2)
+    ], dtype=np.int64)
+    offsets = day_offsets[days - first]
+    # On the few days with a DST change, convert per distinct quarter hour
+    changed = np.flatnonzero(day_offsets[1:] != day_offsets[:-1]) + first
+    moving = np.isin(days, changed)
+    if moving.any():
+        quarters, inverse = np.unique(epochs[moving] // QUARTER, return_inverse=True)
+        exact = np.array([
+            int(datetime.fromtimestamp(quarter * QUARTER, tz).utcoffset().total_seconds())
+            for quarter in quarters.tolist()
+        ], dtype=np.int64)
+        offsets[moving] = exact[inverse]
+    return offsets
+
+
+def local_cells(epochs, first_monday):
+    """(weekday * 24 + hour, week number since first_monday) of each epoch, in local time"""
+    local = epochs + utc_offsets(epochs)
+    days = local // DAY
+    # 1970-01-01 was a Thursday
+    cell = (days + 3) % DAYS * HOURS + local % DAY // 3600
+    week = (days + EPOCH_ORDINAL - first_monday) // 7
+    return cell, week
+
+
+def _matrix(flat, decimals=None):
+    if decimals is not None:
+        flat = np.round(flat, decimals)
+    return flat.reshape(DAYS, HOURS).tolist()
+
+
+def analyze(lab, since, until, weeks=None, capacity=None):
+    """
+    Heatmaps, utilization and forecasts for lab's appointments starting in
+    [since, until). `capacity` is how many appointments of one lab test can
+    run at the same time; `weeks` is the moving-average window.
+    """
+    weeks = weeks or settings.ANALYTICS_FORECAST_WEEKS
+    capacity = capacity or settings.ANALYTICS_DEFAULT_CAPACITY
+    tests = list(
+        LabTest.objects.filter(lab_id=lab.pk).order_by('id')
+        .values_list('id', 'test__name', 'test__duration_minutes')
+    )
+    test_ids = np.array([pk for pk, _, _ in tests], dtype=np.int64)
+    durations = np.array([minutes for _, _, minutes in tests], dtype=np.float64)
+
+    epochs, lab_test_ids, cancelled = columns(
+        Appointment.objects.for_lab(lab.pk).filter(appointment_time__gte=since, appointment_time__lt=until)
+    )
+    index = np.searchsorted(test_ids, lab_test_ids)
+    known = index < len(test_ids)
+    known[known] = test_ids[index[known]] == lab_test_ids[known]
+    epochs, index, cancelled = epochs[known], index[known], cancelled[known]
+
+    start, end = timezone.localtime(since), timezone.localtime(until)
+    first_monday = start.toordinal() - start.weekday()
+    cell, week = local_cells(epochs, first_monday)
+    week_count = (timezone.localtime(until - timedelta(microseconds=1)).toordinal() - first_monday) // 7 + 1
+    # Weeks wholly inside [since, until), which the forecast is based on
+    first_full = 0 if start == start.replace(hour=0, minute=0, second=0, microsecond=0) and not start.weekday() else 1
+    complete = (end.toordinal() - first_monday) // 7
+    window = max(min(weeks, complete - first_full), 0)
+
+    booked = ~cancelled
+    occupancy = np.bincount(index[booked] * CELLS + cell[booked], minlength=len(tests) * CELLS).reshape(len(tests), CELLS)
+    cancellations = np.bincount(index[cancelled], minlength=len(tests))
+    weekly = np.bincount(index[booked] * week_count + week[booked], minlength=len(tests) * week_count).reshape(len(tests), week_count)
+
+    # Minutes each lab test could run per cell over the period: every
+    # quarter hour of [since, until) adds 15 minutes times capacity
+    grid = np.arange(-(-int(since.timestamp()) // QUARTER), -(-int(until.timestamp()) // QUARTER), dtype=np.int64) * QUARTER
+    grid_cells, _ = local_cells(grid, first_monday)
+    available = np.bincount(grid_cells, minlength=CELLS) * 15.0 * capacity
+    booked_minutes = occupancy * durations[:, None]
+    utilization = np.divide(booked_minutes, available, out=np.zeros_like(booked_minutes), where=available > 0)
+
+    # The forecast for next week is the average of the last `window`
+    # complete weeks, cell by cell
+    recent = booked & (week >= complete - window) & (week < complete)
+    forecast = np.bincount(index[recent] * CELLS + cell[recent], minlength=len(tests) * CELLS).reshape(len(tests), CELLS)
+    forecast = forecast / window if window else forecast.astype(np.float64)
+
+    week_starts = [
+        datetime.fromordinal(first_monday + 7 * i).date().isoformat() for i in range(week_count)
+    ]
+    results = []
+    for i, (pk, name, minutes) in enumerate(tests):
+        # moving[k] is the average of the `window` complete weeks ending at week first_full + window - 1 + k
+        moving = np.convolve(weekly[i, first_full:complete], np.ones(window) / window, mode='valid') if window else ()
+        order = np.argsort(utilization[i], kind='stable')[::-1][:settings.ANALYTICS_BUSIEST_HOURS]
+        results.append({
+            'lab_test': pk,
+            'test': name,
+            'duration_minutes': minutes,
+            'appointments': int(occupancy[i].sum()),
+            'cancelled': int(cancellations[i]),
+            'utilization': round(float(booked_minutes[i].sum() / available.sum()), 4) if available.any() else 0.0,
+            'occupancy': _matrix(occupancy[i]),
+            'utilization_by_hour': _matrix(utilization[i], 4),
+            'busiest_hours': [
+                {
+                    'weekday': int(c // HOURS), 'hour': int(c % HOURS),
+                    'appointments': int(occupancy[i, c]), 'utilization': round(float(utilization[i, c]), 4),
+                }
+                for c in order if occupancy[i, c]
+            ],
+            'weekly': [
+                {
+                    'week': week_starts[w],
+                    'appointments': int(weekly[i, w]),
+                    'moving_average': (
+                        round(float(moving[w - first_full - window + 1]), 2)
+                        if window and first_full + window - 1 <= w < complete else None
+                    ),
+                }
+                for w in range(week_count)
+            ],
+            'forecast_next_week': round(float(forecast[i].sum()), 2),
+            'forecast_by_hour': _matrix(forecast[i], 2),
+        })
+
+    return {
+        'lab': lab.pk,
+        'since': since,
+        'until': until,
+        'timezone': timezone.get_current_timezone_name(),
+        'capacity': capacity,
+        'forecast_weeks': window,
+        'appointments': int(occupancy.sum()),
+        'occupancy': _matrix(occupancy.sum(axis=0)),
+        'tests': results,
+    }
+
+
+def _catalog_state(lab):
+    """Changes whenever the lab's lab tests, or their tests, are added, changed or deleted"""
+    state = LabTest.objects.filter(lab_id=lab.pk).aggregate(
+        count=Count('id'), lab_tests=Max('updated_at'), tests=Max('test__updated_at'),
+    )
+    stamps = [state[name].timestamp() if state[name] else 0 for name in ('lab_tests', 'tests')]
+    return f"{state['count']}-{stamps[0]}-{stamps[1]}"
+
+
+def cached_analysis(lab, since, until, weeks=None, capacity=None):
+    # Lab test names and durations come from the catalog, so it is part of the key too
+    key = (
+        f'analytics:{lab_state(lab)}:{_catalog_state(lab)}:'
+        f'{since.timestamp()}:{until.timestamp()}:{weeks}:{capacity}'
+    )
+    result = cache.get(key)
+    if result is None:
+        result = analyze(lab, since, until, weeks, capacity)
+        cache.set(key, result, settings.ANALYTICS_CACHE_TIMEOUT)
+    return result
+
+
+def default_window():
+    """The last settings.ANALYTICS_DEFAULT_DAYS, up to the start of today"""
+    until = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    return until - timedelta(days=settings.ANALYTICS_DEFAULT_DAYS), until
@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class AppointmentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'appointments'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_migrate, post_save
+        from labs.models import LabTest
+        from . import signals
+
+        post_migrate.connect(signals.reserve_shard_ids, sender=self)
+        post_save.connect(signals.forget_lab_test, sender=LabTest)
+        post_delete.connect(signals.delete_sharded_appointments, sender=LabTest)
+        post_delete.connect(signals.delete_sharded_appointments, sender=settings.AUTH_USER_MODEL)
+        post_delete.connect(signals.log_deleted_appointment, sender=self.get_model('Appointment'))
@@ -0,0 +1,162 @@
+"""
+Cursor-based consumption of the AppointmentEvent log.
+
+Integrations pass back the cursor of their previous response and get the
+events recorded since, oldest first, so each sync costs what changed
+instead of a full listing. The cursor is the last event id seen; with
+appointment shards it is one id per database joined by dots (each shard
+logs its appointments' events in the same transaction as the change, so
+ids only increase per database). Treat it as opaque.
+
+A cursor only works if ids are handed out in commit order, or an event
+that commits after a later id has been read is skipped. SQLite lets one
+writer at a time in, so there it holds. Other databases allocate ids
+before commit, so on them read() leaves out events younger than
+settings.APPOINTMENT_EVENTS_SETTLE_DELAY, which covers any transaction
+shorter than that.
+
+?wait= long-polls. The async view can wait up to
+settings.APPOINTMENT_EVENTS_MAX_WAIT; the sync view holds a worker thread
+while it waits, so it waits at most APPOINTMENT_EVENTS_SYNC_MAX_WAIT.
+
+Events older than settings.APPOINTMENT_EVENT_RETENTION are removed by the
+compact_appointment_events command; consumers must sync more often than
+that.
+"""
+import asyncio
+import heapq
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.models import Max
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.exceptions import PermissionDenied, ValidationError
+
+from core.projections import get_projection
+from labs.models import Laboratory
+from . import sharding
+from .models import AppointmentEvent
+
+
+class AppointmentEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AppointmentEvent
+        fields = (
+            'id', 'type', 'appointment_id', 'lab_id', 'lab_test_id', 'user_id',
+            'status', 'previous_status', 'appointment_time', 'created_at',
+        )
+
+
+def format_cursor(positions):
+    return '.'.join(str(position) for position in positions)
+
+
+def latest_cursor():
+    return [
+        AppointmentEvent.objects.using(alias).aggregate(last=Max('id'))['last'] or 0
+        for alias in sharding.all_aliases()
+    ]
+
+
+def parse_cursor(value):
+    """Per-database positions for a cursor; empty means from the start"""
+    count = len(sharding.all_aliases())
+    if not value:
+        return [0] * count
+    if value == 'latest':
+        return latest_cursor()
+    try:
+        positions = [int(part) for part in value.split('.')]
+    except ValueError:
+        raise ValidationError({'cursor': 'Invalid cursor.'})
+    if len(positions) > count or min(positions) < 0:
+        raise ValidationError({'cursor': 'Invalid cursor.'})
+    # Shards added since the cursor was issued start from their beginning
+    return positions + [0] * (count - len(positions))
+
+
+def lab_scope(user, lab):
+    """Lab ids the user may read events for (None for all), narrowed to ?lab="""
+    if lab is not None:
+        try:
+            lab = int(lab)
+        except ValueError:
+            raise ValidationError({'lab': 'Enter a laboratory id.'})
+    if user.is_admin:
+        return None if lab is None else [lab]
+    if user.role != 'lab_owner':
+        raise PermissionDenied('Only laboratory owners and admins can read appointment events.')
+    owned = list(Laboratory.objects.filter(owner=user).values_list('id', flat=True))
+    if lab is None:
+        return owned
+    if lab not in owned:
+        raise PermissionDenied('You do not own this laboratory.')
+    return [lab]
+
+
+def parse_request(request):
+    """(positions, lab_ids, limit, wait) from the query parameters"""
+    params = request.query_params if hasattr(request, 'query_params') else request.GET
+    try:
+        limit = min(int(params.get('limit', settings.APPOINTMENT_EVENTS_PAGE_SIZE)), settings.APPOINTMENT_EVENTS_MAX_PAGE_SIZE)
+        wait = min(float(params.get('wait', 0)), settings.APPOINTMENT_EVENTS_MAX_WAIT)
+    except ValueError:
+        raise ValidationError('limit and wait must be numbers.')
+    if limit < 1 or wait < 0:
+        raise ValidationError('limit must be positive and wait cannot be negative.')
+    return parse_cursor(params.get('cursor')), lab_scope(request.user, params.get('lab')), limit, wait
+
+
+def read(positions, lab_ids=None, limit=100):
+    """Up to `limit` events after positions, oldest first, and the next cursor"""
+    projection = get_projection(AppointmentEventSerializer)
+    id_index, created_index = projection.fields.index('id'), projection.fields.index('created_at')
+    parts = []
+    for index, alias in enumerate(sharding.all_aliases()):
+        queryset = AppointmentEvent.objects.using(alias).filter(id__gt=positions[index])
+        if lab_ids is not None:
+            queryset = queryset.filter(lab_id__in=lab_ids)
+        if connections[alias].vendor != 'sqlite':
+            # Ids are not in commit order here; let in-flight transactions land
+            queryset = queryset.filter(created_at__lte=timezone.now() - settings.APPOINTMENT_EVENTS_SETTLE_DELAY)
+        rows = projection.values(queryset.order_by('id'))[:limit]
+        parts.append([(index, row) for row in rows])
+
+    positions = list(positions)
+    events = []
+    merged = heapq.merge(*parts, key=lambda item: (item[1][created_index], item[0], item[1][id_index]))
+    for index, row in merged:
+        if len(events) == limit:
+            break
+        positions[index] = row[id_index]
+        events.append(row)
+    return {'events': projection.data(events), 'cursor': format_cursor(positions)}
+
+
+def wait_for(positions, lab_ids, limit, wait):
+    """
+    read(), polling until there is something new for up to `wait` seconds,
+    capped at settings.APPOINTMENT_EVENTS_SYNC_MAX_WAIT
+    """
+    deadline = time.monotonic() + min(wait, settings.APPOINTMENT_EVENTS_SYNC_MAX_WAIT)
+    while True:
+        page = read(positions, lab_ids, limit)
+        remaining = deadline - time.monotonic()
+        if page['events'] or remaining <= 0:
+            return page
+        time.sleep(min(settings.APPOINTMENT_EVENTS_POLL_INTERVAL, remaining))
+
+
+async def await_for(positions, lab_ids, limit, wait):
+    """wait_for() without holding a thread between polls"""
+    deadline = time.monotonic() + wait
+    async_read = sync_to_async(read)
+    while True:
+        page = await async_read(positions, lab_ids, limit)
+        remaining = deadline - time.monotonic()
+        if page['events'] or remaining <= 0:
+            return page
+        await asyncio.sleep(min(settings.APPOINTMENT_EVENTS_POLL_INTERVAL, remaining))
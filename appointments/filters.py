@@ -0,0 +1,74 @@
+from datetime import datetime, time
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from .models import Appointment
+from .sharding import lab_test_ids
+
+
+def parse_boundary(value, name, end=False):
+    """
+    Parse a date or datetime query parameter into an aware datetime. A bare
+    date means the start of that day, or the end of it for upper bounds.
+    """
+    try:
+        # Dates first: parse_datetime() also accepts a bare date (as midnight)
+        day = parse_date(value)
+        if day is not None:
+            parsed = datetime.combine(day, time.max if end else time.min)
+        else:
+            parsed = parse_datetime(value)
+            if parsed is None:
+                raise ValueError
+    except ValueError:
+        raise ValidationError({name: 'Enter a valid date or datetime.'})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def parse_ids(value, name):
+    try:
+        return [int(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        raise ValidationError({name: 'Enter a comma separated list of ids.'})
+
+
+class AppointmentFilterBackend(BaseFilterBackend):
+    """
+    Server-side filters for appointment lists:
+
+        ?date_from=2025-06-01&date_to=2025-06-30
+        ?status=booked,rescheduled
+        ?lab=3  ?test=7  ?lab_test=12
+
+    Every filter narrows a range scan on one of the composite
+    (…, appointment_time) indexes declared on Appointment.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+
+        if params.get('date_from'):
+            queryset = queryset.filter(appointment_time__gte=parse_boundary(params['date_from'], 'date_from'))
+        if params.get('date_to'):
+            queryset = queryset.filter(appointment_time__lte=parse_boundary(params['date_to'], 'date_to', end=True))
+
+        if params.get('status'):
+            statuses = [s for s in params['status'].split(',') if s]
+            valid = {choice for choice, _ in Appointment.STATUS_CHOICES}
+            if not set(statuses) <= valid:
+                raise ValidationError({'status': f"Choose from {', '.join(sorted(valid))}."})
+            queryset = queryset.filter(status__in=statuses)
+
+        if params.get('lab'):
+            queryset = queryset.filter(lab_test_id__in=lab_test_ids(lab_id__in=parse_ids(params['lab'], 'lab')))
+        if params.get('test'):
+            queryset = queryset.filter(lab_test_id__in=lab_test_ids(test_id__in=parse_ids(params['test'], 'test')))
+        if params.get('lab_test'):
+            queryset = queryset.filter(lab_test_id__in=parse_ids(params['lab_test'], 'lab_test'))
+
+        return queryset
@@ -0,0 +1,171 @@
+"""
+iCalendar feeds and incremental sync of a laboratory's appointments.
+
+The feed is rebuilt only when the lab's state changes: its ETag combines the
+lab's latest Appointment.updated_at and latest AppointmentEvent id (which
+moves on deletes too), both read from the ends of indexes, and the rendered
+calendar is cached under that ETag. Calendar apps that poll with
+If-None-Match get a 304 without any appointment rows being read.
+
+The sync API returns the appointments whose updated_at is after the token,
+plus the ids deleted since, so polling costs the number of changes. Tokens
+step back settings.CALENDAR_SYNC_OVERLAP from the time of the request to
+cover transactions that committed late; clients upsert by id, so repeats
+are harmless.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signing import Signer
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from rest_framework.exceptions import ValidationError
+
+from core.projections import get_projection
+from labs.models import LabTest
+from . import sharding
+from .models import Appointment, AppointmentEvent
+from .serializers import AppointmentSerializer
+
+PRODID = '-//Lab Appointment System//Appointments//EN'
+_signer = Signer(salt='appointments.ical')
+
+
+class TokenExpired(Exception):
+    """The sync token predates the retained deletion events"""
+
+
+def feed_key(lab):
+    """Secret for the subscription URL; changes if the lab changes owner"""
+    return _signer.signature(f'{lab.pk}:{lab.owner_id}')
+
+
+def valid_feed_key(lab, key):
+    return constant_time_compare(key, feed_key(lab))
+
+
+def lab_state(lab):
+    """
+    Changes whenever one of the lab's appointments is written or deleted,
+    and daily. Anything derived from the lab's appointments can be cached
+    under it.
+    """
+    alias = sharding.shard_for_lab(lab.pk)
+    last_change = Appointment.objects.for_lab(lab.pk).aggregate(last=Max('updated_at'))['last']
+    last_event = AppointmentEvent.objects.using(alias).filter(lab_id=lab.pk).aggregate(last=Max('id'))['last']
+    stamp = make_token(last_change) if last_change else 0
+    # Windows relative to today slide daily, so the date is part of the state
+    return f'{lab.pk}-{timezone.localdate():%Y%m%d}-{stamp}-{last_event or 0}'
+
+
+def feed_etag(lab):
+    return f'"cal-{lab_state(lab)}"'
+
+
+def _window(lab):
+    since = timezone.now() - timedelta(days=settings.CALENDAR_FEED_PAST_DAYS)
+    return Appointment.objects.for_lab(lab.pk).filter(appointment_time__gte=since)
+
+
+def _escape(text):
+    return (
+        str(text).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+    )
+
+
+def _fold(line):
+    """Fold content lines at 75 octets (RFC 5545, 3.1)"""
+    data = line.encode()
+    if len(data) <= 75:
+        return line
+    parts, start = [], 0
+    while start < len(data):
+        end = min(start + (75 if not parts else 74), len(data))
+        # Never split a UTF-8 sequence
+        while end < len(data) and (data[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(data[start:end].decode())
+        start = end
+    return '\r\n '.join(parts)
+
+
+def _utc(value):
+    return value.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def render_feed(lab):
+    tests = {
+        lab_test_id: (name, minutes)
+        for lab_test_id, name, minutes in LabTest.objects.filter(lab_id=lab.pk)
+        .values_list('id', 'test__name', 'test__duration_minutes')
+    }
+    rows = _window(lab).order_by('appointment_time', 'id').values_list(
+        'id', 'lab_test_id', 'appointment_time', 'status', 'version', 'updated_at',
+    )
+    lines = [
+        'BEGIN:VCALENDAR', 'VERSION:2.0', f'PRODID:{PRODID}', 'CALSCALE:GREGORIAN',
+        f'X-WR-CALNAME:{_escape(lab.name)}',
+    ]
+    for pk, lab_test_id, start, status, version, updated_at in rows.iterator(chunk_size=2000):
+        name, minutes = tests.get(lab_test_id, ('Lab test', 30))
+        lines += [
+            'BEGIN:VEVENT',
+            f'UID:appointment-{pk}@{settings.CALENDAR_UID_DOMAIN}',
+            f'DTSTAMP:{_utc(updated_at)}',
+            f'LAST-MODIFIED:{_utc(updated_at)}',
+            f'SEQUENCE:{version}',
+            f'DTSTART:{_utc(start)}',
+            f'DTEND:{_utc(start + timedelta(minutes=minutes))}',
+            f'SUMMARY:{_escape(name)} (booking #{pk})',
+            f"STATUS:{'CANCELLED' if status == 'cancelled' else 'CONFIRMED'}",
+            'END:VEVENT',
+        ]
+    lines.append('END:VCALENDAR')
+    return ''.join(_fold(line) + '\r\n' for line in lines)
+
+
+def cached_feed(lab, etag):
+    key = f'ical:{lab.pk}:{etag}'
+    body = cache.get(key)
+    if body is None:
+        body = render_feed(lab)
+        cache.set(key, body, settings.CALENDAR_FEED_CACHE_TIMEOUT)
+    return body
+
+
+def make_token(moment):
+    return str(int(moment.timestamp() * 1_000_000))
+
+
+def parse_token(token):
+    try:
+        since = datetime.fromtimestamp(int(token) / 1_000_000, tz=dt_timezone.utc)
+    except (TypeError, ValueError, OverflowError, OSError):
+        raise ValidationError({'token': 'Invalid sync token.'})
+    if since < timezone.now() - settings.APPOINTMENT_EVENT_RETENTION:
+        raise TokenExpired()
+    return since
+
+
+def sync(lab, token=None):
+    """Appointments changed since token (all in the feed window without one)"""
+    started = timezone.now()
+    projection = get_projection(AppointmentSerializer)
+    if token:
+        since = parse_token(token)
+        changed = Appointment.objects.for_lab(lab.pk).filter(updated_at__gt=since)
+        deleted = list(
+            AppointmentEvent.objects.using(sharding.shard_for_lab(lab.pk))
+            .filter(lab_id=lab.pk, type='deleted', created_at__gt=since)
+            .order_by('id').values_list('appointment_id', flat=True)
+        )
+    else:
+        changed, deleted = _window(lab), []
+    return {
+        'appointments': projection.serialize(changed.order_by('updated_at', 'id')),
+        'deleted': deleted,
+        'token': make_token(started - settings.CALENDAR_SYNC_OVERLAP),
+    }
@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from appointments import sharding
+from appointments.models import AppointmentEvent
+
+
+class Command(BaseCommand):
+    help = 'Delete appointment events older than the retention period, in batches, on every database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=None, metavar='DAYS',
+                            help='Retention in days (default settings.APPOINTMENT_EVENT_RETENTION)')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        retention = settings.APPOINTMENT_EVENT_RETENTION
+        if options['older_than'] is not None:
+            retention = timedelta(days=options['older_than'])
+        cutoff = timezone.now() - retention
+
+        total = 0
+        for alias in sharding.all_aliases():
+            events = AppointmentEvent.objects.using(alias)
+            # Ids grow with time, so everything up to the newest expired id goes
+            last = events.filter(created_at__lt=cutoff).order_by('-id').values_list('id', flat=True).first()
+            while last is not None:
+                ids = list(events.filter(id__lte=last).order_by('id').values_list('id', flat=True)[:options['batch_size']])
+                if not ids:
+                    break
+                events.filter(id__in=ids).delete()
+                total += len(ids)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {total} appointment events older than {cutoff:%Y-%m-%d %H:%M}'))
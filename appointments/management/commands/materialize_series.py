@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from appointments.series import materialize_due
+
+
+class Command(BaseCommand):
+    help = 'Turn the occurrences of recurring series that are coming up into appointments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=float, default=None, metavar='DAYS',
+                            help='How far ahead to book (default settings.SERIES_MATERIALIZE_AHEAD)')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        ahead = timedelta(days=options['ahead']) if options['ahead'] is not None else None
+        created = materialize_due(ahead, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Created {created} appointment(s) from recurring series'))
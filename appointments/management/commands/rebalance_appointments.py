@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from appointments import sharding
+from appointments.models import Appointment
+
+
+class Command(BaseCommand):
+    help = 'Move appointments to the shard their laboratory maps to (after adding shards or enabling sharding)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would move')
+
+    def handle(self, *args, **options):
+        if not sharding.is_enabled():
+            raise CommandError('Appointment sharding is not enabled (set APPOINTMENT_SHARDS)')
+
+        total = 0
+        for source in sharding.all_aliases():
+            moved = self.rebalance(source, options['batch_size'], options['dry_run'])
+            total += moved
+            self.stdout.write(f'{source}: {moved} appointments {"to move" if options["dry_run"] else "moved"}')
+        self.stdout.write(self.style.SUCCESS(f'{total} appointments {"to move" if options["dry_run"] else "moved"}'))
+
+    def rebalance(self, source, batch_size, dry_run):
+        moved, last_pk = 0, 0
+        while True:
+            batch = list(
+                Appointment.objects.using(source).filter(pk__gt=last_pk).order_by('pk')[:batch_size]
+            )
+            if not batch:
+                return moved
+            last_pk = batch[-1].pk
+
+            by_target = {}
+            for appointment in batch:
+                target = sharding.shard_for_lab_test(appointment.lab_test_id)
+                if target != source:
+                    by_target.setdefault(target, []).append(appointment)
+
+            for target, appointments in by_target.items():
+                moved += len(appointments)
+                if dry_run:
+                    continue
+                # Copy first, then delete: a crash in between leaves a copy
+                # that the next run overwrites and removes from the source.
+                # Raw saves keep every column as is (created_at included),
+                # like loaddata does.
+                with transaction.atomic(using=target):
+                    for appointment in appointments:
+                        appointment.save_base(raw=True, using=target)
+                with transaction.atomic(using=source):
+                    # Raw delete: the rows still exist on the target, so no
+                    # cascades (e.g. waitlist links) may run.
+                    Appointment.objects.using(source).filter(
+                        pk__in=[a.pk for a in appointments]
+                    )._raw_delete(source)
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0001_initial'),
+        ('labs', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='appointment',
+            name='lab_test',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='labs.labtest'),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['user', 'appointment_time'], name='appt_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['lab_test', 'appointment_time'], name='appt_labtest_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['status', 'appointment_time'], name='appt_status_time_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0004_appointment_version'),
+        ('labs', '0002_labtest_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    # Constraints only go when appointments may be sharded; see
+    # settings.APPOINTMENT_FK_CONSTRAINTS.
+    operations = [
+        migrations.AlterField(
+            model_name='appointment',
+            name='lab_test',
+            field=models.ForeignKey(db_constraint=settings.APPOINTMENT_FK_CONSTRAINTS, db_index=False, on_delete=django.db.models.deletion.CASCADE, to='labs.labtest'),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='user',
+            field=models.ForeignKey(db_constraint=settings.APPOINTMENT_FK_CONSTRAINTS, db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='waitlistentry',
+            name='appointment',
+            field=models.OneToOneField(blank=True, db_constraint=settings.APPOINTMENT_FK_CONSTRAINTS, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='waitlist_entry', to='appointments.appointment'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:43
+
+from django.db import DEFAULT_DB_ALIAS, migrations, models
+
+
+def backfill_prices(apps, schema_editor):
+    """
+    Existing bookings get their lab test's current price, the best record
+    there is. Prices are read from the default database, where LabTest
+    lives even when appointments are sharded.
+    """
+    Appointment = apps.get_model('appointments', 'Appointment')
+    LabTest = apps.get_model('labs', 'LabTest')
+    appointments = Appointment.objects.using(schema_editor.connection.alias)
+    if not appointments.filter(price__isnull=True).exists():
+        return
+    by_price = {}
+    for lab_test_id, price in LabTest.objects.using(DEFAULT_DB_ALIAS).values_list('id', 'price').iterator():
+        by_price.setdefault(price, []).append(lab_test_id)
+    for price, lab_test_ids in by_price.items():
+        for start in range(0, len(lab_test_ids), 500):
+            appointments.filter(
+                price__isnull=True, lab_test_id__in=lab_test_ids[start:start + 500],
+            ).update(price=price)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0005_appointment_unconstrained_fks'),
+        ('labs', '0003_labtestprice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.RunPython(backfill_prices, migrations.RunPython.noop),
+    ]
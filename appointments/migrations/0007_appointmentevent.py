@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0006_appointment_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('created', 'Created'), ('status_changed', 'Status changed'), ('deleted', 'Deleted')], max_length=20)),
+                ('appointment_id', models.BigIntegerField()),
+                ('lab_id', models.BigIntegerField(null=True)),
+                ('lab_test_id', models.BigIntegerField()),
+                ('user_id', models.BigIntegerField()),
+                ('status', models.CharField(max_length=15)),
+                ('previous_status', models.CharField(blank=True, max_length=15)),
+                ('appointment_time', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['lab_id', 'id'], name='apptevent_lab_cursor_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:49
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_updated_at(apps, schema_editor):
+    """Existing rows were last known to change when they were created"""
+    Appointment = apps.get_model('appointments', 'Appointment')
+    Appointment.objects.using(schema_editor.connection.alias).update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0007_appointmentevent'),
+        ('labs', '0004_laboratory_offboarding'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['lab_test', 'updated_at'], name='appt_labtest_updated_idx'),
+        ),
+    ]
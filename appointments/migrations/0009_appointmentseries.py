@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0008_appointment_updated_at'),
+        ('labs', '0004_laboratory_offboarding'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='occurrence',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='AppointmentSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('interval_days', models.PositiveSmallIntegerField(default=7)),
+                ('count', models.PositiveSmallIntegerField()),
+                ('exceptions', models.JSONField(blank=True, default=list)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('cancelled', 'Cancelled'), ('finished', 'Finished')], default='active', max_length=15)),
+                ('materialized', models.PositiveSmallIntegerField(default=0)),
+                ('next_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('lab_test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='appointment_series', to='labs.labtest')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='appointment_series', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='series',
+            field=models.ForeignKey(blank=True, db_constraint=settings.APPOINTMENT_FK_CONSTRAINTS, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='appointments', to='appointments.appointmentseries'),
+        ),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(condition=models.Q(('series__isnull', False)), fields=('series', 'occurrence'), name='appt_series_occurrence_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='appointmentseries',
+            index=models.Index(fields=['status', 'next_at'], name='series_due_idx'),
+        ),
+    ]
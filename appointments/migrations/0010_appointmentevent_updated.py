@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0009_appointmentseries'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='appointmentevent',
+            name='type',
+            field=models.CharField(choices=[('created', 'Created'), ('status_changed', 'Status changed'), ('updated', 'Updated'), ('deleted', 'Deleted')], max_length=20),
+        ),
+    ]
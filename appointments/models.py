@@ -1,8 +1,75 @@
-from django.db import models
+from datetime import timedelta
+
+from django.db import DEFAULT_DB_ALIAS, models, router, transaction
+from django.db.models import F, Q, Sum
 from django.conf import settings
+from django.core.mail import send_mail
+from django.utils import timezone
+from core.models import VersionedModel
 from labs.models import LabTest
+from . import sharding
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AppointmentQuerySet(models.QuerySet):
+    def create(self, **kwargs):
+        # Without an explicit using(), place the new row on its lab's shard
+        if self._db is None and sharding.is_enabled():
+            obj = self.model(**kwargs)
+            obj.save(force_insert=True, using=sharding.shard_for_lab_test(obj.lab_test_id))
+            return obj
+        return super().create(**kwargs)
+
+    def for_lab(self, lab_id):
+        """Appointments of one laboratory, read from its shard"""
+        return self.using(sharding.shard_for_lab(lab_id)).filter(
+            lab_test_id__in=sharding.lab_test_ids(lab_id=lab_id)
+        )
+
+    def for_lab_test(self, lab_test_id):
+        return self.using(sharding.shard_for_lab_test(lab_test_id)).filter(lab_test_id=lab_test_id)
+
+    def update(self, **kwargs):
+        """
+        Update. Setting the status logs a 'status_changed' event for each
+        row it changes and bumps version and updated_at, and rows it cancels
+        hand their slots to the waitlist, as Appointment.save() does
+        """
+        if 'status' not in kwargs:
+            return super().update(**kwargs)
+        status = kwargs['status']
+        kwargs.setdefault('version', F('version') + 1)
+        kwargs.setdefault('updated_at', timezone.now())
+        # The waitlist is on the default database; see sharding.atomic
+        with sharding.atomic(self.db):
+            changed = [
+                Appointment(pk=pk, lab_test_id=lab_test_id, user_id=user_id, appointment_time=when, status=previous)
+                for pk, lab_test_id, user_id, when, previous in self.exclude(status=status).values_list(
+                    'pk', 'lab_test_id', 'user_id', 'appointment_time', 'status',
+                )
+            ]
+            updated = super().update(**kwargs)
+            events = AppointmentEvent.objects.db_manager(self.db)
+            events.bulk_create(
+                AppointmentEvent(**{**events.values_for(appointment, 'status_changed', appointment.status), 'status': status})
+                for appointment in changed
+            )
+            if status == 'cancelled':
+                WaitlistEntry.objects.promote_for(changed)
+        return updated
+
+    def revenue(self):
+        """Total booked price of the non-cancelled appointments, from this table alone"""
+        return self.exclude(status='cancelled').aggregate(total=Sum('price'))['total']
 
-class Appointment(models.Model):
+    def scatter_gather(self, key=None, reverse=False):
+        """Evaluate on every shard; see sharding.scatter_gather"""
+        return sharding.scatter_gather(self, key, reverse)
+
+
+class Appointment(VersionedModel):
     STATUS_CHOICES = [
         ('booked', 'Booked'),
         ('cancelled', 'Cancelled'),
@@ -10,8 +77,371 @@ class Appointment(models.Model):
         ('completed', 'Completed'),
     ]
 
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete= models.CASCADE)
-    lab_test = models.ForeignKey(LabTest, on_delete= models.CASCADE)
+    # The composite indexes below lead with these columns, so the FKs do not
+    # need single-column indexes of their own. No database constraints when
+    # sharded: appointments may live on a shard without the user and lab test
+    # tables (see settings.APPOINTMENT_FK_CONSTRAINTS).
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete= models.CASCADE, db_index=False,
+        db_constraint=settings.APPOINTMENT_FK_CONSTRAINTS,
+    )
+    lab_test = models.ForeignKey(
+        LabTest, on_delete= models.CASCADE, db_index=False, db_constraint=settings.APPOINTMENT_FK_CONSTRAINTS,
+    )
     appointment_time = models.DateTimeField()
     status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='booked')
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    # Price of the lab test when booked, so billing never joins LabTest
+    price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+    # Set on the rows materialized from a recurring series (see appointments.series)
+    series = models.ForeignKey(
+        'AppointmentSeries', on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+        related_name='appointments', db_index=False, db_constraint=settings.APPOINTMENT_FK_CONSTRAINTS,
+    )
+    occurrence = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = AppointmentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Patient views: own bookings by time
+            models.Index(fields=['user', 'appointment_time'], name='appt_user_time_idx'),
+            # Lab-side views: bookings per lab test by time
+            models.Index(fields=['lab_test', 'appointment_time'], name='appt_labtest_time_idx'),
+            # Admin views filtered by status
+            models.Index(fields=['status', 'appointment_time'], name='appt_status_time_idx'),
+            # Calendar sync: a lab's changes since a token, and its latest change
+            models.Index(fields=['lab_test', 'updated_at'], name='appt_labtest_updated_idx'),
+        ]
+        constraints = [
+            # Each occurrence of a series is materialized at most once
+            models.UniqueConstraint(
+                fields=['series', 'occurrence'], condition=Q(series__isnull=False), name='appt_series_occurrence_uniq',
+            ),
+        ]
+
+    # Fields whose changes are logged to AppointmentEvent, by attname
+    TRACKED_FIELDS = ('status', 'appointment_time', 'lab_test_id')
+
+    # TRACKED_FIELDS as last read from the database, used to detect changes
+    _loaded = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded = {
+            name: values[field_names.index(name)] for name in cls.TRACKED_FIELDS if name in field_names
+        }
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using, fields, from_queryset)
+        self._remember_loaded(fields)
+
+    def _remember_loaded(self, fields=None):
+        deferred = self.get_deferred_fields()
+        loaded = dict(self._loaded or {})
+        for name in self.TRACKED_FIELDS:
+            field = self._meta.get_field(name.removesuffix('_id'))
+            if name not in deferred and (fields is None or {field.name, field.attname} & set(fields)):
+                loaded[name] = getattr(self, name)
+        self._loaded = loaded
+
+    def _previous_values(self, using, update_fields):
+        """
+        The tracked fields this save writes, with their values in the
+        database before it; empty when adding. Fields that were deferred
+        when the instance was loaded are read from the database.
+        """
+        if self._state.adding:
+            return {}
+        deferred = self.get_deferred_fields()
+        names = [
+            name for name in self.TRACKED_FIELDS
+            if name not in deferred and (
+                update_fields is None or {name, name.removesuffix('_id')} & set(update_fields)
+            )
+        ]
+        loaded = self._loaded or {}
+        missing = [name for name in names if name not in loaded]
+        if missing:
+            row = Appointment._base_manager.using(using).filter(pk=self.pk).values(*missing).first() or {}
+            loaded = self._loaded = {**loaded, **row}
+        return {name: loaded[name] for name in names if name in loaded}
+
+    def current_lab_test_price(self):
+        if Appointment.lab_test.is_cached(self):
+            return self.lab_test.price
+        # LabTest stays on the default database when appointments are sharded
+        return LabTest.objects.using(DEFAULT_DB_ALIAS).values_list('price', flat=True).get(pk=self.lab_test_id)
+
+    def save(self, *args, **kwargs):
+        """
+        Save, log the change to AppointmentEvent ('created', 'status_changed'
+        or, for other TRACKED_FIELDS, 'updated'), and hand the slot to the
+        waitlist when a booking is cancelled
+        """
+        if self._state.adding and self.price is None:
+            self.price = self.current_lab_test_price()
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with sharding.atomic(using):
+            adding, previous = self._state.adding, self._previous_values(using, kwargs.get('update_fields'))
+            previous_status = previous.get('status')
+            cancelled = previous_status not in (None, 'cancelled') and self.status == 'cancelled'
+            super().save(*args, **kwargs)
+            # Logged in the same transaction, on the same database
+            events = AppointmentEvent.objects.db_manager(self._state.db)
+            if adding:
+                events.record(self, 'created')
+            elif previous_status is not None and self.status != previous_status:
+                events.record(self, 'status_changed', previous_status)
+            elif any(getattr(self, name) != value for name, value in previous.items()):
+                events.record(self, 'updated')
+            if cancelled:
+                WaitlistEntry.objects.promote_next(self)
+        self._remember_loaded()
+
+
+class AppointmentSeries(models.Model):
+    """
+    A recurring booking stored as a rule: `count` occurrences, the first at
+    `start` and each `interval_days` later at the same local time. Only
+    occurrences coming up within settings.SERIES_MATERIALIZE_AHEAD, or
+    changed by the patient, become Appointment rows; the rest are expanded
+    on demand (see appointments.series).
+
+    `materialized` is how many leading occurrences have been dealt with,
+    and `next_at` the time of the next one, for the materialize_series
+    command. `exceptions` lists the indexes of occurrences that were skipped
+    or materialized out of turn, which expansion leaves out.
+    """
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        ('cancelled', 'Cancelled'),
+        ('finished', 'Finished'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='appointment_series')
+    lab_test = models.ForeignKey(LabTest, on_delete=models.CASCADE, related_name='appointment_series')
+    start = models.DateTimeField()
+    interval_days = models.PositiveSmallIntegerField(default=7)
+    count = models.PositiveSmallIntegerField()
+    exceptions = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='active')
+    materialized = models.PositiveSmallIntegerField(default=0)
+    next_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # materialize_series: active series whose next occurrence is due
+            models.Index(fields=['status', 'next_at'], name='series_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} every {self.interval_days} day(s) x{self.count} from {self.start:%Y-%m-%d %H:%M}"
+
+    def occurrence_time(self, index):
+        """Start of occurrence `index`, keeping the local wall clock time across DST changes"""
+        local = timezone.localtime(self.start)
+        naive = local.replace(tzinfo=None) + timedelta(days=index * self.interval_days)
+        return timezone.make_aware(naive, local.tzinfo)
+
+
+class AppointmentEventManager(models.Manager):
+    def record(self, appointment, type, previous_status=None):
+        return self.create(**self.values_for(appointment, type, previous_status))
+
+    def values_for(self, appointment, type, previous_status=None):
+        try:
+            lab_id = sharding.lab_id_for_lab_test(appointment.lab_test_id)
+        except LabTest.DoesNotExist:
+            lab_id = None
+        return {
+            'type': type,
+            'appointment_id': appointment.pk,
+            'lab_id': lab_id,
+            'lab_test_id': appointment.lab_test_id,
+            'user_id': appointment.user_id,
+            'status': appointment.status,
+            'previous_status': previous_status or '',
+            'appointment_time': appointment.appointment_time,
+        }
+
+
+class AppointmentEvent(models.Model):
+    """
+    Append-only log of appointment changes for integrations to consume by
+    id (see appointments.events). Plain ids rather than foreign keys, so
+    events outlive what they describe until compacted.
+    """
+    TYPE_CHOICES = [
+        ('created', 'Created'),
+        ('status_changed', 'Status changed'),
+        ('updated', 'Updated'),
+        ('deleted', 'Deleted'),
+    ]
+
+    type = models.CharField(max_length=20, choices=TYPE_CHOICES)
+    appointment_id = models.BigIntegerField()
+    lab_id = models.BigIntegerField(null=True)
+    lab_test_id = models.BigIntegerField()
+    user_id = models.BigIntegerField()
+    status = models.CharField(max_length=15)
+    previous_status = models.CharField(max_length=15, blank=True)
+    appointment_time = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = AppointmentEventManager()
+
+    class Meta:
+        indexes = [
+            # Per-lab consumers: events of a lab after a cursor
+            models.Index(fields=['lab_id', 'id'], name='apptevent_lab_cursor_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.id}: appointment {self.appointment_id} {self.type} ({self.status})"
+
+
+class WaitlistEntryManager(models.Manager):
+    def queue_for(self, lab_test_id, when):
+        """
+        Waiting entries that accept a slot for lab_test at `when`, in
+        promotion order. Seeks straight to the head of the
+        (lab_test, day) queue through waitlist_queue_idx.
+        """
+        local = timezone.localtime(when)
+        return self.filter(
+            lab_test_id=lab_test_id,
+            day=local.date(),
+            status='waiting',
+        ).filter(
+            Q(window_start__isnull=True) | Q(window_start__lte=when),
+            Q(window_end__isnull=True) | Q(window_end__gt=when),
+        ).order_by('-priority', 'created_at', 'id')
+
+    def promote_next(self, cancelled, attempts=5):
+        """
+        Give the cancelled appointment's slot to the next eligible entry.
+
+        Each candidate is claimed with a conditional UPDATE, so concurrent
+        cancellations never promote the same entry twice. Returns the new
+        Appointment, or None if nobody was waiting.
+        """
+        for entry in self.queue_for(cancelled.lab_test_id, cancelled.appointment_time)[:attempts]:
+            claimed = self.filter(pk=entry.pk, status='waiting').update(
+                status='promoted', promoted_at=timezone.now(),
+            )
+            if not claimed:
+                continue
+
+            appointment = Appointment.objects.create(
+                user_id=entry.user_id,
+                lab_test_id=entry.lab_test_id,
+                appointment_time=cancelled.appointment_time,
+                status='booked',
+            )
+            self.filter(pk=entry.pk).update(appointment=appointment)
+            entry.status, entry.appointment = 'promoted', appointment
+            transaction.on_commit(entry.notify_promotion)
+            return appointment
+        return None
+
+    def promote_for(self, cancelled):
+        """
+        promote_next() for each of several cancelled appointments, with one
+        query up front to skip the slots nobody is waiting for
+        """
+        days = {timezone.localtime(appointment.appointment_time).date() for appointment in cancelled}
+        waiting = set(self.filter(
+            lab_test_id__in={appointment.lab_test_id for appointment in cancelled}, day__in=days, status='waiting',
+        ).values_list('lab_test_id', 'day')) if cancelled else set()
+        promoted = []
+        for appointment in cancelled:
+            if (appointment.lab_test_id, timezone.localtime(appointment.appointment_time).date()) in waiting:
+                new = self.promote_next(appointment)
+                if new is not None:
+                    promoted.append(new)
+        return promoted
+
+
+class WaitlistEntry(models.Model):
+    """
+    A patient waiting for a LabTest slot on a given day, optionally within
+    a time window. Promoted automatically when a matching booking is
+    cancelled.
+    """
+    STATUS_CHOICES = [
+        ('waiting', 'Waiting'),
+        ('promoted', 'Promoted'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='waitlist_entries')
+    lab_test = models.ForeignKey(LabTest, on_delete=models.CASCADE, related_name='waitlist_entries', db_index=False)
+    day = models.DateField()
+    window_start = models.DateTimeField(null=True, blank=True)
+    window_end = models.DateTimeField(null=True, blank=True)
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='waiting')
+    appointment = models.OneToOneField(
+        Appointment, on_delete=models.SET_NULL, null=True, blank=True, related_name='waitlist_entry',
+        db_constraint=settings.APPOINTMENT_FK_CONSTRAINTS,
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    promoted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = WaitlistEntryManager()
+
+    class Meta:
+        indexes = [
+            # Head-of-queue lookup: equality on (lab_test, day, status), then
+            # already in promotion order.
+            models.Index(
+                fields=['lab_test', 'day', 'status', '-priority', 'created_at'],
+                name='waitlist_queue_idx',
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'lab_test', 'day'],
+                condition=Q(status='waiting'),
+                name='waitlist_one_waiting_entry',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} waiting for {self.lab_test_id} on {self.day} ({self.status})"
+
+    def notify_promotion(self):
+        """Email the patient that they got a slot; failures are only logged"""
+        try:
+            self.send_promotion_email()
+        except Exception as e:
+            logger.warning('Failed to send waitlist promotion email for entry %s: %s', self.pk, e)
+
+    def send_promotion_email(self):
+        """Send email when a waitlist entry is promoted to a booking"""
+        appointment = self.appointment
+        subject = 'A slot opened up - your appointment is booked'
+        message = f"""
+        Hi {self.user.username},
+
+        A slot became available and you have been moved off the waitlist.
+
+        Test: {appointment.lab_test.test.name}
+        Laboratory: {appointment.lab_test.lab.name}
+        Time: {timezone.localtime(appointment.appointment_time).strftime('%Y-%m-%d %H:%M')}
+
+        If you can no longer make it, please cancel so the next patient can take the slot.
+        """
+        send_mail(
+            subject,
+            message,
+            settings.DEFAULT_FROM_EMAIL,
+            [self.user.email],
+            fail_silently=False,
+        )
\ No newline at end of file
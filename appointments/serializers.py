@@ -1,7 +1,79 @@
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Appointment
+from core.serializers import DynamicFieldsMixin
+from labs.models import LabTest
+from .models import Appointment, AppointmentSeries, WaitlistEntry
 
-class AppointmentSerializer(serializers.ModelSerializer):
+# Lab tests of offboarded laboratories cannot be booked
+_bookable_lab_tests = {'queryset': LabTest.objects.filter(lab__is_active=True)}
+
+class AppointmentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Appointment
-        fields ='__all__'
\ No newline at end of file
+        fields ='__all__'
+        extra_kwargs = {'lab_test': _bookable_lab_tests}
+        expandable_fields = {
+            'lab_test': 'labs.serializers.LabTestSerializer',
+        }
+
+
+class WaitlistEntrySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = WaitlistEntry
+        fields = (
+            'id', 'lab_test', 'day', 'window_start', 'window_end', 'priority',
+            'status', 'appointment', 'created_at', 'promoted_at',
+        )
+        read_only_fields = ('priority', 'status', 'appointment', 'created_at', 'promoted_at')
+        extra_kwargs = {'lab_test': _bookable_lab_tests}
+
+    def validate(self, attrs):
+        day = attrs.get('day')
+        window_start, window_end = attrs.get('window_start'), attrs.get('window_end')
+
+        if day and day < timezone.localdate():
+            raise serializers.ValidationError({'day': 'Cannot join a waitlist for a past day.'})
+        if window_start and window_end and window_start >= window_end:
+            raise serializers.ValidationError({'window_end': 'Must be after window_start.'})
+        if window_start and day and timezone.localtime(window_start).date() != day:
+            raise serializers.ValidationError({'window_start': 'Must fall on the waitlist day.'})
+
+        lab_test = attrs.get('lab_test')
+        if lab_test and not lab_test.is_active:
+            raise serializers.ValidationError({'lab_test': 'This test is not currently offered.'})
+        user = self.context['request'].user
+        if WaitlistEntry.objects.filter(user=user, lab_test=lab_test, day=day, status='waiting').exists():
+            raise serializers.ValidationError('You are already on the waitlist for this test and day.')
+        return attrs
+
+
+class AppointmentSeriesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AppointmentSeries
+        fields = (
+            'id', 'lab_test', 'start', 'interval_days', 'count', 'exceptions',
+            'status', 'materialized', 'next_at', 'created_at',
+        )
+        read_only_fields = ('exceptions', 'status', 'materialized', 'next_at', 'created_at')
+        extra_kwargs = {'lab_test': _bookable_lab_tests}
+
+    def validate(self, attrs):
+        if attrs['start'] <= timezone.now():
+            raise serializers.ValidationError({'start': 'Must be in the future.'})
+        if not 1 <= attrs['count'] <= settings.SERIES_MAX_COUNT:
+            raise serializers.ValidationError({'count': f'Must be between 1 and {settings.SERIES_MAX_COUNT}.'})
+        if attrs.get('interval_days', 7) < 1:
+            raise serializers.ValidationError({'interval_days': 'Must be at least 1.'})
+        if not attrs['lab_test'].is_active:
+            raise serializers.ValidationError({'lab_test': 'This test is not currently offered.'})
+        return attrs
+
+
+class OccurrenceMoveSerializer(serializers.Serializer):
+    appointment_time = serializers.DateTimeField()
+
+    def validate_appointment_time(self, value):
+        if value <= timezone.now():
+            raise serializers.ValidationError('Must be in the future.')
+        return value
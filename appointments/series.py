@@ -0,0 +1,194 @@
+"""
+Recurring appointments (AppointmentSeries).
+
+A series is a rule, not 52 rows. Its occurrences are expanded lazily, and
+only for the window being looked at. An occurrence becomes an Appointment
+row in two cases: when it is close (materialize_due, run by the
+materialize_series command, and once at creation), or when the patient
+changes it (move / skip). Until then it exists only as an index into the
+rule. This keeps the appointments table, and every scan of it, at the size
+of the next few weeks of bookings.
+
+Series rows stay on the default database; their materialized
+appointments go to the lab's shard like any other booking. The
+(series, occurrence) unique constraint makes materializing idempotent,
+so a run interrupted between the two databases can safely run again.
+"""
+import logging
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import sharding
+from .models import Appointment, AppointmentSeries
+
+logger = logging.getLogger(__name__)
+
+
+def _first_index_at(series, since):
+    """Lowest index whose occurrence may fall at or after since"""
+    days = (timezone.localtime(since).date() - timezone.localtime(series.start).date()).days
+    # One interval of slack covers DST shifts around the boundary
+    return max(0, days // series.interval_days - 1)
+
+
+def expand(series, since, until):
+    """(index, time) of the occurrences in [since, until) that have no row yet"""
+    skipped = set(series.exceptions)
+    index = max(_first_index_at(series, since), series.materialized)
+    while index < series.count:
+        when = series.occurrence_time(index)
+        if when >= until:
+            break
+        if when >= since and index not in skipped:
+            yield index, when
+        index += 1
+
+
+def materialized(series, since=None, until=None):
+    """The series' Appointment rows, read from its lab's shard"""
+    queryset = Appointment.objects.for_lab_test(series.lab_test_id).filter(series=series)
+    if since is not None:
+        queryset = queryset.filter(appointment_time__gte=since)
+    if until is not None:
+        queryset = queryset.filter(appointment_time__lt=until)
+    return queryset
+
+
+def occurrences(series, since, until):
+    """
+    Every occurrence in [since, until), oldest first, as dicts. Those
+    with a row carry its id and status; the rest have `appointment` None
+    and status 'scheduled'.
+    """
+    rows = [
+        {
+            'occurrence': occurrence, 'appointment_time': when,
+            'appointment': pk, 'status': status,
+        }
+        for pk, occurrence, when, status in materialized(series, since, until)
+        .values_list('id', 'occurrence', 'appointment_time', 'status')
+    ]
+    if series.status == 'active':
+        rows += [
+            {'occurrence': index, 'appointment_time': when, 'appointment': None, 'status': 'scheduled'}
+            for index, when in expand(series, since, until)
+        ]
+    return sorted(rows, key=lambda row: (row['appointment_time'], row['occurrence']))
+
+
+def _create(series, index, when):
+    """The row for one occurrence, or None if it already has one"""
+    try:
+        with transaction.atomic(using=Appointment.objects.for_lab_test(series.lab_test_id).db):
+            return Appointment.objects.create(
+                user_id=series.user_id, lab_test_id=series.lab_test_id, appointment_time=when,
+                series=series, occurrence=index,
+            )
+    except IntegrityError:
+        return None
+
+
+def _advance(series, index):
+    series.materialized = index
+    series.next_at = series.occurrence_time(index) if index < series.count else None
+    if series.next_at is None and series.status == 'active':
+        series.status = 'finished'
+
+
+def materialize(series, until):
+    """Create rows for the series' occurrences starting before until; returns how many"""
+    created = 0
+    with transaction.atomic():
+        series = AppointmentSeries.objects.select_for_update().get(pk=series.pk)
+        if series.status != 'active':
+            return 0
+        skipped = set(series.exceptions)
+        index = series.materialized
+        while index < series.count:
+            when = series.occurrence_time(index)
+            if when >= until:
+                break
+            if index not in skipped and _create(series, index, when) is not None:
+                created += 1
+            index += 1
+        _advance(series, index)
+        series.save(update_fields=['materialized', 'next_at', 'status', 'updated_at'])
+    return created
+
+
+def materialize_due(ahead=None, batch_size=500):
+    """Materialize every active series with an occurrence within `ahead`; returns rows created"""
+    until = timezone.now() + (ahead or settings.SERIES_MATERIALIZE_AHEAD)
+    created = 0
+    last_id = 0
+    while True:
+        batch = list(
+            AppointmentSeries.objects.filter(status='active', next_at__lt=until, pk__gt=last_id)
+            .order_by('pk')[:batch_size]
+        )
+        if not batch:
+            return created
+        for series in batch:
+            try:
+                created += materialize(series, until)
+            except Exception:
+                logger.exception('Could not materialize appointment series %s', series.pk)
+        last_id = batch[-1].pk
+
+
+def _check_index(series, index):
+    if not 0 <= index < series.count:
+        raise ValueError(f'Series {series.pk} has no occurrence {index}.')
+
+
+def _except(series, index):
+    with transaction.atomic():
+        series = AppointmentSeries.objects.select_for_update().get(pk=series.pk)
+        if index not in series.exceptions:
+            series.exceptions = sorted([*series.exceptions, index])
+            series.save(update_fields=['exceptions', 'updated_at'])
+    return series
+
+
+def move(series, index, when):
+    """Materialize occurrence `index` at a different time; returns its Appointment"""
+    _check_index(series, index)
+    appointment = materialized(series).filter(occurrence=index).first()
+    if appointment is None:
+        _except(series, index)
+        appointment = _create(series, index, when) or materialized(series).get(occurrence=index)
+    if appointment.appointment_time != when:
+        appointment.appointment_time = when
+        if appointment.status == 'booked':
+            appointment.status = 'rescheduled'
+        appointment.save()
+    return appointment
+
+
+def skip(series, index):
+    """Drop one occurrence; one that already has a row is cancelled"""
+    _check_index(series, index)
+    series = _except(series, index)
+    appointment = materialized(series).filter(occurrence=index).first()
+    if appointment is not None and appointment.status != 'cancelled':
+        appointment.status = 'cancelled'
+        appointment.save()
+    return series
+
+
+def cancel(series):
+    """Stop the series and cancel its upcoming booked rows (their slots go to the waitlist)"""
+    # All or nothing: a series left active with some rows cancelled would
+    # keep materializing next to the holes
+    with sharding.atomic(materialized(series).db):
+        AppointmentSeries.objects.filter(pk=series.pk).update(
+            status='cancelled', next_at=None, updated_at=timezone.now(),
+        )
+        upcoming = materialized(series, since=timezone.now()).filter(status__in=('booked', 'rescheduled'))
+        for appointment in upcoming:
+            appointment.status = 'cancelled'
+            appointment.save()
+    series.status, series.next_at = 'cancelled', None
+    return series
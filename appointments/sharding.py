@@ -0,0 +1,263 @@
+"""
+Sharding of appointments by laboratory.
+
+With settings.APPOINTMENT_SHARDS set to a list of database aliases, every
+Appointment is written to the shard its laboratory hashes to (jump
+consistent hash, so adding a shard only moves about 1/N of the labs).
+Everything else, including LabTest, stays on the default database, which is
+also where the lab of a lab test is looked up.
+
+Queries for one lab go to one shard through Appointment.objects.for_lab().
+Queries that span labs use scatter_gather(), which runs the queryset on
+every database in parallel and merges the results, or MergedRows, which
+does the same lazily for pagination and only reads the first
+offset + limit rows of each database. Each shard hands out ids from its
+own range, so ids stay unique and usually say where a row lives. The
+rebalance_appointments command moves rows whose shard changed.
+
+The lab of each lab test is cached per process for
+settings.SHARD_LAB_CACHE_TTL seconds. Moving a lab test to another lab is
+seen at once by the process that saved it and by the others within that
+time; until rebalance_appointments runs, its existing bookings stay on the
+old shard either way.
+
+Writes that touch a shard and the default database (a cancellation that
+promotes a waitlist entry, say) use atomic(), which nests a transaction
+on each. The shard commits first and the default database right after;
+that is two commits, not one, so a failure between them can leave the
+shard ahead of the default database.
+
+With no shards configured, everything here is a no-op.
+"""
+import heapq
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+APPOINTMENT_MODEL = 'appointments.appointment'
+
+# Shard n allocates ids from (n + 1) * ID_RANGE; the default database keeps
+# the ids below ID_RANGE. 2**40 per shard keeps ids JSON-safe (< 2**53).
+ID_RANGE = 2 ** 40
+
+_lab_for_lab_test = {}
+
+
+def shard_aliases():
+    return list(getattr(settings, 'APPOINTMENT_SHARDS', ()))
+
+
+def is_enabled():
+    return bool(getattr(settings, 'APPOINTMENT_SHARDS', ()))
+
+
+def all_aliases():
+    """Every database that may hold appointments, default first"""
+    return [DEFAULT_DB_ALIAS] + shard_aliases()
+
+
+def jump_hash(key, buckets):
+    """Jump consistent hash (Lamping & Veach) of an integer key"""
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * (1 << 31) / ((key >> 33) + 1))
+    return bucket
+
+
+def shard_for_lab(lab_id):
+    aliases = shard_aliases()
+    if not aliases:
+        return DEFAULT_DB_ALIAS
+    return aliases[jump_hash(int(lab_id), len(aliases))]
+
+
+def lab_id_for_lab_test(lab_test_id):
+    lab_id, expires = _lab_for_lab_test.get(lab_test_id, (None, 0))
+    now = time.monotonic()
+    if lab_id is None or expires <= now:
+        from labs.models import LabTest
+        lab_id = LabTest.objects.using(DEFAULT_DB_ALIAS).values_list('lab_id', flat=True).get(pk=lab_test_id)
+        _lab_for_lab_test[lab_test_id] = lab_id, now + getattr(settings, 'SHARD_LAB_CACHE_TTL', 60)
+    return lab_id
+
+
+def forget_lab_test(lab_test_id):
+    _lab_for_lab_test.pop(lab_test_id, None)
+
+
+def shard_for_lab_test(lab_test_id):
+    if not is_enabled():
+        return DEFAULT_DB_ALIAS
+    return shard_for_lab(lab_id_for_lab_test(lab_test_id))
+
+
+def aliases_for_pk(pk):
+    """Databases to look for an appointment id in, most likely first"""
+    aliases = all_aliases()
+    try:
+        index = int(pk) // ID_RANGE
+    except (TypeError, ValueError):
+        return aliases
+    if 0 <= index < len(aliases):
+        aliases.insert(0, aliases.pop(index))
+    return aliases
+
+
+def lab_test_ids(**filters):
+    """
+    LabTest ids matching filters, for appointment__lab_test_id__in lookups.
+    A subquery when unsharded; a list when sharded, since shards cannot
+    join to LabTest.
+    """
+    from labs.models import LabTest
+    queryset = LabTest.objects.using(DEFAULT_DB_ALIAS).filter(**filters)
+    if is_enabled():
+        return list(queryset.values_list('id', flat=True))
+    return queryset.values('id')
+
+
+@contextmanager
+def atomic(using):
+    """transaction.atomic on `using`, inside one on the default database if that is a shard"""
+    if using == DEFAULT_DB_ALIAS:
+        with transaction.atomic(using=using):
+            yield
+    else:
+        with transaction.atomic(using=DEFAULT_DB_ALIAS), transaction.atomic(using=using):
+            yield
+
+
+def _on_every_database(function):
+    """function(alias) on each database in parallel, in all_aliases() order"""
+    def run(alias):
+        try:
+            return function(alias)
+        finally:
+            connections[alias].close()
+
+    aliases = all_aliases()
+    with ThreadPoolExecutor(max_workers=len(aliases)) as pool:
+        return list(pool.map(run, aliases))
+
+
+def scatter_gather(queryset, key=None, reverse=False):
+    """
+    Evaluate queryset on the default database and every shard and return the
+    combined rows. Each database's rows come back in the queryset's order;
+    pass the matching sort key to merge them into one ordered list.
+    """
+    if not is_enabled():
+        return list(queryset)
+    parts = _on_every_database(lambda alias: list(queryset.using(alias)))
+    if key is None:
+        return [row for part in parts for row in part]
+    return list(heapq.merge(*parts, key=key, reverse=reverse))
+
+
+class MergedRows:
+    """
+    An ordered queryset read from every database, for paginators: count()
+    adds up a COUNT from each, and a slice [start:stop] reads the first
+    `stop` rows of each (ORDER BY ... LIMIT stop) and merges them. `key`
+    must give the queryset's ordering.
+    """
+
+    def __init__(self, queryset, key, reverse=False):
+        self.queryset, self.key, self.reverse = queryset, key, reverse
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = sum(_on_every_database(lambda alias: self.queryset.using(alias).count()))
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(scatter_gather(self.queryset, self.key, self.reverse))
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            rows = self[index:index + 1]
+            if not rows:
+                raise IndexError(index)
+            return rows[0]
+        if index.step is not None or (index.start or 0) < 0 or (index.stop is not None and index.stop < 0):
+            raise ValueError('MergedRows only supports forward slices without a step.')
+        if index.stop is None:
+            return list(islice(self, index.start, None))
+        parts = _on_every_database(lambda alias: list(self.queryset.using(alias)[:index.stop]))
+        return list(islice(heapq.merge(*parts, key=self.key, reverse=self.reverse), index.start, index.stop))
+
+
+def reserve_id_range(using):
+    """Start a shard's appointment ids at its own range (post_migrate)"""
+    aliases = shard_aliases()
+    if using not in aliases:
+        return
+    from .models import Appointment
+    table = Appointment._meta.db_table
+    base = (aliases.index(using) + 1) * ID_RANGE
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, base])
+            elif row[0] < base:
+                cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [base, table])
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                "GREATEST(%s, (SELECT COALESCE(MAX(id), 0) FROM " + connection.ops.quote_name(table) + ')))',
+                [table, base],
+            )
+        else:
+            logger.warning('Cannot reserve an appointment id range on %s (%s)', using, connection.vendor)
+
+
+class AppointmentShardRouter:
+    """
+    Route Appointment to its lab's shard. Instances that are already stored
+    stay where they are until rebalanced; queries without an instance hint
+    go to the default database (use for_lab() or scatter_gather()).
+    """
+
+    def _db_for(self, model, instance):
+        if not is_enabled():
+            return None
+        if model._meta.label_lower != APPOINTMENT_MODEL:
+            return DEFAULT_DB_ALIAS
+        if instance is None:
+            return None
+        if instance._meta.label_lower == APPOINTMENT_MODEL and instance._state.db and not instance._state.adding:
+            return instance._state.db
+        lab_test_id = getattr(instance, 'lab_test_id', None)
+        return shard_for_lab_test(lab_test_id) if lab_test_id else None
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model, hints.get('instance'))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_enabled() and APPOINTMENT_MODEL in (obj1._meta.label_lower, obj2._meta.label_lower):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in shard_aliases():
+            return app_label == 'appointments'
+        return None
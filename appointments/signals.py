@@ -0,0 +1,28 @@
+from . import sharding
+
+
+def reserve_shard_ids(sender, using, **kwargs):
+    sharding.reserve_id_range(using)
+
+
+def forget_lab_test(sender, instance, **kwargs):
+    sharding.forget_lab_test(instance.pk)
+
+
+def delete_sharded_appointments(sender, instance, **kwargs):
+    """
+    The ORM cascade only reaches appointments on the default database;
+    delete a removed user's or lab test's appointments on the shards too.
+    """
+    if not sharding.is_enabled():
+        return
+    from .models import Appointment
+    field = 'lab_test_id' if sender._meta.label_lower == 'labs.labtest' else 'user_id'
+    for alias in sharding.shard_aliases():
+        Appointment.objects.using(alias).filter(**{field: instance.pk}).delete()
+
+
+def log_deleted_appointment(sender, instance, using, **kwargs):
+    """Runs inside the deleting transaction, so the event commits with it"""
+    from .models import AppointmentEvent
+    AppointmentEvent.objects.db_manager(using).record(instance, 'deleted', instance.status)
@@ -1,3 +1,648 @@
-from django.test import TestCase
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.pagination import LimitOffsetPagination
+
+from core import testing
+from core.middleware import GZipMiddleware
+from labs.models import LabTest
+from . import analytics, events, ical, series as recurring, sharding
+from .models import Appointment, AppointmentEvent, AppointmentSeries, WaitlistEntry
+from .views import AppointmentViewSet
+
+
+def ids(response):
+    return [row['id'] for row in response.json()]
+
+
+class AppointmentScopeTests(TestCase):
+    """Each role sees only its own slice of the appointment list"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient, cls.other_patient = testing.create_user(), testing.create_user()
+        cls.owner = testing.create_user('lab_owner')
+        cls.admin = testing.create_admin()
+        cls.own_lab_test = testing.create_lab_test(testing.create_lab(cls.owner))
+        cls.other_lab_test = testing.create_lab_test()
+        start = timezone.now() + timedelta(days=1)
+        cls.at_own_lab = testing.create_appointment(cls.patient, cls.own_lab_test, start)
+        cls.elsewhere = testing.create_appointment(cls.patient, cls.other_lab_test, start + timedelta(hours=1))
+        cls.owner_booking = testing.create_appointment(cls.owner, cls.other_lab_test, start + timedelta(hours=2))
+        cls.other = testing.create_appointment(cls.other_patient, cls.other_lab_test, start + timedelta(hours=3))
+
+    def list(self, user, **params):
+        return testing.api_client(user).get(reverse('appointment-list'), params)
+
+    def test_patients_see_their_own_bookings(self):
+        self.assertEqual(ids(self.list(self.patient)), [self.at_own_lab.pk, self.elsewhere.pk])
+        self.assertEqual(ids(self.list(self.other_patient)), [self.other.pk])
+
+    def test_lab_owners_see_their_labs_and_their_own_bookings(self):
+        self.assertEqual(ids(self.list(self.owner)), [self.at_own_lab.pk, self.owner_booking.pk])
+
+    def test_admins_see_everything(self):
+        self.assertEqual(
+            ids(self.list(self.admin)), [self.at_own_lab.pk, self.elsewhere.pk, self.owner_booking.pk, self.other.pk],
+        )
+
+    def test_other_peoples_bookings_are_not_found(self):
+        client = testing.api_client(self.other_patient)
+        response = client.get(reverse('appointment-detail', kwargs={'pk': self.elsewhere.pk}))
+        self.assertEqual(response.status_code, 404)
+        response = client.patch(reverse('appointment-detail', kwargs={'pk': self.elsewhere.pk}), {'status': 'cancelled'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_offboarded_labs_are_hidden(self):
+        self.own_lab_test.lab.offboard()
+        self.assertEqual(ids(self.list(self.patient)), [self.elsewhere.pk])
+        self.assertEqual(ids(self.list(self.admin)), [self.elsewhere.pk, self.owner_booking.pk, self.other.pk])
+
+    def test_anonymous_requests_are_refused(self):
+        self.assertEqual(testing.api_client().get(reverse('appointment-list')).status_code, 401)
+
+
+class AppointmentFilterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = testing.create_admin()
+        cls.lab = testing.create_lab()
+        cls.test = testing.create_test()
+        cls.first = testing.create_lab_test(cls.lab, cls.test)
+        cls.second = testing.create_lab_test(cls.lab)
+        cls.elsewhere = testing.create_lab_test(test=cls.test)
+        day = timezone.make_aware(datetime(2030, 6, 10, 9))
+        cls.a = testing.create_appointment(lab_test=cls.first, when=day)
+        cls.b = testing.create_appointment(lab_test=cls.second, when=day + timedelta(days=1), status='cancelled')
+        cls.c = testing.create_appointment(lab_test=cls.elsewhere, when=day + timedelta(days=2), status='rescheduled')
+
+    def list(self, **params):
+        return testing.api_client(self.admin).get(reverse('appointment-list'), params)
+
+    def test_date_range_includes_whole_days(self):
+        self.assertEqual(ids(self.list(date_from='2030-06-11', date_to='2030-06-11')), [self.b.pk])
+        self.assertEqual(ids(self.list(date_from='2030-06-11')), [self.b.pk, self.c.pk])
+        self.assertEqual(ids(self.list(date_to='2030-06-10T12:00:00Z')), [self.a.pk])
+
+    def test_status(self):
+        self.assertEqual(ids(self.list(status='cancelled,rescheduled')), [self.b.pk, self.c.pk])
+        response = self.list(status='booked,lost')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('status', response.json())
+
+    def test_lab_test_and_lab_test_ids(self):
+        self.assertEqual(ids(self.list(lab=str(self.lab.pk))), [self.a.pk, self.b.pk])
+        self.assertEqual(ids(self.list(test=str(self.test.pk))), [self.a.pk, self.c.pk])
+        self.assertEqual(ids(self.list(lab_test=f'{self.second.pk},{self.elsewhere.pk}')), [self.b.pk, self.c.pk])
+        self.assertEqual(ids(self.list(lab=str(self.lab.pk), status='booked')), [self.a.pk])
+
+    def test_invalid_values_are_rejected(self):
+        self.assertEqual(self.list(lab='one').json(), {'lab': 'Enter a comma separated list of ids.'})
+        self.assertEqual(self.list(date_from='June').json(), {'date_from': 'Enter a valid date or datetime.'})
+
+
+class WaitlistPromotionTests(TestCase):
+    """However a booking gets cancelled, its slot goes to the waitlist"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lab_test = testing.create_lab_test()
+        cls.when = timezone.now().replace(microsecond=0) + timedelta(days=2)
+        cls.day = timezone.localtime(cls.when).date()
+
+    def setUp(self):
+        self.booking = testing.create_appointment(lab_test=self.lab_test, when=self.when)
+        self.entry = self.wait()
+
+    def wait(self, **fields):
+        return WaitlistEntry.objects.create(user=testing.create_user(), lab_test=self.lab_test, day=self.day, **fields)
+
+    def assertPromoted(self, entry):
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'promoted')
+        self.assertEqual(entry.appointment.user_id, entry.user_id)
+        self.assertEqual(entry.appointment.appointment_time, self.when)
+
+    def assertWaiting(self, entry):
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'waiting')
+
+    def test_cancelling_through_the_api(self):
+        response = testing.api_client(self.booking.user).patch(
+            reverse('appointment-detail', kwargs={'pk': self.booking.pk}), {'status': 'cancelled'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertPromoted(self.entry)
+
+    def test_cancelling_with_the_status_deferred(self):
+        booking = Appointment.objects.only('id', 'lab_test', 'appointment_time').get(pk=self.booking.pk)
+        booking.status = 'cancelled'
+        booking.save()
+        self.assertPromoted(self.entry)
+
+    def test_cancelling_after_refresh(self):
+        booking = Appointment.objects.defer('status').get(pk=self.booking.pk)
+        booking.refresh_from_db()
+        booking.status = 'cancelled'
+        booking.save(update_fields=['status'])
+        self.assertPromoted(self.entry)
+
+    def test_cancelling_through_a_queryset_update(self):
+        other = self.wait()
+        second = testing.create_appointment(lab_test=self.lab_test, when=self.when)
+        self.assertEqual(Appointment.objects.filter(pk__in=[self.booking.pk, second.pk]).update(status='cancelled'), 2)
+        self.assertPromoted(self.entry)
+        self.assertPromoted(other)
+
+    def test_already_cancelled_bookings_promote_nobody(self):
+        Appointment.objects.filter(pk=self.booking.pk).update(status='cancelled')
+        self.assertPromoted(self.entry)
+        later = self.wait()
+        Appointment.objects.filter(pk=self.booking.pk).update(status='cancelled')
+        booking = Appointment.objects.get(pk=self.booking.pk)
+        booking.save()
+        self.assertWaiting(later)
+
+    def test_other_updates_promote_nobody(self):
+        Appointment.objects.filter(pk=self.booking.pk).update(status='completed')
+        self.assertWaiting(self.entry)
+
+    def test_priority_and_window_decide_who_is_promoted(self):
+        outside = self.wait(priority=5, window_start=self.when + timedelta(hours=1))
+        urgent = self.wait(priority=1, window_end=self.when + timedelta(hours=1))
+        self.booking.status = 'cancelled'
+        self.booking.save()
+        self.assertPromoted(urgent)
+        self.assertWaiting(outside)
+        self.assertWaiting(self.entry)
+
+
+class AppointmentConcurrencyTests(TestCase):
+    """ETags survive gzip: weak tags match for If-Match and If-None-Match"""
+
+    def setUp(self):
+        self.appointment = testing.create_appointment()
+        self.client = testing.api_client(self.appointment.user)
+        self.url = reverse('appointment-detail', kwargs={'pk': self.appointment.pk})
+
+    def get_etag(self, **headers):
+        response = self.client.get(self.url, **headers)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def update(self, etag, status):
+        return self.client.patch(self.url, {'status': status}, HTTP_IF_MATCH=etag)
+
+    def test_if_match_with_a_strong_etag(self):
+        etag = self.get_etag()
+        self.assertFalse(etag.startswith('W/'))
+        self.assertEqual(self.update(etag, 'rescheduled').status_code, 200)
+
+    @override_settings(GZIP_MIN_LENGTH=0)
+    @mock.patch.object(GZipMiddleware, 'max_random_bytes', 0)
+    def test_if_match_with_a_gzip_weakened_etag(self):
+        etag = self.get_etag(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(etag.startswith('W/'))
+        self.assertEqual(self.update(etag, 'rescheduled').status_code, 200)
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.status, 'rescheduled')
+
+    @override_settings(GZIP_MIN_LENGTH=0)
+    @mock.patch.object(GZipMiddleware, 'max_random_bytes', 0)
+    def test_stale_etags_are_refused(self):
+        for headers in ({}, {'HTTP_ACCEPT_ENCODING': 'gzip'}):
+            etag = self.get_etag(**headers)
+            self.assertEqual(self.update(etag, 'rescheduled').status_code, 200)
+            self.assertEqual(self.update(etag, 'booked').status_code, 412)
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.status, 'rescheduled')
+
+    @override_settings(GZIP_MIN_LENGTH=0)
+    @mock.patch.object(GZipMiddleware, 'max_random_bytes', 0)
+    def test_if_none_match_with_a_gzip_weakened_etag(self):
+        etag = self.get_etag(HTTP_ACCEPT_ENCODING='gzip')
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+SHARDS = ['appointments_0', 'appointments_1']
+
+
+@override_settings(APPOINTMENT_SHARDS=SHARDS)
+class ShardedAppointmentTests(TransactionTestCase):
+    """Appointments spread over two shards, read back through the API"""
+    databases = {'default', *SHARDS}
+
+    def setUp(self):
+        for alias in SHARDS:
+            sharding.reserve_id_range(alias)
+        sharding._lab_for_lab_test.clear()
+        self.addCleanup(sharding._lab_for_lab_test.clear)
+        self.admin = testing.create_admin()
+        # One lab on each shard
+        self.lab_tests = {}
+        while len(self.lab_tests) < len(SHARDS):
+            lab = testing.create_lab()
+            self.lab_tests.setdefault(sharding.shard_for_lab(lab.pk), testing.create_lab_test(lab))
+        start = timezone.now().replace(microsecond=0) + timedelta(days=1)
+        self.bookings = [
+            testing.create_appointment(lab_test=self.lab_tests[SHARDS[n % 2]], when=start + timedelta(hours=n))
+            for n in range(6)
+        ]
+
+    def list(self, **params):
+        return testing.api_client(self.admin).get(reverse('appointment-list'), params)
+
+    def test_bookings_are_stored_on_their_labs_shard(self):
+        for alias, lab_test in self.lab_tests.items():
+            stored = Appointment.objects.using(alias).filter(lab_test=lab_test)
+            self.assertEqual(stored.count(), 3)
+            self.assertTrue(all(pk // sharding.ID_RANGE == SHARDS.index(alias) + 1 for pk in stored.values_list('pk', flat=True)))
+        self.assertFalse(Appointment.objects.using('default').exists())
+
+    def test_list_merges_the_shards_in_time_order(self):
+        self.assertEqual(ids(self.list()), [booking.pk for booking in self.bookings])
+
+    def test_pages_read_only_offset_plus_limit_rows_per_shard(self):
+        fetched = []
+        every_database = sharding._on_every_database
+
+        def spy(function):
+            results = every_database(function)
+            fetched.append(results)
+            return results
+
+        with mock.patch.object(AppointmentViewSet, 'pagination_class', LimitOffsetPagination), \
+                mock.patch.object(sharding, '_on_every_database', spy):
+            response = self.list(limit=2, offset=2)
+        self.assertEqual(response.json()['count'], 6)
+        self.assertEqual([row['id'] for row in response.json()['results']], [b.pk for b in self.bookings[2:4]])
+        # One COUNT per database, then at most offset + limit rows from each
+        counts, rows = fetched
+        self.assertEqual(counts, [0, 3, 3])
+        self.assertTrue(all(len(part) <= 4 for part in rows))
+
+    def test_merged_rows_slices(self):
+        queryset = Appointment.objects.order_by('appointment_time', 'id')
+        rows = sharding.MergedRows(queryset, key=lambda a: (a.appointment_time, a.id))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual([a.pk for a in rows[1:4]], [b.pk for b in self.bookings[1:4]])
+        self.assertEqual(rows[5].pk, self.bookings[5].pk)
+        self.assertEqual([a.pk for a in rows], [b.pk for b in self.bookings])
+        with self.assertRaises(IndexError):
+            rows[6]
+
+    def test_retrieve_and_update_find_the_right_shard(self):
+        booking = self.bookings[1]
+        client = testing.api_client(self.admin)
+        url = reverse('appointment-detail', kwargs={'pk': booking.pk})
+        self.assertEqual(client.get(url).json()['id'], booking.pk)
+        self.assertEqual(client.patch(url, {'status': 'rescheduled'}).status_code, 200)
+        self.assertEqual(Appointment.objects.using(booking._state.db).get(pk=booking.pk).status, 'rescheduled')
+
+    def test_cancelling_on_a_shard_promotes_the_waitlist(self):
+        booking = self.bookings[1]
+        entry = WaitlistEntry.objects.create(
+            user=testing.create_user(), lab_test=booking.lab_test,
+            day=timezone.localtime(booking.appointment_time).date(),
+        )
+        booking.status = 'cancelled'
+        booking.save()
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'promoted')
+        promoted = Appointment.objects.using(booking._state.db).get(user=entry.user)
+        self.assertEqual(promoted.appointment_time, booking.appointment_time)
+
+    def test_cached_labs_expire(self):
+        lab_test = self.lab_tests[SHARDS[0]]
+        other_lab = self.lab_tests[SHARDS[1]].lab_id
+        self.assertEqual(sharding.lab_id_for_lab_test(lab_test.pk), lab_test.lab_id)
+        # Moved by another process: no signal reaches this one
+        LabTest.objects.filter(pk=lab_test.pk).update(lab_id=other_lab)
+        self.assertEqual(sharding.lab_id_for_lab_test(lab_test.pk), lab_test.lab_id)
+        later = time.monotonic() + settings.SHARD_LAB_CACHE_TTL
+        with mock.patch('appointments.sharding.time.monotonic', return_value=later):
+            self.assertEqual(sharding.lab_id_for_lab_test(lab_test.pk), other_lab)
+
+
+class AppointmentEventTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = testing.create_user('lab_owner')
+        cls.lab_test = testing.create_lab_test(testing.create_lab(cls.owner))
+
+    def setUp(self):
+        self.appointment = testing.create_appointment(lab_test=self.lab_test)
+
+    def types(self):
+        return list(AppointmentEvent.objects.filter(appointment_id=self.appointment.pk).order_by('id').values_list(
+            'type', 'status', 'previous_status',
+        ))
+
+    def test_tracked_changes_are_logged(self):
+        appointment = Appointment.objects.get(pk=self.appointment.pk)
+        appointment.appointment_time += timedelta(hours=2)
+        appointment.save()
+        appointment.status = 'rescheduled'
+        appointment.save()
+        appointment.save()
+        self.assertEqual(self.types(), [
+            ('created', 'booked', ''), ('updated', 'booked', ''), ('status_changed', 'rescheduled', 'booked'),
+        ])
+        updated = AppointmentEvent.objects.get(type='updated')
+        self.assertEqual(updated.appointment_time, self.appointment.appointment_time + timedelta(hours=2))
+
+    def test_changes_to_deferred_fields_are_logged(self):
+        appointment = Appointment.objects.only('id').get(pk=self.appointment.pk)
+        appointment.appointment_time = self.appointment.appointment_time + timedelta(days=1)
+        appointment.save(update_fields=['appointment_time'])
+        self.assertEqual([row[0] for row in self.types()], ['created', 'updated'])
+
+    def test_untracked_saves_are_not_logged(self):
+        appointment = Appointment.objects.get(pk=self.appointment.pk)
+        appointment.save(update_fields=['updated_at'])
+        self.assertEqual([row[0] for row in self.types()], ['created'])
+
+    def test_status_updates_through_the_queryset_are_logged(self):
+        before = Appointment.objects.values_list('version', 'updated_at').get(pk=self.appointment.pk)
+        Appointment.objects.filter(pk=self.appointment.pk).update(status='cancelled')
+        Appointment.objects.filter(pk=self.appointment.pk).update(status='cancelled')
+        self.assertEqual(self.types(), [('created', 'booked', ''), ('status_changed', 'cancelled', 'booked')])
+        version, updated_at = Appointment.objects.values_list('version', 'updated_at').get(pk=self.appointment.pk)
+        self.assertEqual(version, before[0] + 2)
+        self.assertGreater(updated_at, before[1])
+
+    def test_cursor_pages(self):
+        first = events.read([0], limit=1)
+        self.assertEqual([event['type'] for event in first['events']], ['created'])
+        self.appointment.status = 'completed'
+        self.appointment.save()
+        second = events.read(events.parse_cursor(first['cursor']))
+        self.assertEqual([event['status'] for event in second['events']], ['completed'])
+        self.assertEqual(events.read(events.parse_cursor(second['cursor']))['events'], [])
+
+    def test_recent_events_are_held_back_where_ids_are_not_in_commit_order(self):
+        self.assertEqual(len(events.read([0])['events']), 1)
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            self.assertEqual(events.read([0])['events'], [])
+            AppointmentEvent.objects.update(created_at=timezone.now() - timedelta(seconds=3))
+            self.assertEqual(len(events.read([0])['events']), 1)
+
+    @override_settings(APPOINTMENT_EVENTS_SYNC_MAX_WAIT=0.05, APPOINTMENT_EVENTS_POLL_INTERVAL=0.01)
+    def test_the_sync_view_caps_the_long_poll(self):
+        client = testing.api_client(self.owner)
+        cursor = client.get(reverse('appointment-events'), {'cursor': 'latest'}).json()['cursor']
+        started = time.monotonic()
+        response = client.get(reverse('appointment-events'), {'cursor': cursor, 'wait': 30})
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(response.json(), {'events': [], 'cursor': cursor})
+
+
+class LabCalendarTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = testing.create_user('lab_owner')
+        cls.lab = testing.create_lab(cls.owner)
+        cls.lab_test = testing.create_lab_test(cls.lab)
+
+    def setUp(self):
+        cache.clear()
+        self.appointment = testing.create_appointment(lab_test=self.lab_test)
+        self.feed_url = reverse('lab-calendar-feed', args=[self.lab.pk])
+        self.sync_url = reverse('lab-calendar-sync', args=[self.lab.pk])
+        self.key = ical.feed_key(self.lab)
+
+    def feed(self, key=None, **headers):
+        return self.client.get(self.feed_url, {'key': key or self.key}, **headers)
+
+    def sync(self, token=None):
+        params = {'key': self.key}
+        if token is not None:
+            params['token'] = token
+        return self.client.get(self.sync_url, params)
+
+    def test_feed_key(self):
+        response = self.feed()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        self.assertIn(f'UID:appointment-{self.appointment.pk}@', response.content.decode())
+        self.assertEqual(self.feed(key='forged').status_code, 403)
+        self.assertEqual(self.client.get(self.feed_url).status_code, 401)
+        self.assertEqual(testing.api_client(self.owner).get(self.feed_url).status_code, 200)
+        self.assertEqual(testing.api_client(testing.create_user('lab_owner')).get(self.feed_url).status_code, 403)
+
+    def test_links_carry_the_key_which_changes_with_the_owner(self):
+        links = testing.api_client(self.owner).get(reverse('lab-calendar', args=[self.lab.pk])).json()
+        self.assertTrue(links['feed_url'].endswith(f'?key={self.key}'))
+        self.lab.owner = testing.create_user('lab_owner')
+        self.lab.save()
+        self.assertEqual(self.feed().status_code, 403)
+
+    def test_not_modified(self):
+        etag = self.feed()['ETag']
+        response = self.feed(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.feed(HTTP_IF_NONE_MATCH=f'W/{etag}').status_code, 304)
+        self.appointment.status = 'cancelled'
+        self.appointment.save()
+        response = self.feed(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('STATUS:CANCELLED', response.content.decode())
+
+    @override_settings(GZIP_MIN_LENGTH=0)
+    @mock.patch.object(GZipMiddleware, 'max_random_bytes', 0)
+    def test_not_modified_with_a_gzip_weakened_etag(self):
+        etag = self.feed(HTTP_ACCEPT_ENCODING='gzip')['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        self.assertEqual(self.feed(HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_sync_token(self):
+        first = self.sync().json()
+        self.assertEqual([row['id'] for row in first['appointments']], [self.appointment.pk])
+        self.assertEqual(first['deleted'], [])
+
+        # Tokens step back CALENDAR_SYNC_OVERLAP, so move the unchanged row out of it
+        Appointment.objects.filter(pk=self.appointment.pk).update(updated_at=timezone.now() - timedelta(minutes=1))
+        added = testing.create_appointment(lab_test=self.lab_test)
+        deleted = testing.create_appointment(lab_test=self.lab_test)
+        deleted_pk = deleted.pk
+        deleted.delete()
+        second = self.sync(first['token']).json()
+        self.assertEqual([row['id'] for row in second['appointments']], [added.pk])
+        self.assertEqual(second['deleted'], [deleted_pk])
+
+    def test_sync_token_errors(self):
+        self.assertEqual(self.sync('soon').status_code, 400)
+        expired = ical.make_token(timezone.now() - settings.APPOINTMENT_EVENT_RETENTION - timedelta(days=1))
+        response = self.sync(expired)
+        self.assertEqual(response.status_code, 410)
+
+
+class AnalyticsTests(TestCase):
+    """Four weeks of March 2024 in Berlin; the clocks go forward on Sunday the 31st"""
+    tz = ZoneInfo('Europe/Berlin')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lab = testing.create_lab()
+        cls.lab_test = testing.create_lab_test(cls.lab, testing.create_test(duration_minutes=30))
+        bookings = [
+            (4, 9, 0), (11, 9, 0), (11, 9, 0),  # Mondays
+            (19, 10, 0),  # Tuesday
+            (25, 9, 0), (27, 14, 0),  # Monday, Wednesday
+            (31, 1, 30), (31, 10, 0),  # Sunday, before and after the change
+        ]
+        for day, hour, minute in bookings:
+            cls.book(day, hour, minute)
+        cls.book(18, 9, 0, status='cancelled')
+
+    @classmethod
+    def book(cls, day, hour, minute, **fields):
+        when = datetime(2024, 3, day, hour, minute, tzinfo=cls.tz)
+        return testing.create_appointment(lab_test=cls.lab_test, when=when, **fields)
+
+    def analyze(self, weeks=2):
+        with timezone.override(self.tz):
+            return analytics.analyze(
+                self.lab, datetime(2024, 3, 4, tzinfo=self.tz), datetime(2024, 4, 1, tzinfo=self.tz), weeks=weeks,
+            )
+
+    def test_heatmap(self):
+        result = self.analyze()
+        heatmap = result['tests'][0]['occupancy']
+        cells = {(day, hour): count for day, row in enumerate(heatmap) for hour, count in enumerate(row) if count}
+        self.assertEqual(cells, {(0, 9): 4, (1, 10): 1, (2, 14): 1, (6, 1): 1, (6, 10): 1})
+        self.assertEqual(result['occupancy'], heatmap)
+        self.assertEqual((result['appointments'], result['tests'][0]['cancelled']), (8, 1))
+
+    def test_utilization(self):
+        test = self.analyze()['tests'][0]
+        # 4 x 30 minutes in the four hours Monday 9:00 offered
+        self.assertEqual(test['utilization_by_hour'][0][9], 0.5)
+        # 8 x 30 minutes out of four weeks less the hour skipped by DST
+        self.assertEqual(test['utilization'], round(240 / ((4 * 168 - 1) * 60), 4))
+        self.assertEqual(test['busiest_hours'][0], {'weekday': 0, 'hour': 9, 'appointments': 4, 'utilization': 0.5})
+
+    def test_moving_average_and_forecast(self):
+        result = self.analyze(weeks=2)
+        test = result['tests'][0]
+        self.assertEqual(result['forecast_weeks'], 2)
+        self.assertEqual(
+            [(week['week'], week['appointments'], week['moving_average']) for week in test['weekly']],
+            [('2024-03-04', 1, None), ('2024-03-11', 2, 1.5), ('2024-03-18', 1, 1.5), ('2024-03-25', 4, 2.5)],
+        )
+        # The last two weeks, cell by cell
+        self.assertEqual(test['forecast_next_week'], 2.5)
+        self.assertEqual(test['forecast_by_hour'][0][9], 0.5)
+        self.assertEqual(test['forecast_by_hour'][6][10], 0.5)
+
+    def test_cached_results_follow_the_catalog(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        since, until = datetime(2024, 3, 4, tzinfo=self.tz), datetime(2024, 4, 1, tzinfo=self.tz)
+        with timezone.override(self.tz):
+            self.assertNotEqual(analytics.cached_analysis(self.lab, since, until)['tests'][0]['test'], 'Renamed')
+            test = self.lab_test.test
+            test.name = 'Renamed'
+            test.save()
+            self.assertEqual(analytics.cached_analysis(self.lab, since, until)['tests'][0]['test'], 'Renamed')
+
+    def test_chunked_reads(self):
+        queryset = Appointment.objects.filter(lab_test=self.lab_test)
+        epochs, lab_test_ids, cancelled = analytics.columns(queryset, chunk_size=2)
+        self.assertEqual(len(epochs), 9)
+        self.assertEqual(set(lab_test_ids.tolist()), {self.lab_test.pk})
+        self.assertEqual(int(cancelled.sum()), 1)
+        self.assertEqual(sorted(epochs.tolist()), sorted(int(a.appointment_time.timestamp()) for a in queryset))
+
+
+class SeriesTests(TestCase):
+    tz = ZoneInfo('Europe/Berlin')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = testing.create_user()
+        cls.lab_test = testing.create_lab_test()
+
+    def create_series(self, start, count=3, **fields):
+        return AppointmentSeries.objects.create(
+            user=self.user, lab_test=self.lab_test, start=start, count=count, next_at=start, **fields,
+        )
+
+    def test_expansion_keeps_the_local_time_across_dst(self):
+        # Berlin moves its clocks forward on Sunday 31 March 2030
+        series = self.create_series(datetime(2030, 3, 25, 9, tzinfo=self.tz))
+        with timezone.override(self.tz):
+            times = [when for _, when in recurring.expand(series, series.start, series.start + timedelta(days=30))]
+        self.assertEqual([when.astimezone(self.tz).hour for when in times], [9, 9, 9])
+        # ... which makes the week with the change an hour short
+        gaps = [(later.timestamp() - earlier.timestamp()) / 3600 for earlier, later in zip(times, times[1:])]
+        self.assertEqual(gaps, [7 * 24 - 1, 7 * 24])
+
+    def test_moving_and_skipping_unmaterialized_occurrences(self):
+        start = timezone.now() + timedelta(days=60)
+        series = self.create_series(start, count=4)
+        moved = recurring.move(series, 1, start + timedelta(days=8))
+        recurring.skip(series, 2)
+        series.refresh_from_db()
+        self.assertEqual(series.exceptions, [1, 2])
+        self.assertEqual((moved.series_id, moved.occurrence), (series.pk, 1))
+
+        rows = recurring.occurrences(series, start, start + timedelta(days=30))
+        self.assertEqual(
+            [(row['occurrence'], row['appointment']) for row in rows],
+            [(0, None), (1, moved.pk), (3, None)],
+        )
+        # Moving it again updates the same row
+        self.assertEqual(recurring.move(series, 1, start + timedelta(days=9)).pk, moved.pk)
+        self.assertEqual(recurring.materialized(series).count(), 1)
+        with self.assertRaises(ValueError):
+            recurring.skip(series, 4)
+
+    def test_skipping_a_materialized_occurrence_cancels_it(self):
+        series = self.create_series(timezone.now() + timedelta(days=1))
+        recurring.materialize(series, timezone.now() + timedelta(days=2))
+        recurring.skip(series, 0)
+        self.assertEqual(recurring.materialized(series).get(occurrence=0).status, 'cancelled')
+
+    def test_materialize_due_is_idempotent(self):
+        series = self.create_series(timezone.now() + timedelta(days=1, hours=1), count=5)
+        self.assertEqual(recurring.materialize_due(ahead=timedelta(days=15)), 2)
+        self.assertEqual(recurring.materialize_due(ahead=timedelta(days=15)), 0)
+        # As if a run died between creating the rows and saving its progress
+        AppointmentSeries.objects.filter(pk=series.pk).update(materialized=0, next_at=series.start)
+        self.assertEqual(recurring.materialize_due(ahead=timedelta(days=15)), 0)
+        self.assertEqual(sorted(recurring.materialized(series).values_list('occurrence', flat=True)), [0, 1])
+        series.refresh_from_db()
+        self.assertEqual((series.materialized, series.next_at), (2, series.occurrence_time(2)))
+
+    def test_cancel(self):
+        series = self.create_series(timezone.now() + timedelta(days=1))
+        recurring.materialize(series, timezone.now() + timedelta(days=9))
+        recurring.cancel(series)
+        series.refresh_from_db()
+        self.assertEqual((series.status, series.next_at), ('cancelled', None))
+        self.assertEqual(set(recurring.materialized(series).values_list('status', flat=True)), {'cancelled'})
+        # Nothing left to expand
+        rows = recurring.occurrences(series, timezone.now(), timezone.now() + timedelta(days=30))
+        self.assertEqual([row['occurrence'] for row in rows], [0, 1])
+        self.assertEqual(recurring.materialize_due(ahead=timedelta(days=30)), 0)
+
+    def test_cancel_is_all_or_nothing(self):
+        series = self.create_series(timezone.now() + timedelta(days=1))
+        recurring.materialize(series, timezone.now() + timedelta(days=9))
+        with mock.patch.object(Appointment, 'save', side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            recurring.cancel(series)
+        series.refresh_from_db()
+        self.assertEqual(series.status, 'active')
+        self.assertEqual(set(recurring.materialized(series).values_list('status', flat=True)), {'booked'})
@@ -1,10 +1,28 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import AppointmentViewSet
+from core.async_views import async_read_view
+from .views import (
+    AppointmentEventsView, AppointmentSeriesViewSet, AppointmentViewSet, AsyncAppointmentEventsView,
+    LabAnalyticsView, LabCalendarFeedView, LabCalendarLinksView, LabCalendarSyncView, WaitlistEntryViewSet,
+)
 
 router = DefaultRouter()
+# Registered before the appointment routes so 'waitlist/' and 'series/'
+# are not taken for an appointment pk.
+router.register(r'waitlist', WaitlistEntryViewSet)
+router.register(r'series', AppointmentSeriesViewSet)
 router.register(r'', AppointmentViewSet)
 
 urlpatterns = [
+    # Before the router, whose detail route would take these as a pk
+    path(
+        'events/',
+        async_read_view('appointment-events', AsyncAppointmentEventsView, AppointmentEventsView.as_view()),
+        name='appointment-events',
+    ),
+    path('calendar/<int:lab_id>/', LabCalendarLinksView.as_view(), name='lab-calendar'),
+    path('calendar/<int:lab_id>.ics', LabCalendarFeedView.as_view(), name='lab-calendar-feed'),
+    path('calendar/<int:lab_id>/sync/', LabCalendarSyncView.as_view(), name='lab-calendar-sync'),
+    path('analytics/<int:lab_id>/', LabAnalyticsView.as_view(), name='lab-analytics'),
     path('', include(router.urls)),
 ]
@@ -1,9 +1,314 @@
-from rest_framework import viewsets
-from .models import Appointment
-from .serializers import AppointmentSerializer
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, NotAuthenticated, PermissionDenied, ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from asgiref.sync import sync_to_async
+from .filters import AppointmentFilterBackend, parse_boundary
+from .models import Appointment, AppointmentSeries, WaitlistEntry
+from .serializers import (
+    AppointmentSerializer, AppointmentSeriesSerializer, OccurrenceMoveSerializer, WaitlistEntrySerializer,
+)
 from rest_framework import permissions
+from core.async_views import AsyncReadView
+from core.concurrency import etag_matches
+from core.idempotency import IdempotentCreateMixin
+from labs.models import Laboratory
+from core.mixins import ConditionalUpdateMixin, ProjectionListMixin, SparseFieldsetMixin
+from . import analytics, events, ical, series as recurring, sharding
 
-class AppointmentViewSet(viewsets.ModelViewSet):
+class AppointmentViewSet(IdempotentCreateMixin, ConditionalUpdateMixin, SparseFieldsetMixin, ProjectionListMixin, viewsets.ModelViewSet):
     queryset = Appointment.objects.all()
     serializer_class = AppointmentSerializer
-    permission_classes = [permissions.IsAuthenticated]
\ No newline at end of file
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [AppointmentFilterBackend]
+
+    def get_queryset(self):
+        """
+        Scope appointments by role: admins see everything, lab owners see
+        bookings for their laboratories (and their own), everyone else only
+        their own bookings. Bookings at offboarded labs are hidden.
+        """
+        queryset = super().get_queryset().exclude(lab_test__in=sharding.lab_test_ids(lab__is_active=False))
+        user = self.request.user
+
+        if not user.is_admin:
+            if user.role == 'lab_owner':
+                owned_lab_tests = sharding.lab_test_ids(lab__owner=user)
+                queryset = queryset.filter(Q(lab_test__in=owned_lab_tests) | Q(user=user))
+            else:
+                queryset = queryset.filter(user=user)
+
+        return queryset.order_by('appointment_time', 'id')
+
+    # With appointment shards enabled, lists and lookups run on every shard
+    # (sharding.MergedRows). Shards cannot join to LabTest, so ?expand=
+    # is ignored there.
+
+    def get_requested_expand(self):
+        if sharding.is_enabled():
+            return None
+        return super().get_requested_expand()
+
+    def list(self, request, *args, **kwargs):
+        if not sharding.is_enabled():
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        projection = self.get_projection()
+        if projection is None:
+            key = lambda a: (a.appointment_time, a.id)
+        else:
+            # Trailing sort columns are ignored by the projection converter
+            queryset = queryset.values_list(*projection.lookups, 'appointment_time', 'id')
+            key = lambda row: (row[-2], row[-1])
+        # A paginator slices this, which reads only offset + limit rows per shard
+        rows = sharding.MergedRows(queryset, key)
+        page = self.paginate_queryset(rows)
+        objects = list(rows) if page is None else page
+        data = self.get_serializer(objects, many=True).data if projection is None else projection.data(objects)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    def get_object(self):
+        if not sharding.is_enabled():
+            return super().get_object()
+
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        for alias in sharding.aliases_for_pk(lookup):
+            try:
+                instance = queryset.using(alias).get(**{self.lookup_field: lookup})
+            except (Appointment.DoesNotExist, TypeError, ValueError):
+                continue
+            self.check_object_permissions(self.request, instance)
+            return instance
+        raise Http404
+
+
+class WaitlistEntryViewSet(mixins.CreateModelMixin,
+                           mixins.ListModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    Join, inspect and leave waitlists. Patients only see their own entries;
+    leaving marks the entry cancelled so the queue keeps its history.
+    """
+    queryset = WaitlistEntry.objects.all()
+    serializer_class = WaitlistEntrySerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = super().get_queryset().filter(lab_test__lab__is_active=True)
+        if not self.request.user.is_admin:
+            queryset = queryset.filter(user=self.request.user)
+        if self.request.query_params.get('status'):
+            queryset = queryset.filter(status=self.request.query_params['status'])
+        return queryset.order_by('day', 'created_at')
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    def perform_destroy(self, instance):
+        WaitlistEntry.objects.filter(pk=instance.pk, status='waiting').update(status='cancelled')
+
+
+class AppointmentSeriesViewSet(mixins.CreateModelMixin,
+                               mixins.ListModelMixin,
+                               mixins.RetrieveModelMixin,
+                               mixins.DestroyModelMixin,
+                               viewsets.GenericViewSet):
+    """
+    Recurring bookings (see appointments.series). Patients only see their
+    own series; deleting one cancels it and its upcoming bookings.
+
+        GET    series/<id>/occurrences/?date_from=&date_to=
+        PATCH  series/<id>/occurrences/<n>/   {"appointment_time": ...}
+        DELETE series/<id>/occurrences/<n>/   skip one occurrence
+    """
+    queryset = AppointmentSeries.objects.all()
+    serializer_class = AppointmentSeriesSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = super().get_queryset().filter(lab_test__lab__is_active=True)
+        if not self.request.user.is_admin:
+            queryset = queryset.filter(user=self.request.user)
+        return queryset.order_by('start', 'id')
+
+    def perform_create(self, serializer):
+        series = serializer.save(user=self.request.user, next_at=serializer.validated_data['start'])
+        # Occurrences that are already close become bookings right away
+        recurring.materialize(series, timezone.now() + settings.SERIES_MATERIALIZE_AHEAD)
+        series.refresh_from_db()
+
+    def perform_destroy(self, instance):
+        recurring.cancel(instance)
+
+    @action(detail=True, methods=['get'])
+    def occurrences(self, request, pk=None):
+        series = self.get_object()
+        params = request.query_params
+        since = timezone.now()
+        if params.get('date_from'):
+            since = parse_boundary(params['date_from'], 'date_from')
+        until = since + settings.SERIES_DEFAULT_WINDOW
+        if params.get('date_to'):
+            until = parse_boundary(params['date_to'], 'date_to', end=True)
+        return Response(recurring.occurrences(series, since, until))
+
+    @action(detail=True, methods=['patch', 'delete'], url_path=r'occurrences/(?P<index>\d+)')
+    def occurrence(self, request, pk=None, index=None):
+        series = self.get_object()
+        if series.status != 'active':
+            raise ValidationError('This series is no longer active.')
+        try:
+            if request.method == 'DELETE':
+                recurring.skip(series, int(index))
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            serializer = OccurrenceMoveSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            appointment = recurring.move(series, int(index), serializer.validated_data['appointment_time'])
+        except ValueError as e:
+            raise ValidationError({'occurrence': str(e)})
+        return Response(AppointmentSerializer(appointment).data)
+
+
+class AppointmentEventsView(APIView):
+    """
+    Appointment changes after ?cursor=, oldest first, with the cursor to
+    pass next time. ?lab= narrows to one laboratory, ?limit= caps the page
+    and ?wait=N holds the request up to N seconds until something happens
+    (at most settings.APPOINTMENT_EVENTS_SYNC_MAX_WAIT on this sync path).
+    Lab owners see their own laboratories' events; admins see all.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        return Response(events.wait_for(*events.parse_request(request)))
+
+
+class AsyncAppointmentEventsView(AsyncReadView):
+    """
+    Async path for AppointmentEventsView: long-polls without holding a
+    thread. Invalid requests go to the sync view for its error responses.
+    """
+
+    def can_serve(self, request, kwargs):
+        return request.method == 'GET' and 'text/html' not in request.headers.get('Accept', '')
+
+    async def get(self, request):
+        try:
+            params = await sync_to_async(events.parse_request)(request)
+        except APIException:
+            return None
+        return self.render(await events.await_for(*params))
+
+
+
+class LabCalendarView(APIView):
+    """
+    Base for a laboratory's calendar endpoints: open to its owner and to
+    admins, or to anyone holding the lab's feed key (?key=), since
+    calendar apps cannot send a bearer token.
+    """
+    permission_classes = [permissions.AllowAny]
+    allow_feed_key = True
+
+    def get_lab(self, request, lab_id):
+        lab = get_object_or_404(Laboratory, pk=lab_id, is_active=True)
+        key = request.query_params.get('key')
+        if key is not None and self.allow_feed_key:
+            if not ical.valid_feed_key(lab, key):
+                raise PermissionDenied('Invalid calendar key.')
+            return lab
+        user = request.user
+        if not user.is_authenticated:
+            raise NotAuthenticated()
+        if not (user.is_admin or lab.owner_id == user.pk):
+            raise PermissionDenied('You do not own this laboratory.')
+        return lab
+
+
+class LabCalendarLinksView(LabCalendarView):
+    """Subscription URLs for a laboratory's calendar"""
+    allow_feed_key = False
+
+    def get(self, request, lab_id):
+        lab = self.get_lab(request, lab_id)
+        query = f'?key={ical.feed_key(lab)}'
+        return Response({
+            'feed_url': request.build_absolute_uri(reverse('lab-calendar-feed', args=[lab.pk]) + query),
+            'sync_url': request.build_absolute_uri(reverse('lab-calendar-sync', args=[lab.pk]) + query),
+        })
+
+
+class LabCalendarFeedView(LabCalendarView):
+    """iCalendar feed of a laboratory's appointments, with ETag / 304"""
+
+    def get(self, request, lab_id):
+        lab = self.get_lab(request, lab_id)
+        etag = ical.feed_etag(lab)
+        # Weak comparison: gzip turns the ETag into W/"..."
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(ical.cached_feed(lab, etag), content_type='text/calendar; charset=utf-8')
+        response['ETag'] = etag
+        return response
+
+
+class LabCalendarSyncView(LabCalendarView):
+    """
+    Appointments of a laboratory changed since ?token=, the ids deleted
+    since, and the token for the next call. Without a token, everything in
+    the feed window. 410 means the token is too old: start over without one.
+    """
+
+    def get(self, request, lab_id):
+        lab = self.get_lab(request, lab_id)
+        try:
+            return Response(ical.sync(lab, request.query_params.get('token')))
+        except ical.TokenExpired:
+            return Response({'detail': 'Sync token expired; sync again without a token.'}, status=410)
+
+
+class LabAnalyticsView(LabCalendarView):
+    """
+    Demand heatmaps, utilization, busy hours and forecasts per lab test for
+    a laboratory (see appointments.analytics). Covers the last
+    settings.ANALYTICS_DEFAULT_DAYS unless ?since= / ?until= are given;
+    ?weeks= sets the forecast window and ?capacity= how many appointments
+    of one lab test can run at once.
+    """
+    allow_feed_key = False
+
+    def get(self, request, lab_id):
+        lab = self.get_lab(request, lab_id)
+        params = request.query_params
+        since, until = analytics.default_window()
+        if params.get('since'):
+            since = parse_boundary(params['since'], 'since')
+        if params.get('until'):
+            # A bare date includes that whole day
+            until = parse_boundary(params['until'], 'until', end=True) + timedelta(microseconds=1)
+        if since >= until:
+            raise ValidationError({'since': 'Must be before until.'})
+        try:
+            weeks = int(params.get('weeks', settings.ANALYTICS_FORECAST_WEEKS))
+            capacity = int(params.get('capacity', settings.ANALYTICS_DEFAULT_CAPACITY))
+        except ValueError:
+            raise ValidationError('weeks and capacity must be whole numbers.')
+        if weeks < 1 or capacity < 1:
+            raise ValidationError('weeks and capacity must be positive.')
+        return Response(analytics.cached_analysis(lab, since, until, weeks, capacity))
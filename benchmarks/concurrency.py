@@ -0,0 +1,264 @@
+"""
+WSGI threads vs ASGI under many concurrent connections.
+
+Starts the project under gunicorn (gthread workers, sync views) and under
+uvicorn (async read views from core.async_views) against the same
+throwaway SQLite file, then holds a fixed number of keep-alive connections
+open against each and records throughput and latency. Slow clients send
+their request in two halves with a pause in between, which ties up a
+worker thread under WSGI but costs nothing under ASGI.
+
+Needs the gunicorn and uvicorn packages, which are not runtime
+dependencies of the project.
+"""
+import asyncio
+import importlib.util
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import datagen
+from .suite import percentile
+
+SERVERS = ('wsgi', 'asgi')
+DEFAULT_PATHS = ['/api/labs/laboratories/', '/api/tests/']
+
+
+def missing_servers():
+    return [name for name in ('gunicorn', 'uvicorn') if importlib.util.find_spec(name) is None]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _manage(env, *args):
+    subprocess.run(
+        [sys.executable, str(settings.BASE_DIR / 'manage.py'), *args],
+        env=env, check=True, stdout=subprocess.DEVNULL,
+    )
+
+
+def _server_command(kind, port, workers, threads):
+    if kind == 'wsgi':
+        return [
+            sys.executable, '-m', 'gunicorn', 'config.wsgi:application',
+            '--worker-class', 'gthread', '--workers', str(workers), '--threads', str(threads),
+            '--bind', f'127.0.0.1:{port}', '--backlog', '4096', '--log-level', 'warning',
+        ]
+    return [
+        sys.executable, '-m', 'uvicorn', 'config.asgi:application',
+        '--host', '127.0.0.1', '--port', str(port), '--workers', str(workers),
+        '--backlog', '4096', '--log-level', 'warning', '--no-access-log',
+    ]
+
+
+@contextmanager
+def running_server(kind, env, workers, threads, startup_timeout=30):
+    """Start a server process and wait until it answers HTTP"""
+    port = _free_port()
+    env = dict(env)
+    if kind == 'wsgi':
+        env['ASYNC_READ_ROUTES'] = ''
+    process = subprocess.Popen(
+        _server_command(kind, port, workers, threads),
+        cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL,
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        deadline = time.monotonic() + startup_timeout
+        while True:
+            try:
+                urllib.request.urlopen(f'{base_url}/api/tests/', timeout=1).read()
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f'{kind} server did not start')
+                time.sleep(0.2)
+        yield port
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def _login(port, username, password):
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{port}/api/accounts/token/',
+        data=json.dumps({'username': username, 'password': password}).encode(),
+        headers={'Content-Type': 'application/json'},
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())['access']
+
+
+async def _read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ', 2)[1])
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers.get('connection', '').lower() == 'close'
+
+
+async def _client(port, requests, deadline, slow_delay, timeout, stats):
+    """One keep-alive connection issuing requests until the deadline"""
+    reader = writer = None
+    index = 0
+    while time.monotonic() < deadline:
+        request = requests[index % len(requests)]
+        index += 1
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection('127.0.0.1', port), timeout,
+                )
+            if slow_delay:
+                writer.write(request[:16])
+                await writer.drain()
+                await asyncio.sleep(slow_delay)
+                writer.write(request[16:])
+            else:
+                writer.write(request)
+            await writer.drain()
+            status, close = await asyncio.wait_for(_read_response(reader), timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            stats['errors'] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            continue
+
+        stats['latencies'].append((time.perf_counter() - started) * 1000)
+        stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+        if close:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def _load(port, token, paths, connections, slow_clients, slow_delay, duration, timeout):
+    requests = [
+        (
+            f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n'
+            f'Authorization: Bearer {token}\r\nAccept: application/json\r\n\r\n'
+        ).encode()
+        for path in paths
+    ]
+    fast, slow = {'latencies': [], 'statuses': {}, 'errors': 0}, {'latencies': [], 'statuses': {}, 'errors': 0}
+    deadline = time.monotonic() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        _client(port, requests, deadline, slow_delay if i < slow_clients else 0, timeout,
+                slow if i < slow_clients else fast)
+        for i in range(connections)
+    ))
+    return fast, slow, time.perf_counter() - started
+
+
+def _summary(stats, elapsed):
+    latencies = sorted(stats['latencies'])
+    ok = sum(count for status, count in stats['statuses'].items() if status < 400)
+    return {
+        'requests': len(latencies),
+        'ok': ok,
+        'errors': stats['errors'] + len(latencies) - ok,
+        'statuses': {str(k): v for k, v in sorted(stats['statuses'].items())},
+        'throughput_rps': round(ok / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 2) if latencies else None,
+    }
+
+
+def _raise_fd_limit(needed):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+
+
+def run(servers=SERVERS, connections=1000, slow_clients=0, slow_delay=0.5, duration=15,
+        timeout=30, paths=None, workers=1, threads=32, labs=50, tests=100, stdout=None):
+    """Benchmark each server kind in turn and return the result document"""
+    paths = paths or DEFAULT_PATHS
+
+    def log(message):
+        if stdout is not None:
+            stdout.write(message)
+
+    _raise_fd_limit(connections * 2 + 256)
+    workdir = tempfile.mkdtemp(prefix='bench_concurrency_')
+    env = dict(os.environ)
+    env.update({
+        'SQLITE_PATH': os.path.join(workdir, 'db.sqlite3'),
+        'MAX_CONCURRENT_REQUESTS': '0',
+        'PYTHONUNBUFFERED': '1',
+    })
+    env.pop('ASYNC_READ_ROUTES', None)
+    try:
+        log('Preparing database...')
+        _manage(env, 'migrate', '--noinput')
+        _manage(env, 'generate_benchmark_data', '--users', '10', '--lab-owners', '5',
+                '--labs', str(labs), '--tests', str(tests), '--appointments', '0')
+
+        results = []
+        for kind in servers:
+            with running_server(kind, env, workers, threads) as port:
+                token = _login(port, f'{datagen.PREFIX}user_0', datagen.BENCHMARK_PASSWORD)
+                fast, slow, elapsed = asyncio.run(_load(
+                    port, token, paths, connections, slow_clients, slow_delay, duration, timeout,
+                ))
+            result = {'server': kind, 'elapsed_s': round(elapsed, 2), **_summary(fast, elapsed)}
+            if slow_clients:
+                result['slow_clients'] = _summary(slow, elapsed)
+            results.append(result)
+            log(
+                f"  {kind}: {result['throughput_rps']} req/s ok={result['ok']} errors={result['errors']} "
+                f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms"
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'connections': connections,
+            'slow_clients': slow_clients,
+            'slow_delay_s': slow_delay,
+            'duration_s': duration,
+            'paths': paths,
+            'workers': workers,
+            'wsgi_threads': threads,
+            'labs': labs,
+            'tests': tests,
+        },
+        'results': results,
+    }
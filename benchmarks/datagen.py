@@ -0,0 +1,225 @@
+"""
+Synthetic data generator used by the benchmark commands.
+
+Everything is inserted with bulk_create in fixed-size batches, and the
+random generator is seeded so that two runs with the same arguments produce
+the same dataset.
+"""
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import UserCounter
+from appointments.models import Appointment
+from labs.models import Laboratory, LabTest, LabTestPrice
+from tests.models import Test
+
+User = get_user_model()
+
+# Every generated row is tagged with this prefix so it can be found and
+# removed again without touching real data.
+PREFIX = 'bench_'
+
+BENCHMARK_PASSWORD = 'bench-password-123'
+
+TEST_NAMES = [
+    'Complete Blood Count', 'Lipid Panel', 'Liver Function', 'Kidney Function',
+    'Thyroid Panel', 'HbA1c', 'Vitamin D', 'Vitamin B12', 'Iron Studies',
+    'Urinalysis', 'COVID-19 PCR', 'Blood Glucose', 'Electrolytes', 'CRP',
+    'Allergy Panel', 'Coagulation Profile', 'Hepatitis Panel', 'PSA',
+]
+STATUSES = [choice for choice, _ in Appointment.STATUS_CHOICES]
+STATUS_WEIGHTS = [70, 10, 5, 15]
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _bulk_insert(model, objects, batch_size):
+    """Insert objects in batches, one transaction per batch"""
+    created = 0
+    for batch in _batches(objects, batch_size):
+        with transaction.atomic():
+            model.objects.bulk_create(batch, batch_size=batch_size)
+        created += len(batch)
+    return created
+
+
+def clear():
+    """Remove every row created by the generator"""
+    Appointment.objects.filter(user__username__startswith=PREFIX).delete()
+    LabTest.objects.filter(lab__name__startswith=PREFIX).delete()
+    Laboratory.objects.filter(name__startswith=PREFIX).delete()
+    Test.objects.filter(name__startswith=PREFIX).delete()
+    User.objects.filter(username__startswith=PREFIX).delete()
+    # generate() adjusts the counters by hand, so recount rather than
+    # rely on every deletion path having done the reverse
+    UserCounter.objects.reconcile()
+
+
+def generate(users=1000, lab_owners=50, labs=100, tests=200, tests_per_lab=40,
+             appointments=100000, batch_size=5000, seed=42, days=365, stdout=None):
+    """
+    Generate a realistic dataset and return a dict with the number of rows
+    created per model.
+
+    Calling generate() again adds more rows on top of the existing benchmark
+    data, which is how the suite grows the dataset between sizes.
+    """
+    rng = random.Random(seed)
+
+    def log(message):
+        if stdout is not None:
+            stdout.write(message)
+
+    counts = {}
+    now = timezone.now()
+    offset = User.objects.filter(username__startswith=PREFIX).count()
+
+    # Hashing a password is deliberately slow, so every generated account
+    # shares one precomputed hash.
+    password = make_password(BENCHMARK_PASSWORD)
+
+    def make_user(i, role):
+        return User(
+            username=f'{PREFIX}{role}_{offset + i}',
+            email=f'{PREFIX}{role}_{offset + i}@example.com',
+            password=password,
+            role=role,
+            approval_status='approved',
+            is_active=True,
+        )
+
+    counts['users'] = _bulk_insert(
+        User,
+        (make_user(i, 'user') for i in range(users)),
+        batch_size,
+    )
+    counts['lab_owners'] = _bulk_insert(
+        User,
+        (make_user(users + i, 'lab_owner') for i in range(lab_owners)),
+        batch_size,
+    )
+    # Bulk inserts skip User.save(), which keeps the counters otherwise
+    UserCounter.objects.adjust('user', 'approved', True, counts['users'])
+    UserCounter.objects.adjust('lab_owner', 'approved', True, counts['lab_owners'])
+    log(f"Created {counts['users']} users and {counts['lab_owners']} lab owners")
+
+    test_offset = Test.objects.filter(name__startswith=PREFIX).count()
+    counts['tests'] = _bulk_insert(
+        Test,
+        (
+            Test(
+                name=f'{PREFIX}{TEST_NAMES[i % len(TEST_NAMES)]} {test_offset + i}',
+                description='Synthetic benchmark test',
+                duration_minutes=rng.choice([10, 15, 30, 45, 60]),
+            )
+            for i in range(tests)
+        ),
+        batch_size,
+    )
+
+    owner_ids = list(
+        User.objects.filter(username__startswith=f'{PREFIX}lab_owner_')
+        .values_list('id', flat=True)
+    )
+    lab_offset = Laboratory.objects.filter(name__startswith=PREFIX).count()
+    counts['labs'] = _bulk_insert(
+        Laboratory,
+        (
+            Laboratory(
+                name=f'{PREFIX}Laboratory {lab_offset + i}',
+                description='Synthetic benchmark laboratory',
+                address=f'{rng.randint(1, 999)} Benchmark Street',
+                owner_id=rng.choice(owner_ids),
+            )
+            for i in range(labs)
+        ) if owner_ids else (),
+        batch_size,
+    )
+    log(f"Created {counts['tests']} tests and {counts['labs']} laboratories")
+
+    test_ids = list(Test.objects.filter(name__startswith=PREFIX).values_list('id', flat=True))
+    new_lab_ids = list(
+        Laboratory.objects.filter(name__startswith=PREFIX)
+        .order_by('-id').values_list('id', flat=True)[:counts['labs']]
+    )
+    per_lab = min(tests_per_lab, len(test_ids))
+    counts['lab_tests'] = _bulk_insert(
+        LabTest,
+        (
+            LabTest(
+                lab_id=lab_id,
+                test_id=test_id,
+                price=Decimal(rng.randint(500, 50000)) / 100,
+                is_active=rng.random() > 0.05,
+            )
+            for lab_id in new_lab_ids
+            for test_id in rng.sample(test_ids, per_lab)
+        ),
+        batch_size,
+    )
+    # bulk_create skips LabTest.save(), which opens the price history
+    _bulk_insert(
+        LabTestPrice,
+        (
+            LabTestPrice(lab_test_id=lab_test_id, price=price, valid_from=now)
+            for lab_test_id, price in LabTest.objects.filter(
+                lab_id__in=new_lab_ids, prices__isnull=True,
+            ).values_list('id', 'price').iterator()
+        ),
+        batch_size,
+    )
+    log(f"Created {counts['lab_tests']} lab tests")
+
+    user_ids = list(
+        User.objects.filter(username__startswith=f'{PREFIX}user_')
+        .values_list('id', flat=True)
+    )
+    prices = dict(
+        LabTest.objects.filter(lab__name__startswith=PREFIX).values_list('id', 'price')
+    )
+    lab_test_ids = list(prices)
+    if not user_ids or not lab_test_ids:
+        counts['appointments'] = 0
+        return counts
+
+    start = now - timedelta(days=days // 2)
+    span_minutes = days * 24 * 60
+    choice = rng.choice
+    randrange = rng.randrange
+    choices = rng.choices
+
+    def make_appointments():
+        for status in choices(STATUSES, weights=STATUS_WEIGHTS, k=appointments):
+            user_id, lab_test_id = choice(user_ids), choice(lab_test_ids)
+            yield Appointment(
+                user_id=user_id,
+                lab_test_id=lab_test_id,
+                price=prices[lab_test_id],
+                # Round to quarter hours like real bookings
+                appointment_time=start + timedelta(minutes=randrange(0, span_minutes, 15)),
+                status=status,
+            )
+
+    counts['appointments'] = 0
+    for batch in _batches(make_appointments(), batch_size):
+        counts['appointments'] += _bulk_insert(Appointment, batch, batch_size)
+        if counts['appointments'] % (batch_size * 20) == 0:
+            log(f"  ... {counts['appointments']} appointments")
+    log(f"Created {counts['appointments']} appointments")
+
+    return counts
@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks import concurrency, suite
+
+
+class Command(BaseCommand):
+    help = 'Compare gunicorn (WSGI threads) with uvicorn (ASGI, async read views) under many concurrent connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', action='append', dest='servers', choices=concurrency.SERVERS,
+                            help='Only run this server kind (may be repeated)')
+        parser.add_argument('--connections', type=int, default=1000)
+        parser.add_argument('--slow-clients', type=int, default=0,
+                            help='How many of the connections send their requests slowly')
+        parser.add_argument('--slow-delay', type=float, default=0.5,
+                            help='Seconds a slow client pauses in the middle of each request')
+        parser.add_argument('--duration', type=float, default=15)
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--path', action='append', dest='paths',
+                            help=f"Request this path (may be repeated, default {', '.join(concurrency.DEFAULT_PATHS)})")
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--threads', type=int, default=32, help='Threads per gunicorn worker')
+        parser.add_argument('--output', help='Also write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        missing = concurrency.missing_servers()
+        if missing:
+            raise CommandError(f"Install {' and '.join(missing)} to run this benchmark")
+        if options['slow_clients'] > options['connections']:
+            raise CommandError('--slow-clients cannot exceed --connections')
+
+        report = concurrency.run(
+            servers=options['servers'] or concurrency.SERVERS,
+            connections=options['connections'],
+            slow_clients=options['slow_clients'],
+            slow_delay=options['slow_delay'],
+            duration=options['duration'],
+            timeout=options['timeout'],
+            paths=options['paths'],
+            workers=options['workers'],
+            threads=options['threads'],
+            stdout=self.stdout,
+        )
+        report['meta']['git_revision'] = suite.git_revision()
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(report, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
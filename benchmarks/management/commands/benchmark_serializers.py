@@ -0,0 +1,33 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from benchmarks import datagen, serialization, suite
+
+
+class Command(BaseCommand):
+    help = 'Compare serialization CPU of ModelSerializers and list projections for one page'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--output', help='Also write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        page_size = options['page_size']
+        with suite.throwaway_database():
+            datagen.generate(users=200, lab_owners=20, labs=50, tests=100,
+                             appointments=page_size)
+            results = serialization.run(page_size=page_size, repeat=options['repeat'])
+
+        for row in results:
+            self.stdout.write(
+                f"{row['case']:<12} rows={row['rows']:<6} "
+                f"serializer={row['serializer_ms']:.2f}ms projection={row['projection_ms']:.2f}ms "
+                f"({row['speedup']}x), with fetch {row['serializer_with_fetch_ms']:.2f}ms -> "
+                f"{row['projection_with_fetch_ms']:.2f}ms ({row['speedup_with_fetch']}x)"
+            )
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump({'meta': {'git_revision': suite.git_revision(), 'page_size': page_size},
+                           'results': results}, fh, indent=2)
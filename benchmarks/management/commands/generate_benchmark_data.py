@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from benchmarks import datagen
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic dataset (users, labs, tests, lab tests, appointments) for benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--lab-owners', type=int, default=50)
+        parser.add_argument('--labs', type=int, default=100)
+        parser.add_argument('--tests', type=int, default=200)
+        parser.add_argument('--tests-per-lab', type=int, default=40)
+        parser.add_argument('--appointments', type=int, default=100000)
+        parser.add_argument('--days', type=int, default=365,
+                            help='Spread appointments over this many days around today')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--clear', action='store_true',
+                            help='Remove previously generated benchmark data first')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            datagen.clear()
+            self.stdout.write('Removed existing benchmark data')
+
+        counts = datagen.generate(
+            users=options['users'],
+            lab_owners=options['lab_owners'],
+            labs=options['labs'],
+            tests=options['tests'],
+            tests_per_lab=options['tests_per_lab'],
+            appointments=options['appointments'],
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+            days=options['days'],
+            stdout=self.stdout,
+        )
+        summary = ', '.join(f'{count} {name}' for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Generated {summary}'))
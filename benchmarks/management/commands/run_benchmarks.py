@@ -0,0 +1,68 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks import suite
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the API endpoints at several dataset sizes and write the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default=','.join(str(s) for s in suite.DEFAULT_SIZES),
+                            help='Comma separated appointment counts, e.g. 1000,10000,100000')
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--endpoint', action='append', dest='endpoints',
+                            help='Only run this endpoint (may be repeated)')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--gzip', action='store_true',
+                            help='Send Accept-Encoding: gzip and record compressed sizes')
+        parser.add_argument('--output', default='benchmark_results.json')
+        parser.add_argument('--baseline', help='Previous results file to compare against')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='p95 slowdown in percent reported as a regression')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',') if size]
+        except ValueError:
+            raise CommandError('--sizes must be a comma separated list of integers')
+
+        unknown = set(options['endpoints'] or []) - {e.name for e in suite.ENDPOINTS}
+        if unknown:
+            raise CommandError(f"Unknown endpoint(s): {', '.join(sorted(unknown))}")
+
+        with suite.throwaway_database():
+            report = suite.run(
+                sizes=sizes,
+                iterations=options['iterations'],
+                warmup=options['warmup'],
+                endpoints=options['endpoints'],
+                seed=options['seed'],
+                gzip=options['gzip'],
+                stdout=self.stdout,
+            )
+
+        with open(options['output'], 'w') as fh:
+            json.dump(report, fh, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if options['baseline']:
+            with open(options['baseline']) as fh:
+                baseline = json.load(fh)
+            regressions = 0
+            for row in suite.compare(baseline, report, options['threshold']):
+                line = (
+                    f"{row['endpoint']:<46} size={row['size']:<8} "
+                    f"p95 {row['p95_before']:.2f} -> {row['p95_after']:.2f}ms "
+                    f"({row['p95_change_pct']:+.1f}%) "
+                    f"queries {row['queries_before']} -> {row['queries_after']}"
+                )
+                if row['regression']:
+                    regressions += 1
+                    self.stdout.write(self.style.ERROR(line))
+                else:
+                    self.stdout.write(line)
+            if regressions:
+                raise CommandError(f'{regressions} regression(s) compared to {options["baseline"]}')
@@ -0,0 +1,58 @@
+"""
+Serialization CPU benchmark: ModelSerializer(many=True) over model
+instances versus the values_list() projections used by the list endpoints.
+"""
+import time
+
+from appointments.models import Appointment
+from appointments.serializers import AppointmentSerializer
+from core.projections import get_projection
+from labs.models import LabTest
+from labs.serializers import LabTestSerializer
+
+CASES = [
+    ('labtest', LabTest, LabTestSerializer),
+    ('appointment', Appointment, AppointmentSerializer),
+]
+
+
+def _best_of(func, repeat):
+    """Lowest CPU time over `repeat` runs, in milliseconds"""
+    best = None
+    for _ in range(repeat):
+        started = time.process_time()
+        func()
+        elapsed = (time.process_time() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(page_size=1000, repeat=20):
+    results = []
+    for name, model, serializer_class in CASES:
+        queryset = model.objects.order_by('pk')[:page_size]
+        projection = get_projection(serializer_class)
+
+        instances = list(queryset)
+        rows = list(projection.values(queryset))
+        expected = serializer_class(instances, many=True).data
+        actual = projection.data(rows)
+        if [dict(item) for item in expected] != actual:
+            raise AssertionError(f'{name}: projection output differs from {serializer_class.__name__}')
+
+        serializer_ms = _best_of(lambda: serializer_class(instances, many=True).data, repeat)
+        projection_ms = _best_of(lambda: projection.data(rows), repeat)
+        serializer_total_ms = _best_of(lambda: serializer_class(list(queryset.all()), many=True).data, repeat)
+        projection_total_ms = _best_of(lambda: projection.serialize(queryset), repeat)
+
+        results.append({
+            'case': name,
+            'rows': len(rows),
+            'serializer_ms': round(serializer_ms, 3),
+            'projection_ms': round(projection_ms, 3),
+            'speedup': round(serializer_ms / projection_ms, 1) if projection_ms else None,
+            'serializer_with_fetch_ms': round(serializer_total_ms, 3),
+            'projection_with_fetch_ms': round(projection_total_ms, 3),
+            'speedup_with_fetch': round(serializer_total_ms / projection_total_ms, 1) if projection_total_ms else None,
+        })
+    return results
@@ -0,0 +1,286 @@
+"""
+Endpoint benchmark suite.
+
+Drives the real URL routes from config/urls.py through the Django test
+client and records latency percentiles and query counts per endpoint.
+"""
+import math
+import platform
+import subprocess
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import (
+    CaptureQueriesContext, setup_test_environment, teardown_test_environment,
+)
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from appointments.models import Appointment
+from labs.models import Laboratory, LabTest
+from tests.models import Test
+
+from . import datagen
+
+User = get_user_model()
+
+
+class Endpoint:
+    """A single route to benchmark"""
+
+    def __init__(self, name, url_name, method='get', auth='user', kwargs=None, data=None):
+        self.name = name
+        self.url_name = url_name
+        self.method = method
+        self.auth = auth
+        self.kwargs = kwargs or (lambda ctx: {})
+        self.data = data or (lambda ctx: None)
+
+    def url(self, ctx):
+        return reverse(self.url_name, kwargs=self.kwargs(ctx))
+
+
+ENDPOINTS = [
+    Endpoint('accounts.profile', 'get_user_profile'),
+    Endpoint(
+        'accounts.check_status', 'check_approval_status', auth=None,
+        kwargs=lambda ctx: {'username': ctx['user'].username},
+    ),
+    Endpoint('accounts.pending_users', 'pending_users', auth='admin'),
+    Endpoint('labs.laboratory_list', 'laboratory-list'),
+    Endpoint(
+        'labs.laboratory_detail', 'laboratory-detail',
+        kwargs=lambda ctx: {'pk': ctx['lab_id']},
+    ),
+    Endpoint('labs.labtest_list', 'labtest-list'),
+    Endpoint(
+        'labs.labtest_detail', 'labtest-detail',
+        kwargs=lambda ctx: {'pk': ctx['lab_test_id']},
+    ),
+    Endpoint('tests.test_list', 'test-list'),
+    Endpoint('appointments.appointment_list', 'appointment-list'),
+    Endpoint('appointments.appointment_list_lab_owner', 'appointment-list', auth='lab_owner'),
+    Endpoint(
+        'appointments.appointment_list_admin_filtered', 'appointment-list', auth='admin',
+        data=lambda ctx: {'status': 'booked', 'date_from': ctx['today'], 'date_to': ctx['today']},
+    ),
+    Endpoint(
+        'appointments.appointment_detail', 'appointment-detail',
+        kwargs=lambda ctx: {'pk': ctx['appointment_id']},
+    ),
+]
+
+DEFAULT_SIZES = [1000, 10000, 50000]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR,
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextmanager
+def throwaway_database():
+    """
+    Run the enclosed block against a fresh test database, so benchmarks
+    never touch development data.
+    """
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def build_context():
+    """Pick the users and objects the endpoints are exercised with"""
+    user = User.objects.filter(username__startswith=f'{datagen.PREFIX}user_').order_by('id').first()
+    lab_owner = User.objects.filter(username__startswith=f'{datagen.PREFIX}lab_owner_').order_by('id').first()
+    admin, _ = User.objects.get_or_create(
+        username=f'{datagen.PREFIX}admin',
+        defaults={
+            'email': f'{datagen.PREFIX}admin@example.com',
+            'is_staff': True,
+            'is_superuser': True,
+            'role': 'admin',
+            'approval_status': 'approved',
+        },
+    )
+    return {
+        'user': user,
+        'admin': admin,
+        'today': timezone.localdate().isoformat(),
+        'lab_id': Laboratory.objects.values_list('id', flat=True).first(),
+        'lab_test_id': LabTest.objects.values_list('id', flat=True).first(),
+        'appointment_id': Appointment.objects.filter(user=user).values_list('id', flat=True).first(),
+        'tokens': {
+            'user': str(RefreshToken.for_user(user).access_token),
+            'lab_owner': str(RefreshToken.for_user(lab_owner).access_token),
+            'admin': str(RefreshToken.for_user(admin).access_token),
+        },
+    }
+
+
+def measure(client, endpoint, ctx, iterations, warmup, gzip=False):
+    """Run one endpoint repeatedly and summarise the timings"""
+    url = endpoint.url(ctx)
+    headers = {'HTTP_ACCEPT_ENCODING': 'gzip'} if gzip else {}
+    if endpoint.auth:
+        headers['HTTP_AUTHORIZATION'] = f"Bearer {ctx['tokens'][endpoint.auth]}"
+    call = getattr(client, endpoint.method)
+    # Every request comes from one address, so start each endpoint with
+    # full throttle buckets.
+    cache.clear()
+
+    for _ in range(warmup):
+        call(url, endpoint.data(ctx), **headers)
+
+    timings = []
+    queries = []
+    status_code = None
+    response_bytes = 0
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = call(url, endpoint.data(ctx), **headers)
+            # Streaming bodies are produced lazily, so consume them in the
+            # timed region.
+            if response.streaming:
+                body = b''.join(response.streaming_content)
+            else:
+                body = response.content
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(captured.captured_queries))
+        status_code = response.status_code
+        response_bytes = len(body)
+
+    timings.sort()
+    return {
+        'url': url,
+        'status': status_code,
+        'iterations': iterations,
+        'response_bytes': response_bytes,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'queries': max(queries),
+    }
+
+
+def run(sizes=None, iterations=30, warmup=3, endpoints=None, seed=42, gzip=False, stdout=None):
+    """
+    Grow the benchmark dataset through each size (number of appointments)
+    and measure every endpoint at each step.
+    """
+    sizes = sorted(sizes or DEFAULT_SIZES)
+    selected = [e for e in ENDPOINTS if not endpoints or e.name in endpoints]
+    # Requests are sequential, so the single-flight micro-cache would answer
+    # every repeat; measure the views themselves instead.
+    with override_settings(SINGLE_FLIGHT_TTL=0):
+        client = Client()
+        return _run(client, sizes, iterations, warmup, selected, seed, gzip, stdout)
+
+
+def _run(client, sizes, iterations, warmup, selected, seed, gzip, stdout):
+    def log(message):
+        if stdout is not None:
+            stdout.write(message)
+
+    results = []
+    current = 0
+    for step, size in enumerate(sizes):
+        # Reference data is created once; appointments are topped up per size.
+        first = step == 0
+        datagen.generate(
+            users=1000 if first else 0,
+            lab_owners=50 if first else 0,
+            labs=100 if first else 0,
+            tests=200 if first else 0,
+            appointments=size - current,
+            seed=seed + step,
+        )
+        current = size
+        ctx = build_context()
+        log(f'Dataset: {size} appointments')
+
+        for endpoint in selected:
+            result = measure(client, endpoint, ctx, iterations, warmup, gzip)
+            result.update({'endpoint': endpoint.name, 'size': size})
+            results.append(result)
+            log(
+                f"  {endpoint.name:<46} p50={result['p50_ms']:>9.2f}ms "
+                f"p95={result['p95_ms']:>9.2f}ms p99={result['p99_ms']:>9.2f}ms "
+                f"queries={result['queries']} bytes={result['response_bytes']}"
+            )
+
+    return {
+        'meta': {
+            'created_at': datetime.now(dt_timezone.utc).isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'iterations': iterations,
+            'warmup': warmup,
+            'seed': seed,
+            'gzip': gzip,
+            'counts': {
+                'users': User.objects.count(),
+                'labs': Laboratory.objects.count(),
+                'tests': Test.objects.count(),
+                'lab_tests': LabTest.objects.count(),
+                'appointments': Appointment.objects.count(),
+            },
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=10.0):
+    """
+    Compare two result documents and return rows describing p95 and query
+    count changes for endpoints present in both. Rows whose p95 got worse by
+    more than threshold percent, or that issue more queries, are flagged.
+    """
+    index = {(r['endpoint'], r['size']): r for r in baseline['results']}
+    rows = []
+    for result in current['results']:
+        before = index.get((result['endpoint'], result['size']))
+        if before is None:
+            continue
+        change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+        rows.append({
+            'endpoint': result['endpoint'],
+            'size': result['size'],
+            'p95_before': before['p95_ms'],
+            'p95_after': result['p95_ms'],
+            'p95_change_pct': round(change, 1),
+            'queries_before': before['queries'],
+            'queries_after': result['queries'],
+            'regression': change > threshold or result['queries'] > before['queries'],
+        })
+    return rows
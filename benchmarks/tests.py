@@ -0,0 +1,55 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from accounts.models import UserCounter
+from appointments.models import Appointment
+from labs.models import Laboratory, LabTest, LabTestPrice
+from tests.models import Test
+from . import datagen
+
+User = get_user_model()
+
+
+class DatagenTests(TestCase):
+    def generate(self, **sizes):
+        return datagen.generate(**{
+            'users': 10, 'lab_owners': 2, 'labs': 3, 'tests': 8, 'tests_per_lab': 4,
+            'appointments': 50, 'batch_size': 7, 'seed': 1, **sizes,
+        })
+
+    def test_generate_creates_requested_sizes(self):
+        counts = self.generate()
+        self.assertEqual(counts, {
+            'users': 10, 'lab_owners': 2, 'tests': 8, 'labs': 3, 'lab_tests': 12, 'appointments': 50,
+        })
+        self.assertEqual(User.objects.filter(username__startswith=f'{datagen.PREFIX}user_').count(), 10)
+        self.assertEqual(Laboratory.objects.filter(name__startswith=datagen.PREFIX).count(), 3)
+        self.assertEqual(LabTest.objects.filter(lab__name__startswith=datagen.PREFIX).count(), 12)
+        self.assertEqual(Appointment.objects.count(), 50)
+        # Every lab test has its opening price interval
+        self.assertEqual(LabTestPrice.objects.filter(valid_to__isnull=True).count(), 12)
+
+    def test_generate_adds_to_existing_data(self):
+        self.generate()
+        counts = self.generate(seed=2)
+        self.assertEqual(counts['users'], 10)
+        self.assertEqual(User.objects.filter(username__startswith=datagen.PREFIX).count(), 24)
+        self.assertEqual(Test.objects.filter(name__startswith=datagen.PREFIX).count(), 16)
+
+    def test_same_seed_same_dataset(self):
+        # Appointment times are relative to now, so compare the rest
+        self.generate()
+        first = list(Appointment.objects.order_by('id').values_list('status', 'price'))
+        datagen.clear()
+        self.generate()
+        second = list(Appointment.objects.order_by('id').values_list('status', 'price'))
+        self.assertEqual(first, second)
+
+    def test_counters_follow_generate_and_clear(self):
+        self.generate()
+        self.assertEqual(UserCounter.objects.totals()['total'], User.objects.count())
+        self.assertEqual(UserCounter.objects.totals()['role'].get('lab_owner'), 2)
+        datagen.clear()
+        self.assertFalse(User.objects.filter(username__startswith=datagen.PREFIX).exists())
+        self.assertEqual(UserCounter.objects.totals()['total'], User.objects.count())
+        self.assertEqual(UserCounter.objects.reconcile(), {})
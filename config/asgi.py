@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Serve the read-heavy routes with the async views in core.async_views
+os.environ.setdefault('ASYNC_READ_ROUTES', '*')
 
 application = get_asgi_application()
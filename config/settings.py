@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -50,37 +51,65 @@ FRONTEND_URL = os.environ.get('FRONTEND_URL', 'http://localhost:5173')
 #     'django.contrib.auth.backends.ModelBackend',  # Default backend
 # ]
 
-# Logging configuration for better debugging
+# Logging configuration
+# Records are queued in the request thread and written as JSON lines by a
+# background listener (see core/log.py). Sensitive fields are redacted and
+# DEBUG records are sampled at LOG_DEBUG_SAMPLE_RATE.
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', '0.1'))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {
+            '()': 'core.log.RequestIdFilter',
+        },
+        'sample_debug': {
+            '()': 'core.log.SamplingFilter',
+            'rate': LOG_DEBUG_SAMPLE_RATE,
+            'level': 'DEBUG',
+        },
+    },
     'formatters': {
-        'verbose': {
-            'format': '{levelname} {asctime} {module} {process:d} {thread:d} {message}',
-            'style': '{',
+        'json': {
+            '()': 'core.log.JsonFormatter',
         },
     },
     'handlers': {
-        'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'verbose',
-        },
-        'file': {
-            'class': 'logging.FileHandler',
-            'filename': 'django.log',
-            'formatter': 'verbose',
+        'queue': {
+            'class': 'core.log.BackgroundQueueHandler',
+            'filename': str(BASE_DIR / 'django.log'),
+            'max_bytes': 10 * 1024 * 1024,
+            'backup_count': 5,
+            'console': True,
+            'filters': ['request_id', 'sample_debug'],
         },
     },
     'root': {
-        'handlers': ['console'],
+        'handlers': ['queue'],
         'level': 'INFO',
     },
     'loggers': {
         'accounts': {
-            'handlers': ['console', 'file'],
+            'handlers': ['queue'],
             'level': 'DEBUG',
             'propagate': False,
         },
+        'labs': {
+            'handlers': ['queue'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'appointments': {
+            'handlers': ['queue'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'core': {
+            'handlers': ['queue'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
 
@@ -103,11 +132,17 @@ INSTALLED_APPS = [
     'labs',
     'appointments',
     'tests',
+    'benchmarks',
+    'core',
     'corsheaders',
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestIdMiddleware',
+    'core.middleware.ConcurrencyLimitMiddleware',
+    'core.middleware.SingleFlightMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.GZipMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -179,10 +214,31 @@ WSGI_APPLICATION = 'config.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+# Appointment shards (appointments.sharding): APPOINTMENT_SHARDS=N adds N
+# SQLite databases next to the main one and spreads appointments over them
+# by laboratory. Off by default. Create them with
+# `migrate --database appointments_<n>` and move existing rows with
+# `rebalance_appointments`.
+APPOINTMENT_SHARDS = [f'appointments_{n}' for n in range(int(os.environ.get('APPOINTMENT_SHARDS', '0')))]
+SHARD_DIR = Path(os.environ.get('SHARD_DIR', BASE_DIR))
+for _alias in APPOINTMENT_SHARDS:
+    DATABASES[_alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': SHARD_DIR / f'{_alias}.sqlite3',
+    }
+SHARD_LAB_CACHE_TTL = 60  # seconds a process trusts its cached lab of a lab test
+# A shard only holds the appointments tables, so appointments cannot have
+# database FK constraints to users and lab tests there. Without shards they
+# keep them. Turning sharding on later leaves the constraints in the default
+# database, which is harmless: the rows they cover are all local to it.
+APPOINTMENT_FK_CONSTRAINTS = not APPOINTMENT_SHARDS
+
+DATABASE_ROUTERS = ['appointments.sharding.AppointmentShardRouter'] if APPOINTMENT_SHARDS else []
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -231,5 +287,144 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'core.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+    # Token buckets for the public endpoints (core.throttling): N/period is
+    # a burst of N refilled over one period.
+    'DEFAULT_THROTTLE_RATES': {
+        'register': '20/hour',
+        'register_username': '5/hour',
+        'login': '30/min',
+        'login_username': '10/min',
+        'approval_status': '120/min',
+        'approval_status_username': '60/min',
+    },
 }
 
+# Throttle buckets and the typeahead version stamp must be shared by every
+# worker; point REDIS_URL at a Redis server in production (requires the
+# redis package).
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Route names served by the async read views in core.async_views, comma
+# separated, or '*' for all eligible routes. They only pay off under ASGI, so
+# config/asgi.py enables all of them and WSGI deployments leave this empty.
+ASYNC_READ_ROUTES = os.environ.get('ASYNC_READ_ROUTES', '')
+if ASYNC_READ_ROUTES != '*':
+    ASYNC_READ_ROUTES = [name for name in ASYNC_READ_ROUTES.split(',') if name]
+
+# Hot GET routes whose identical concurrent requests share one response
+# (core.middleware.SingleFlightMiddleware): URL name -> 'shared' when every
+# authenticated caller sees the same data, 'user' when it is per user.
+SINGLE_FLIGHT_ROUTES = {
+    'laboratory-list': 'shared',
+    'laboratory-detail': 'shared',
+    'labtest-list': 'shared',
+    'labtest-detail': 'shared',
+    'test-list': 'shared',
+    'test-detail': 'shared',
+}
+SINGLE_FLIGHT_TTL = 1.0  # seconds a coalesced response is reused
+
+# Requests in flight per process before new ones are shed with a 503
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('MAX_CONCURRENT_REQUESTS', '64'))
+LOAD_SHED_RETRY_AFTER = 1  # seconds
+
+# Responses smaller than this are sent uncompressed
+GZIP_MIN_LENGTH = 1024
+
+# Idempotency-Key handling for booking and registration POSTs
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+IDEMPOTENCY_RETRY_AFTER = 1  # seconds a duplicate of an in-flight request is told to wait
+
+
+# New registrations email the superusers 'immediate'ly, or are summarised
+# by the send_admin_digest command ('digest'), which cron runs periodically.
+ADMIN_NOTIFICATION_MODE = os.environ.get('ADMIN_NOTIFICATION_MODE', 'immediate')
+ADMIN_DIGEST_MAX_LISTED = 50  # pending users named in one digest
+ADMIN_RECIPIENTS_CACHE_TIMEOUT = 3600  # seconds; dropped early on superuser changes
+
+# CSVs uploaded to the bulk import endpoint, queued for run_user_imports
+USER_IMPORT_MAX_BYTES = 10 * 1024 * 1024
+
+# Appointment event log (appointments.events)
+APPOINTMENT_EVENTS_PAGE_SIZE = 100
+APPOINTMENT_EVENTS_MAX_PAGE_SIZE = 1000
+APPOINTMENT_EVENTS_MAX_WAIT = 30  # seconds a long-poll may hold the request
+APPOINTMENT_EVENTS_SYNC_MAX_WAIT = 1  # ... when it is served by the sync view, holding a thread
+# Outside SQLite, events this recent are held back until earlier ids commit
+APPOINTMENT_EVENTS_SETTLE_DELAY = timedelta(seconds=2)
+APPOINTMENT_EVENTS_POLL_INTERVAL = 0.5  # seconds between checks while waiting
+# Events older than this are removed by compact_appointment_events
+APPOINTMENT_EVENT_RETENTION = timedelta(days=int(os.environ.get('APPOINTMENT_EVENT_RETENTION_DAYS', '30')))
+
+# Laboratory calendar feeds and sync (appointments.ical)
+CALENDAR_FEED_PAST_DAYS = 30  # past appointments kept in feeds
+CALENDAR_FEED_CACHE_TIMEOUT = 3600  # seconds a rendered feed is kept per ETag
+CALENDAR_SYNC_OVERLAP = timedelta(seconds=5)  # sync tokens step back this far
+CALENDAR_UID_DOMAIN = os.environ.get('CALENDAR_UID_DOMAIN', 'lab-appointments')
+
+# Demand analytics (appointments.analytics)
+ANALYTICS_DEFAULT_DAYS = 365  # history analysed without ?since=
+ANALYTICS_DEFAULT_CAPACITY = 1  # appointments one lab test can run at once
+ANALYTICS_FORECAST_WEEKS = 8  # moving-average window
+ANALYTICS_BUSIEST_HOURS = 5  # busy hours listed per lab test
+ANALYTICS_CHUNK_SIZE = 100_000  # rows fetched per round trip
+ANALYTICS_CACHE_TIMEOUT = 3600  # seconds; keyed on the lab's appointments and catalog
+
+# Test name typeahead (tests.typeahead)
+TYPEAHEAD_LIMIT = 10
+TYPEAHEAD_MAX_LIMIT = 50
+TYPEAHEAD_POPULARITY_DAYS = 90  # appointments counted for ranking
+TYPEAHEAD_VERSION_CHECK_INTERVAL = 1  # seconds between looks at the shared version stamp
+TYPEAHEAD_MAX_AGE = 600  # seconds before the index is rebuilt to refresh popularity
+# Without Redis other processes' version bumps are invisible; rebuild this often
+TYPEAHEAD_UNSHARED_MAX_AGE = 30
+
+# Home screen endpoint (accounts.home): rows per list section
+HOME_SECTION_LIMITS = {'appointments': 5, 'labs': 10, 'tests': 10}
+HOME_MAX_SECTION_LIMIT = 50
+
+# Recurring appointment series (appointments.series)
+SERIES_MATERIALIZE_AHEAD = timedelta(days=14)  # occurrences this close become bookings
+SERIES_MAX_COUNT = 366
+SERIES_DEFAULT_WINDOW = timedelta(days=90)  # occurrences listed without ?date_to=
+
+# Catalog delta sync for offline clients (labs.catalog)
+CATALOG_SYNC_PAGE_SIZE = 500  # rows per page, across tests, labs and lab tests
+CATALOG_SYNC_MAX_PAGE_SIZE = 2000
+CATALOG_SYNC_OVERLAP = timedelta(seconds=5)  # final tokens step back this far
+# Tombstones older than this are removed by compact_catalog_tombstones;
+# older tokens get a 410 and the client downloads the catalog again
+CATALOG_TOMBSTONE_RETENTION = timedelta(days=int(os.environ.get('CATALOG_TOMBSTONE_RETENTION_DAYS', '90')))
+
+# `manage.py test`: hashing passwords properly takes most of a second per
+# user, which only slows the suite down. Two shard databases exist for the
+# sharding tests, which turn them on with override_settings, so the schema
+# and routing are the sharded ones.
+TESTING = sys.argv[1:2] == ['test']
+if TESTING:
+    PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+    for _alias in ('appointments_0', 'appointments_1'):
+        DATABASES.setdefault(_alias, {'ENGINE': 'django.db.backends.sqlite3', 'NAME': SHARD_DIR / f'{_alias}.sqlite3'})
+    APPOINTMENT_FK_CONSTRAINTS = False
+    DATABASE_ROUTERS = ['appointments.sharding.AppointmentShardRouter']
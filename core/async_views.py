@@ -0,0 +1,224 @@
+"""
+Async-native read paths for DRF views.
+
+DRF views are synchronous, so under ASGI each request to them holds a
+thread. The views here serve plain GET requests with the async ORM
+instead, and hand everything else (writes, query parameters, the browsable
+API, missing or bad credentials, 404s) to the regular synchronous view, so
+clients see identical responses either way.
+
+The sync view's throttles, and any permission classes beyond AllowAny
+and IsAuthenticated, are checked on the async path too, against the user
+the token resolved to; if one refuses, the sync view answers, with its
+usual 403 or 429.
+
+Which routes are served async is chosen by name with
+settings.ASYNC_READ_ROUTES ('*' for every eligible route).
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.http import HttpResponse, HttpResponseNotModified
+from django.urls import URLPattern
+from rest_framework.generics import GenericAPIView
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.request import Request
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .authentication import validated_token
+from .concurrency import etag_for, not_modified
+from .mixins import ConditionalUpdateMixin, SparseFieldsetMixin
+from .projections import get_projection
+from .renderers import FastJSONRenderer
+
+# Classes whose get_queryset() adds nothing for a plain GET
+_PLAIN_QUERYSET_CLASSES = (GenericAPIView, SparseFieldsetMixin)
+
+
+def async_routes_enabled(name):
+    routes = getattr(settings, 'ASYNC_READ_ROUTES', ())
+    return routes == '*' or name in routes
+
+
+async def authenticate(request):
+    """Resolve a Bearer token to an active user, or None if that fails"""
+    if jwt_settings.CHECK_REVOKE_TOKEN:
+        return None
+    token = validated_token(request)
+    if token is None or jwt_settings.USER_ID_CLAIM not in token:
+        return None
+    user_id = token[jwt_settings.USER_ID_CLAIM]
+    user = await get_user_model().objects.filter(**{jwt_settings.USER_ID_FIELD: user_id}).afirst()
+    if user is None or (jwt_settings.CHECK_USER_IS_ACTIVE and not user.is_active):
+        return None
+    return user
+
+
+class AsyncReadView:
+    """
+    Base class: subclasses implement `async get(request, *args, **kwargs)`
+    and return a response, or None to let the sync view answer instead.
+    """
+    requires_auth = True
+    renderer = FastJSONRenderer()
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.sync_fallback = sync_to_async(fallback)
+        view = fallback.cls(**getattr(fallback, 'initkwargs', {}))
+        # Same Allow header as the DRF view (api_view or APIView.as_view)
+        self.allow = ', '.join(view.allowed_methods)
+        self.has_checks = bool(view.throttle_classes) or not all(
+            permission in (AllowAny, IsAuthenticated) for permission in view.permission_classes
+        )
+
+    @classmethod
+    def as_view(cls, fallback, **initkwargs):
+        self = cls(fallback, **initkwargs)
+
+        async def view(request, *args, **kwargs):
+            return await self.dispatch(request, *args, **kwargs)
+
+        # The sync fallbacks are DRF views, which are CSRF exempt too
+        view.csrf_exempt = True
+        view.view_class = cls
+        return view
+
+    def can_serve(self, request, kwargs):
+        return (
+            request.method in ('GET', 'HEAD')
+            and not request.GET
+            and 'format' not in kwargs
+            and 'text/html' not in request.headers.get('Accept', '')
+        )
+
+    async def dispatch(self, request, *args, **kwargs):
+        if not self.can_serve(request, kwargs):
+            return await self.sync_fallback(request, *args, **kwargs)
+
+        user = await authenticate(request)
+        if user is None and (self.requires_auth or 'HTTP_AUTHORIZATION' in request.META):
+            return await self.sync_fallback(request, *args, **kwargs)
+        request.user = user or AnonymousUser()
+        if self.has_checks and not await sync_to_async(self.check_view)(request, args, kwargs):
+            return await self.sync_fallback(request, *args, **kwargs)
+
+        response = await self.get(request, *args, **kwargs)
+        if response is None:
+            return await self.sync_fallback(request, *args, **kwargs)
+        return response
+
+    def check_view(self, request, args, kwargs):
+        """Whether the sync view's permissions and throttles let the request through"""
+        view = self.fallback.cls(**getattr(self.fallback, 'initkwargs', {}))
+        view.args, view.kwargs = args, kwargs
+        if getattr(self.fallback, 'actions', None):
+            view.action = self.fallback.actions.get('get')
+        view.request = drf_request = Request(request)
+        drf_request.user = request.user
+        return (
+            all(permission.has_permission(drf_request, view) for permission in view.get_permissions())
+            and all(throttle.allow_request(drf_request, view) for throttle in view.get_throttles())
+        )
+
+    async def get(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def render(self, data, headers=None):
+        response = HttpResponse(self.renderer.render(data), content_type=self.renderer.media_type)
+        response['Allow'] = self.allow
+        response['Vary'] = 'Accept'
+        for name, value in (headers or {}).items():
+            response[name] = value
+        return response
+
+
+class ViewSetReadView(AsyncReadView):
+    """Async list/retrieve for a ModelViewSet route produced by a router"""
+
+    def __init__(self, fallback):
+        super().__init__(fallback)
+        viewset = fallback.cls
+        self.viewset = viewset
+        self.action = fallback.actions.get('get')
+        self.serializer_class = viewset.serializer_class
+        self.requires_auth = IsAuthenticated in viewset.permission_classes
+        self.allow = ', '.join(
+            method.upper() for method in viewset.http_method_names
+            if method in fallback.actions or method in ('head', 'options')
+        )
+        try:
+            self.projection = get_projection(self.serializer_class)
+        except ImproperlyConfigured:
+            self.projection = None
+
+    @classmethod
+    def supports(cls, viewset, actions):
+        """Whether a plain GET on this route can be served without DRF"""
+        plain_queryset = all(
+            klass in _PLAIN_QUERYSET_CLASSES
+            for klass in viewset.__mro__ if 'get_queryset' in vars(klass)
+        )
+        return (
+            actions.get('get') in ('list', 'retrieve')
+            and plain_queryset
+            and viewset.queryset is not None
+            and viewset.serializer_class is not None
+            and viewset.pagination_class is None
+            and not viewset.filter_backends
+            and all(p in (AllowAny, IsAuthenticated) for p in viewset.permission_classes)
+        )
+
+    async def get(self, request, *args, **kwargs):
+        queryset = self.viewset.queryset.all()
+        if self.action == 'list':
+            if self.projection is not None:
+                rows = [row async for row in self.projection.values(queryset)]
+                return self.render(self.projection.data(rows))
+            instances = [instance async for instance in queryset]
+            return self.render(self.serializer_class(instances, many=True).data)
+
+        lookup_url_kwarg = self.viewset.lookup_url_kwarg or self.viewset.lookup_field
+        try:
+            instance = await queryset.filter(**{self.viewset.lookup_field: kwargs[lookup_url_kwarg]}).afirst()
+        except (TypeError, ValueError, ValidationError):
+            instance = None
+        if instance is None:
+            return None
+
+        if issubclass(self.viewset, ConditionalUpdateMixin):
+            etag = etag_for(instance)
+            if not_modified(request, instance):
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                return response
+            return self.render(self.serializer_class(instance).data, {'ETag': etag})
+        return self.render(self.serializer_class(instance).data)
+
+
+def async_read_urls(urlpatterns):
+    """
+    Swap the list/retrieve routes of a router's urls for ViewSetReadView
+    when their names are enabled in settings.ASYNC_READ_ROUTES.
+    """
+    result = []
+    for pattern in urlpatterns:
+        callback = pattern.callback if isinstance(pattern, URLPattern) else None
+        viewset, actions = getattr(callback, 'cls', None), getattr(callback, 'actions', None)
+        if (actions and async_routes_enabled(pattern.name)
+                and ViewSetReadView.supports(viewset, actions)):
+            pattern = URLPattern(
+                pattern.pattern, ViewSetReadView.as_view(callback),
+                pattern.default_args, pattern.name,
+            )
+        result.append(pattern)
+    return result
+
+
+def async_read_view(name, view_class, fallback):
+    """Return view_class wrapping fallback if the route is enabled, else fallback"""
+    if async_routes_enabled(name):
+        return view_class.as_view(fallback)
+    return fallback
@@ -0,0 +1,35 @@
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+_jwt = JWTAuthentication()
+
+
+def validated_token(request):
+    """
+    Return the validated access token carried by a plain Django request, or
+    None if there is none or it does not validate. Only the signature and
+    claims are checked; the user is not loaded.
+    """
+    header = _jwt.get_header(request)
+    raw_token = _jwt.get_raw_token(header) if header is not None else None
+    if raw_token is None:
+        return None
+    try:
+        return _jwt.get_validated_token(raw_token)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+def authenticated_user(request):
+    """
+    Return the user a plain Django request authenticates as, or None. Unlike
+    validated_token() this loads the user, so deleted and inactive users are
+    rejected just as JWTAuthentication would reject them.
+    """
+    token = validated_token(request)
+    if token is None:
+        return None
+    try:
+        return _jwt.get_user(token)
+    except (InvalidToken, AuthenticationFailed):
+        return None
@@ -0,0 +1,71 @@
+"""
+HTTP side of optimistic concurrency: ETags derived from a VersionedModel's
+version, If-Match / If-None-Match parsing and the 412 error.
+
+GZipMiddleware weakens the ETag of every body it compresses ('W/"…"'), so
+clients echo back weak tags for the same representation they would have
+been sent a strong one for uncompressed. Tags are therefore compared by
+their opaque part: weak comparison for If-None-Match, and for If-Match
+too, since a tag names a version rather than particular bytes.
+"""
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'The resource was modified by someone else. Reload it and try again.'
+    default_code = 'precondition_failed'
+
+
+class PreconditionRequired(APIException):
+    status_code = status.HTTP_428_PRECONDITION_REQUIRED
+    default_detail = 'This request must be conditional; send an If-Match header.'
+    default_code = 'precondition_required'
+
+
+def etag_for(instance):
+    return f'"{instance.pk}.{instance.version}"'
+
+
+def opaque_tag(tag):
+    """The tag without its W/ weakness prefix"""
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def parse_etags(header):
+    """Split an If-Match / If-None-Match header into a list of opaque tags"""
+    if not header:
+        return []
+    return [opaque_tag(tag.strip()) for tag in header.split(',') if tag.strip()]
+
+
+def etag_matches(header, etag):
+    """Whether an If-Match / If-None-Match header lists etag (or '*')"""
+    tags = parse_etags(header)
+    return '*' in tags or opaque_tag(etag) in tags
+
+
+def expected_version(request, instance, required=False):
+    """
+    Check the request's If-Match header against the instance.
+
+    Returns the version the client based its change on (or None when no
+    If-Match was sent). Raises PreconditionFailed if the client's copy is
+    already stale, and PreconditionRequired if `required` and no header
+    was sent.
+    """
+    tags = parse_etags(request.headers.get('If-Match'))
+    if not tags:
+        if required:
+            raise PreconditionRequired()
+        return None
+    if '*' in tags:
+        return None
+    if etag_for(instance) not in tags:
+        raise PreconditionFailed()
+    return instance.version
+
+
+def not_modified(request, instance):
+    return etag_matches(request.headers.get('If-None-Match'), etag_for(instance))
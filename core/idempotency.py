@@ -0,0 +1,160 @@
+"""
+Idempotency-Key support for POST endpoints.
+
+The first request with a given key (per caller) inserts an in-progress
+row, runs the view and stores the response. Retries with the same key get
+the stored response (status, body and headers such as Location and ETag)
+back without touching the business tables; retries
+that arrive while the first request is still running get a 409 with
+Retry-After straight away, rather than holding a worker while they wait.
+"""
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.throttling import BaseThrottle
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+# Stored with the response and sent again on replay
+REPLAYED_HEADERS = ('Location', 'ETag', 'Last-Modified', 'Content-Location')
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _scope(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return f'ip:{BaseThrottle().get_ident(request)}'
+
+
+def _fingerprint(request):
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.path.encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _headers(request, response):
+    headers = {name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)}
+    # The Content-Type is only set when the response is rendered: take it
+    # from the renderer chosen for this request, as Response does
+    content_type, renderer = response.content_type, getattr(request, 'accepted_renderer', None)
+    if content_type is None and renderer is not None:
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+    if content_type is not None:
+        headers['Content-Type'] = content_type
+    return headers
+
+
+def _replay(record):
+    headers = dict(record.response_headers)
+    response = Response(
+        json.loads(record.response_body), status=record.response_status,
+        headers=headers, content_type=headers.pop('Content-Type', None),
+    )
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _claim(scope, key, fingerprint):
+    """Insert the in-progress row; returns (record, created)"""
+    expires_at = timezone.now() + _setting('IDEMPOTENCY_KEY_TTL', timedelta(hours=24))
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    scope=scope, key=key, fingerprint=fingerprint, expires_at=expires_at,
+                ), True
+        except IntegrityError:
+            # Expired keys are evicted lazily and may be reused
+            deleted, _ = IdempotencyKey.objects.filter(
+                scope=scope, key=key, expires_at__lt=timezone.now()
+            ).delete()
+            if not deleted:
+                return None, False
+    return None, False
+
+
+def run_idempotent(request, handler):
+    """Run handler() at most once per (caller, Idempotency-Key)"""
+    key = request.headers.get(HEADER)
+    if not key:
+        return handler()
+    if len(key) > MAX_KEY_LENGTH:
+        return Response(
+            {'detail': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters.'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    scope, fingerprint = _scope(request), _fingerprint(request)
+    record, created = _claim(scope, key, fingerprint)
+
+    if not created:
+        record = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+        if record is None:
+            # The first request failed and released the key; run this one.
+            return run_idempotent(request, handler)
+        if record.fingerprint != fingerprint:
+            return Response(
+                {'detail': f'{HEADER} was already used for a different request.'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        if record.state != 'completed':
+            response = Response(
+                {'detail': 'A request with this Idempotency-Key is still being processed.'},
+                status=status.HTTP_409_CONFLICT,
+            )
+            response['Retry-After'] = str(_setting('IDEMPOTENCY_RETRY_AFTER', 1))
+            return response
+        return _replay(record)
+
+    try:
+        response = handler()
+    except Exception:
+        record.delete()
+        raise
+
+    # Server errors and throttling are transient: release the key so the
+    # client can retry for real.
+    if response.status_code >= 500 or response.status_code == status.HTTP_429_TOO_MANY_REQUESTS \
+            or not isinstance(response, Response):
+        record.delete()
+        return response
+
+    IdempotencyKey.objects.filter(pk=record.pk).update(
+        state='completed',
+        response_status=response.status_code,
+        response_body=json.dumps(response.data, default=str),
+        response_headers=_headers(request, response),
+    )
+    return response
+
+
+def idempotent(view_func):
+    """Decorator for function-based API views; apply below @api_view"""
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        return run_idempotent(request, lambda: view_func(request, *args, **kwargs))
+    return wrapper
+
+
+class IdempotentCreateMixin:
+    """Honour Idempotency-Key on a viewset's create()"""
+
+    def create(self, request, *args, **kwargs):
+        return run_idempotent(request, lambda: super(IdempotentCreateMixin, self).create(request, *args, **kwargs))
@@ -0,0 +1,157 @@
+"""
+Logging pipeline: records are put on an in-memory queue in the request
+thread and formatted as JSON, redacted and written by a background
+QueueListener, so disk latency never blocks a request.
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+from datetime import datetime, timezone
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+
+SENSITIVE_KEYS = frozenset({
+    'password', 'confirm_password', 'old_password', 'new_password',
+    'token', 'access', 'refresh', 'authorization', 'secret', 'api_key',
+})
+REDACTED = '[REDACTED]'
+
+# Catches "password': 'hunter2" / "password=hunter2" style leaks in messages
+_SENSITIVE_PATTERN = re.compile(
+    r"""(?P<key>["']?(?:%s)["']?\s*[:=]\s*)(?P<value>"[^"]*"|'[^']*'|[^\s,;}&]+)"""
+    % '|'.join(sorted(SENSITIVE_KEYS)),
+    re.IGNORECASE,
+)
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+
+
+def get_request_id():
+    return _request_id.get()
+
+
+def set_request_id(value):
+    """Bind a request id to the current context and return the reset token"""
+    return _request_id.set(value)
+
+
+def reset_request_id(token):
+    _request_id.reset(token)
+
+
+def redact(value):
+    """Return a copy of value with sensitive keys masked, recursively"""
+    if isinstance(value, dict) or hasattr(value, 'items'):
+        return {
+            key: REDACTED if str(key).lower() in SENSITIVE_KEYS else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+
+def redact_text(text):
+    return _SENSITIVE_PATTERN.sub(lambda m: m.group('key') + REDACTED, text)
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the id of the request being handled"""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of records at or below `level`, so high-volume debug
+    events can stay enabled without flooding the queue.
+    """
+
+    def __init__(self, rate=0.1, level='DEBUG'):
+        super().__init__()
+        self.rate = float(rate)
+        self.levelno = logging._checkLevel(level)
+
+    def filter(self, record):
+        if record.levelno > self.levelno:
+            return True
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line, with sensitive data redacted"""
+
+    def format(self, record):
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': redact_text(record.getMessage()),
+            'request_id': getattr(record, 'request_id', None),
+            'module': record.module,
+            'process': record.process,
+            'thread': record.thread,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                payload[key] = REDACTED if key.lower() in SENSITIVE_KEYS else redact(value)
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload['exc'] = record.exc_text
+        return json.dumps(payload, default=str)
+
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that owns its QueueListener and target handlers.
+
+    Only the message merge and a queue put happen on the calling thread;
+    JSON formatting, redaction and I/O run on the listener thread. The file
+    target rotates by size.
+    """
+
+    def __init__(self, filename=None, max_bytes=10 * 1024 * 1024, backup_count=5, console=True):
+        super().__init__(queue.SimpleQueue())
+        formatter = JsonFormatter()
+        targets = []
+        if filename:
+            file_handler = logging.handlers.RotatingFileHandler(
+                filename, maxBytes=max_bytes, backupCount=backup_count,
+                encoding='utf-8', delay=True,
+            )
+            targets.append(file_handler)
+        if console:
+            targets.append(logging.StreamHandler(sys.stderr))
+        for target in targets:
+            target.setFormatter(formatter)
+
+        self.listener = logging.handlers.QueueListener(self.queue, *targets, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def prepare(self, record):
+        # Merge args now, since they may change once the caller moves on, but
+        # leave exception formatting to the listener thread.
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        return record
+
+    def close(self):
+        listener, self.listener = self.listener, None
+        if listener is not None and listener._thread is not None:
+            listener.stop()
+            for target in listener.handlers:
+                target.close()
+        super().close()
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Delete expired idempotency keys in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        total = 0
+        while True:
+            ids = list(
+                IdempotencyKey.objects.filter(expires_at__lt=now)
+                .values_list('id', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            deleted, _ = IdempotencyKey.objects.filter(id__in=ids).delete()
+            total += deleted
+        self.stdout.write(self.style.SUCCESS(f'Deleted {total} expired idempotency keys'))
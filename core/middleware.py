@@ -0,0 +1,312 @@
+import asyncio
+import re
+import threading
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.urls import Resolver404, resolve
+from django.utils.http import urlencode
+from django.middleware.gzip import GZipMiddleware as DjangoGZipMiddleware
+
+from .authentication import authenticated_user
+from .log import reset_request_id, set_request_id
+
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+class RequestIdMiddleware:
+    """
+    Bind a request id to every log record emitted while handling a request.
+
+    An incoming X-Request-ID header is reused when it looks sane, so ids can
+    be followed across services; otherwise a new one is generated. The id is
+    echoed back on the response.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _bind(self, request):
+        request_id = request.headers.get('X-Request-ID', '')
+        if not _VALID_REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+        request.request_id = request_id
+        return request_id, set_request_id(request_id)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_id, token = self._bind(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            reset_request_id(token)
+        response['X-Request-ID'] = request_id
+        return response
+
+    async def __acall__(self, request):
+        request_id, token = self._bind(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            reset_request_id(token)
+        response['X-Request-ID'] = request_id
+        return response
+
+
+class GZipMiddleware(DjangoGZipMiddleware):
+    """
+    Django's GZipMiddleware with a configurable size threshold
+    (settings.GZIP_MIN_LENGTH); small bodies are not worth the CPU.
+    """
+
+    def process_response(self, request, response):
+        min_length = getattr(settings, 'GZIP_MIN_LENGTH', 1024)
+        if not response.streaming and len(response.content) < min_length:
+            return response
+        return super().process_response(request, response)
+
+
+class ConcurrencyLimitMiddleware:
+    """
+    Shed load once more than settings.MAX_CONCURRENT_REQUESTS requests are
+    in flight in this process: the excess gets an immediate 503 with
+    Retry-After instead of queueing behind the others, which keeps latency
+    bounded for the requests that are admitted. Streaming responses hold
+    their slot until the body has been sent. A budget of 0 disables it.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.limit = getattr(settings, 'MAX_CONCURRENT_REQUESTS', 0)
+        self.retry_after = getattr(settings, 'LOAD_SHED_RETRY_AFTER', 1)
+        self.slots = threading.BoundedSemaphore(self.limit) if self.limit else None
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def shed(self):
+        response = JsonResponse({'detail': 'Server is busy, please retry shortly.'}, status=503)
+        response['Retry-After'] = str(self.retry_after)
+        return response
+
+    def release_after(self, response):
+        if response.streaming:
+            response._resource_closers.append(self.slots.release)
+        else:
+            self.slots.release()
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if self.slots is None:
+            return self.get_response(request)
+        if not self.slots.acquire(blocking=False):
+            return self.shed()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self.slots.release()
+            raise
+        return self.release_after(response)
+
+    async def __acall__(self, request):
+        if self.slots is None:
+            return await self.get_response(request)
+        if not self.slots.acquire(blocking=False):
+            return self.shed()
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            self.slots.release()
+            raise
+        return self.release_after(response)
+
+
+class SingleFlightMiddleware:
+    """
+    Coalesce identical concurrent GETs to hot read routes.
+
+    Routes are listed by URL name in settings.SINGLE_FLIGHT_ROUTES with a
+    scope: 'shared' when every authenticated caller gets the same response,
+    'user' when it depends on who is asking. Requests with the same route,
+    normalised query string, scope and content negotiation headers wait for
+    the first one and get a copy of its rendered bytes, which are also kept
+    for settings.SINGLE_FLIGHT_TTL seconds. Every caller is authenticated,
+    user lookup included, before it can join a flight; only the leader runs
+    the view. Only 2xx responses are shared, so one caller's 401 or 429 is
+    never handed to another.
+
+    State is per process. Any write handled by the process drops the cached
+    responses.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.routes = getattr(settings, 'SINGLE_FLIGHT_ROUTES', {})
+        self.ttl = getattr(settings, 'SINGLE_FLIGHT_TTL', 1.0)
+        self.wait_timeout = getattr(settings, 'SINGLE_FLIGHT_WAIT_TIMEOUT', 10)
+        self.max_entries = getattr(settings, 'SINGLE_FLIGHT_MAX_ENTRIES', 1024)
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.cache = {}
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def flight_key(self, request):
+        if request.method != 'GET' or not self.routes:
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        scope = self.routes.get(match.url_name)
+        if scope is None:
+            return None
+
+        if 'HTTP_AUTHORIZATION' not in request.META:
+            ident = 'anonymous'
+        else:
+            user = authenticated_user(request)
+            if user is None:
+                return None
+            ident = 'authenticated' if scope == 'shared' else f'user:{user.pk}'
+
+        query = urlencode(sorted(request.GET.lists()), doseq=True)
+        return (
+            request.path, query, ident,
+            request.headers.get('Accept', ''),
+            'gzip' in request.headers.get('Accept-Encoding', ''),
+            request.headers.get('Origin', ''),
+            request.headers.get('If-None-Match', ''),
+            request.headers.get('If-Modified-Since', ''),
+        )
+
+    def cached(self, key):
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def store(self, key, snapshot):
+        if not self.ttl or snapshot is None or snapshot[0] != 200:
+            return
+        now = time.monotonic()
+        if len(self.cache) >= self.max_entries:
+            self.cache = {k: v for k, v in self.cache.items() if v[0] > now}
+            while len(self.cache) >= self.max_entries:
+                self.cache.pop(next(iter(self.cache)))
+        self.cache[key] = (now + self.ttl, snapshot)
+
+    @staticmethod
+    def snapshot(response, content):
+        if response.cookies or not 200 <= response.status_code < 300:
+            return None
+        headers = [(name, value) for name, value in response.items() if name.lower() != 'content-length']
+        return response.status_code, headers, content
+
+    @staticmethod
+    def replay(snapshot):
+        status, headers, content = snapshot
+        response = HttpResponse(content, status=status)
+        for name, value in headers:
+            response[name] = value
+        response['Content-Length'] = str(len(content))
+        return response
+
+    def claim(self, key, new_waiter):
+        """Return (cached snapshot, waiter, is_leader) for a key"""
+        with self.lock:
+            snapshot = self.cached(key)
+            if snapshot is not None:
+                return snapshot, None, False
+            waiter = self.flights.get(key)
+            if waiter is not None:
+                return None, waiter, False
+            waiter = self.flights[key] = new_waiter()
+            return None, waiter, True
+
+    def finish(self, key, waiter, snapshot):
+        with self.lock:
+            self.flights.pop(key, None)
+            self.store(key, snapshot)
+        waiter.snapshot = snapshot
+
+    def invalidate(self, request):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            with self.lock:
+                self.cache = {}
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        key = self.flight_key(request)
+        if key is None:
+            self.invalidate(request)
+            return self.get_response(request)
+
+        snapshot, event, leader = self.claim(key, threading.Event)
+        if snapshot is not None:
+            return self.replay(snapshot)
+        if not leader:
+            if event.wait(self.wait_timeout) and event.snapshot is not None:
+                return self.replay(event.snapshot)
+            return self.get_response(request)
+
+        snapshot = None
+        try:
+            response = self.get_response(request)
+            if response.streaming:
+                content = b''.join(response.streaming_content)
+                response.close()
+                response = self.replay((response.status_code, list(response.items()), content))
+            snapshot = self.snapshot(response, response.content)
+            return response
+        finally:
+            self.finish(key, event, snapshot)
+            event.set()
+
+    async def __acall__(self, request):
+        key = await sync_to_async(self.flight_key)(request)
+        if key is None:
+            self.invalidate(request)
+            return await self.get_response(request)
+
+        snapshot, event, leader = self.claim(key, asyncio.Event)
+        if snapshot is not None:
+            return self.replay(snapshot)
+        if not leader:
+            try:
+                await asyncio.wait_for(event.wait(), self.wait_timeout)
+            except asyncio.TimeoutError:
+                pass
+            if event.is_set() and event.snapshot is not None:
+                return self.replay(event.snapshot)
+            return await self.get_response(request)
+
+        snapshot = None
+        try:
+            response = await self.get_response(request)
+            if response.streaming:
+                if response.is_async:
+                    content = b''.join([chunk async for chunk in response.streaming_content])
+                else:
+                    content = await sync_to_async(b''.join)(response.streaming_content)
+                await sync_to_async(response.close)()
+                response = self.replay((response.status_code, list(response.items()), content))
+            snapshot = self.snapshot(response, response.content)
+            return response
+        finally:
+            self.finish(key, event, snapshot)
+            event.set()
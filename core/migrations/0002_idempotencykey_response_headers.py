@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='response_headers',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
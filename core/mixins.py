@@ -0,0 +1,207 @@
+from itertools import islice
+
+from django.core.exceptions import FieldDoesNotExist
+from django.http import HttpResponseNotModified, StreamingHttpResponse
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer
+
+from .concurrency import PreconditionFailed, etag_for, expected_version, not_modified
+from .models import VersionConflict
+from .projections import get_projection
+from .renderers import stream_json_array
+
+
+class ProjectionListMixin:
+    """
+    Serve list() from a values_list() projection of the serializer instead
+    of model instances. Set `use_projection = False` on a viewset to go back
+    to the regular ModelSerializer path.
+
+    Unpaginated JSON lists longer than `stream_chunk_size` rows are streamed
+    in chunks straight from a database cursor.
+    """
+    use_projection = True
+    stream_chunk_size = 2000
+
+    def get_projection(self):
+        if not self.use_projection:
+            return None
+        return get_projection(self.get_serializer_class())
+
+    def list(self, request, *args, **kwargs):
+        projection = self.get_projection()
+        if projection is None:
+            return super().list(request, *args, **kwargs)
+
+        rows = projection.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(projection.data(page))
+        return self.projected_response(projection, rows)
+
+    def projected_response(self, projection, rows):
+        chunk_size = self.stream_chunk_size
+        renderer = getattr(self.request, 'accepted_renderer', None)
+        media_type = getattr(self.request, 'accepted_media_type', None)
+        if (not chunk_size or not isinstance(renderer, JSONRenderer)
+                or renderer.get_indent(media_type, {})):
+            return Response(projection.data(rows))
+
+        iterator = rows.iterator(chunk_size=chunk_size)
+        head = list(islice(iterator, chunk_size + 1))
+        if len(head) <= chunk_size:
+            return Response(projection.data(head))
+
+        def chunks():
+            yield projection.data(head)
+            while True:
+                batch = list(islice(iterator, chunk_size))
+                if not batch:
+                    return
+                yield projection.data(batch)
+
+        return StreamingHttpResponse(
+            stream_json_array(renderer, chunks(), media_type),
+            content_type=renderer.media_type,
+        )
+
+
+def parse_list_param(request, name):
+    """Parse a comma separated query parameter, or return None if absent"""
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def _queryset_plan(serializer, prefix=''):
+    """
+    Work out the only() columns and select_related() paths needed to render
+    a (possibly expanded) serializer. `only` is None when some field cannot
+    be mapped to a model column, in which case no columns are deferred.
+    """
+    model = serializer.Meta.model
+    only, related = [], []
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if isinstance(field, BaseSerializer):
+            path = prefix + field.source
+            related.append(path)
+            nested_only, nested_related = _queryset_plan(field, path + '__')
+            related.extend(nested_related)
+            if only is not None:
+                only.append(path)
+                only = only + nested_only if nested_only is not None else None
+            continue
+        try:
+            model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            only = None
+            continue
+        if only is not None:
+            only.append(prefix + field.source)
+    return only, related
+
+
+class SparseFieldsetMixin:
+    """
+    Support ?fields=a,b and ?expand=rel on safe methods. The serializer only
+    renders the requested fields, the SQL only reads their columns, and
+    select_related is added for expanded relations only.
+
+    Must come before ProjectionListMixin in the bases so projected lists
+    honour ?fields= too.
+    """
+
+    def get_requested_fields(self):
+        if self.request is None or self.request.method not in SAFE_METHODS:
+            return None
+        return parse_list_param(self.request, 'fields')
+
+    def get_requested_expand(self):
+        if self.request is None or self.request.method not in SAFE_METHODS:
+            return None
+        return parse_list_param(self.request, 'expand')
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.get_requested_fields())
+        kwargs.setdefault('expand', self.get_requested_expand())
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields, expand = self.get_requested_fields(), self.get_requested_expand()
+        if fields is None and not expand:
+            return queryset
+
+        serializer = self.get_serializer_class()(fields=fields, expand=expand)
+        only, related = _queryset_plan(serializer)
+        if related:
+            queryset = queryset.select_related(*related)
+        if fields is not None and only:
+            queryset = queryset.only(*only, *getattr(self, 'always_load_fields', ()))
+        return queryset
+
+    def get_projection(self):
+        if self.get_requested_expand():
+            return None
+        projection = super().get_projection()
+        fields = self.get_requested_fields()
+        if projection is None or fields is None:
+            return projection
+        # Normalise so arbitrary query strings cannot grow the projection cache
+        selected = sorted(set(fields) & set(projection.fields))
+        return get_projection(self.get_serializer_class(), selected)
+
+
+class ConditionalUpdateMixin:
+    """
+    ETag / If-Match support for viewsets over a VersionedModel.
+
+    retrieve() sends an ETag and honours If-None-Match with a 304. update,
+    partial_update and destroy honour If-Match: a stale tag is rejected with
+    412 before any write, and the UPDATE itself is conditional on the
+    version, so a concurrent write that slips in between also ends in 412
+    instead of being overwritten. Set `require_if_match = True` to refuse
+    unconditional writes with 428.
+    """
+    require_if_match = False
+    always_load_fields = ('version',)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        if not_modified(request, instance):
+            response = HttpResponseNotModified()
+        else:
+            response = Response(self.get_serializer(instance).data)
+        response['ETag'] = etag_for(instance)
+        return response
+
+    def update(self, request, *args, **kwargs):
+        response = super().update(request, *args, **kwargs)
+        instance = getattr(self, '_updated_instance', None)
+        if instance is not None:
+            response['ETag'] = etag_for(instance)
+        return response
+
+    def perform_update(self, serializer):
+        instance = serializer.instance
+        instance._expected_version = expected_version(self.request, instance, self.require_if_match)
+        try:
+            super().perform_update(serializer)
+        except VersionConflict:
+            raise PreconditionFailed()
+        self._updated_instance = serializer.instance
+
+    def perform_destroy(self, instance):
+        version = expected_version(self.request, instance, self.require_if_match)
+        if version is None:
+            return super().perform_destroy(instance)
+        deleted, _ = type(instance)._base_manager.using(instance._state.db).filter(
+            pk=instance.pk, version=version,
+        ).delete()
+        if not deleted:
+            raise PreconditionFailed()
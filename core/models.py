@@ -0,0 +1,113 @@
+from django.db import models
+from django.db.models import F
+
+
+class VersionConflict(Exception):
+    """The row was changed by someone else since it was read"""
+
+
+class VersionedModel(models.Model):
+    """
+    Optimistic concurrency control.
+
+    Every UPDATE is issued as `UPDATE ... WHERE id = %s AND version = %s` and
+    bumps the version, so a save based on a stale read raises
+    VersionConflict instead of silently overwriting a concurrent change.
+    Callers holding a version from a client (an If-Match header) set
+    `_expected_version` before saving to check against that instead of the
+    version that was loaded.
+
+    Models saved from many places that cannot answer a conflict (admin
+    actions, login) set check_loaded_version = False: only saves with an
+    `_expected_version` are checked then, and the rest just bump the
+    version so ETags still move.
+    """
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    check_loaded_version = True
+    _expected_version = None
+    _version_check = None
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'version' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'version']
+        if self._expected_version is None and not self.check_loaded_version:
+            return self._save_unchecked(*args, **kwargs)
+
+        expected = self._expected_version if self._expected_version is not None else self.version
+
+        self._version_check = expected
+        self.version = expected + 1
+        try:
+            return super().save(*args, **kwargs)
+        except VersionConflict:
+            self.version = expected
+            raise
+        finally:
+            self._version_check = None
+            self._expected_version = None
+
+    def _save_unchecked(self, *args, **kwargs):
+        loaded = self.__dict__.get('version')
+        self.version = F('version') + 1
+        try:
+            result = super().save(*args, **kwargs)
+        except Exception:
+            if loaded is None:
+                del self.__dict__['version']
+            else:
+                self.version = loaded
+            raise
+        # Deferred: read back from the database only if something needs it
+        del self.__dict__['version']
+        return result
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        expected = self._version_check
+        if expected is None:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+
+        updated = super()._do_update(
+            base_qs.filter(version=expected), using, pk_val, values, update_fields, forced_update
+        )
+        if not updated and base_qs.filter(pk=pk_val).exists():
+            raise VersionConflict(
+                f'{self._meta.label} {pk_val} was modified concurrently (expected version {expected})'
+            )
+        return updated
+
+
+class IdempotencyKey(models.Model):
+    """
+    Stored outcome of a POST made with an Idempotency-Key header, so retries
+    get the original response instead of running the request again.
+    """
+    STATE_CHOICES = [
+        ('in_progress', 'In progress'),
+        ('completed', 'Completed'),
+    ]
+
+    scope = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    state = models.CharField(max_length=15, choices=STATE_CHOICES, default='in_progress')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.TextField(blank=True)
+    response_headers = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='idempotency_scope_key_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key} ({self.state})"
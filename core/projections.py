@@ -0,0 +1,142 @@
+"""
+Read-only projections of ModelSerializers.
+
+A Projection reads the columns a serializer would output straight from
+values_list() and turns each row into a dict with a converter function that
+is generated once per serializer, so list endpoints never build model
+instances or run DRF's field-by-field to_representation. Output matches the
+serializer field for field.
+"""
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.utils.timezone import get_current_timezone
+from rest_framework import ISO_8601
+from rest_framework import fields as drf_fields
+from rest_framework import relations
+from rest_framework.settings import api_settings
+
+# DRF fields whose to_representation is a no-op for values coming out of
+# the database, so the raw column value can be used as is.
+_PASSTHROUGH_FIELDS = (
+    drf_fields.BooleanField,
+    drf_fields.CharField,
+    drf_fields.ChoiceField,
+    drf_fields.IntegerField,
+    drf_fields.ReadOnlyField,
+)
+
+# Fields whose representation needs formatting; their bound
+# to_representation is reused so the output stays identical.
+_CONVERTED_FIELDS = (
+    drf_fields.DateField,
+    drf_fields.DateTimeField,
+    drf_fields.DecimalField,
+    drf_fields.FloatField,
+    drf_fields.TimeField,
+    drf_fields.UUIDField,
+)
+
+_cache = {}
+
+
+def _datetime_converter(field):
+    """
+    Inline DRF's ISO 8601 DateTimeField.to_representation for aware values.
+    The returned function takes the active timezone as a second argument so
+    it is looked up once per page rather than once per value.
+    """
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    fallback = field.to_representation
+    if (not settings.USE_TZ or hasattr(field, 'timezone') or output_format is None
+            or output_format.lower() != ISO_8601):
+        return lambda value, tz: fallback(value)
+
+    def convert(value, tz):
+        if value.tzinfo is None:
+            return fallback(value)
+        value = value.astimezone(tz).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+class Projection:
+    """Precompiled values_list() read path for a ModelSerializer class"""
+
+    def __init__(self, serializer_class, fields=None):
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+        serializer = serializer_class()
+
+        names, lookups, converters, tz_aware = [], [], {}, set()
+        for name, field in serializer.fields.items():
+            if field.write_only or (fields is not None and name not in fields):
+                continue
+            lookups.append(self._lookup_for(name, field))
+            names.append(name)
+            if isinstance(field, drf_fields.DateTimeField):
+                converters[name] = _datetime_converter(field)
+                tz_aware.add(name)
+            elif isinstance(field, _CONVERTED_FIELDS):
+                converters[name] = field.to_representation
+            elif not isinstance(field, _PASSTHROUGH_FIELDS + (relations.PrimaryKeyRelatedField,)):
+                raise ImproperlyConfigured(
+                    f'{serializer_class.__name__}.{name} ({type(field).__name__}) '
+                    f'cannot be projected'
+                )
+
+        self.fields = tuple(names)
+        self.lookups = tuple(lookups)
+        self.convert = self._compile(names, converters, tz_aware)
+
+    def _lookup_for(self, name, field):
+        source = field.source
+        if source == '*' or getattr(field, 'source_attrs', None) is None:
+            raise ImproperlyConfigured(f'{self.serializer_class.__name__}.{name} cannot be projected')
+        if isinstance(field, relations.PrimaryKeyRelatedField):
+            if field.pk_field is not None or '.' in source:
+                raise ImproperlyConfigured(f'{self.serializer_class.__name__}.{name} cannot be projected')
+            try:
+                return self.model._meta.get_field(source).attname
+            except FieldDoesNotExist:
+                raise ImproperlyConfigured(f'{self.serializer_class.__name__}.{name} cannot be projected')
+        return source.replace('.', '__')
+
+    def _compile(self, names, converters, tz_aware):
+        """Generate `def convert(row, tz): return {...}` for this field list"""
+        namespace = {}
+        items = []
+        for index, name in enumerate(names):
+            if name in converters:
+                namespace[f'_c{index}'] = converters[name]
+                args = f'row[{index}], tz' if name in tz_aware else f'row[{index}]'
+                # DRF never passes None to to_representation
+                items.append(f'{name!r}: None if row[{index}] is None else _c{index}({args})')
+            else:
+                items.append(f'{name!r}: row[{index}]')
+        source = 'def convert(row, tz):\n    return {%s}\n' % ', '.join(items)
+        exec(compile(source, f'<projection {self.serializer_class.__name__}>', 'exec'), namespace)
+        return namespace['convert']
+
+    def values(self, queryset):
+        """Restrict a queryset to the projected columns, yielding tuples"""
+        return queryset.values_list(*self.lookups)
+
+    def data(self, rows):
+        """Convert rows produced by values() into serializer-shaped dicts"""
+        convert = self.convert
+        tz = get_current_timezone()
+        return [convert(row, tz) for row in rows]
+
+    def serialize(self, queryset):
+        return self.data(self.values(queryset))
+
+
+def get_projection(serializer_class, fields=None):
+    """Return the cached Projection for a serializer class (and field subset)"""
+    key = (serializer_class, tuple(fields) if fields is not None else None)
+    projection = _cache.get(key)
+    if projection is None:
+        projection = _cache[key] = Projection(serializer_class, fields)
+    return projection
@@ -0,0 +1,60 @@
+"""
+JSON renderer backed by orjson when it is installed, falling back to
+DRF's stdlib renderer otherwise. Output is compatible with DRF's
+JSONRenderer: compact, UTF-8, with U+2028/U+2029 escaped.
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+_fallback_encoder = JSONEncoder()
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _default(obj):
+    # Decimal, lazy strings, querysets, ... are handled exactly like DRF does.
+    return _fallback_encoder.default(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Drop-in JSONRenderer. datetimes, dates, UUIDs and dict subclasses are
+    encoded natively by orjson; anything else goes through DRF's encoder.
+    Indented output (e.g. ?format=json; indent=4) uses the stdlib path.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None or not self.compact or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=_default, option=ORJSON_OPTIONS)
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+def stream_json_array(renderer, chunks, accepted_media_type=None):
+    """
+    Yield a JSON array piece by piece from an iterable of lists, so large
+    lists are sent without building the whole document in memory.
+    """
+    yield b'['
+    first = True
+    for chunk in chunks:
+        if not chunk:
+            continue
+        body = renderer.render(chunk, accepted_media_type)[1:-1]
+        if first:
+            first = False
+            yield body
+        else:
+            yield b',' + body
+    yield b']'
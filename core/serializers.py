@@ -0,0 +1,75 @@
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import ValidationError
+
+
+def split_paths(paths):
+    """
+    Turn ['id', 'lab.name', 'lab.address'] into
+    {'id': [], 'lab': ['name', 'address']}. Returns None for None.
+    """
+    if paths is None:
+        return None
+    tree = {}
+    for path in paths:
+        head, _, rest = path.partition('.')
+        children = tree.setdefault(head, [])
+        if rest:
+            children.append(rest)
+    return tree
+
+
+def resolve_serializer(serializer_class):
+    if isinstance(serializer_class, str):
+        return import_string(serializer_class)
+    return serializer_class
+
+
+class DynamicFieldsMixin:
+    """
+    Sparse fieldsets and on-demand expansion for ModelSerializers.
+
+    `fields` keeps only the named fields and `expand` renders the named
+    relations with the serializer listed in Meta.expandable_fields instead of
+    their primary key. Dotted names reach into expanded relations, e.g.
+    fields=['id', 'lab.name'] and expand=['lab_test.lab']. Names that do
+    not exist, or that reach into a relation which is not expanded, raise a
+    ValidationError (400) listing them.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, path='', **kwargs):
+        super().__init__(*args, **kwargs)
+        self._apply_expand(split_paths(expand) or {}, split_paths(fields), path)
+
+    def _check_names(self, expand_tree, fields_tree, path):
+        expandable = getattr(self.Meta, 'expandable_fields', {})
+        errors = {}
+        unknown = [name for name in expand_tree if name not in expandable or name not in self.fields]
+        if unknown:
+            errors['expand'] = [f'Cannot expand {path}{name}.' for name in unknown]
+        if fields_tree is not None:
+            unknown = [
+                name for name, children in fields_tree.items()
+                if name not in self.fields or (children and name not in expand_tree)
+            ]
+            if unknown:
+                errors['fields'] = [f'Unknown field {path}{name}.' for name in unknown]
+        if errors:
+            raise ValidationError(errors)
+
+    def _apply_expand(self, expand_tree, fields_tree, path=''):
+        self._check_names(expand_tree, fields_tree, path)
+        expandable = getattr(self.Meta, 'expandable_fields', {})
+        for name, nested_expand in expand_tree.items():
+            if fields_tree is not None and name not in fields_tree:
+                continue
+            serializer_class = resolve_serializer(expandable[name])
+            self.fields[name] = serializer_class(
+                read_only=True,
+                fields=(fields_tree or {}).get(name) or None,
+                expand=nested_expand or None,
+                path=f'{path}{name}.',
+            )
+
+        if fields_tree is not None:
+            for name in set(self.fields) - set(fields_tree):
+                self.fields.pop(name)
@@ -0,0 +1,69 @@
+"""
+Fixtures shared by the apps' tests: small factories for the catalog,
+users and bookings, and API clients that authenticate with a real JWT
+(so the middlewares see the same Authorization header as in production).
+"""
+from datetime import timedelta
+from decimal import Decimal
+from itertools import count
+
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+_sequence = count(1)
+
+
+def create_user(role='user', approval_status='approved', **fields):
+    n = next(_sequence)
+    fields.setdefault('username', f'{role}{n}')
+    fields.setdefault('email', f"{fields['username']}@example.com")
+    return get_user_model().objects.create_user(
+        password=fields.pop('password', 'secret-pass-123'), role=role, approval_status=approval_status, **fields,
+    )
+
+
+def create_admin(**fields):
+    return create_user(role='admin', is_staff=True, is_superuser=True, **fields)
+
+
+def create_lab(owner=None, **fields):
+    from labs.models import Laboratory
+    n = next(_sequence)
+    return Laboratory.objects.create(
+        owner=owner or create_user('lab_owner'), name=fields.pop('name', f'Lab {n}'),
+        address=fields.pop('address', f'{n} Test Street'), **fields,
+    )
+
+
+def create_test(name=None, **fields):
+    from tests.models import Test
+    return Test.objects.create(name=name or f'Test {next(_sequence)}', **fields)
+
+
+def create_lab_test(lab=None, test=None, price='25.00', **fields):
+    from labs.models import LabTest
+    return LabTest.objects.create(
+        lab=lab or create_lab(), test=test or create_test(), price=Decimal(price), **fields,
+    )
+
+
+def create_appointment(user=None, lab_test=None, when=None, **fields):
+    from appointments.models import Appointment
+    return Appointment.objects.create(
+        user=user or create_user(), lab_test=lab_test or create_lab_test(),
+        appointment_time=when or timezone.now() + timedelta(days=1), **fields,
+    )
+
+
+def access_token(user):
+    return str(RefreshToken.for_user(user).access_token)
+
+
+def api_client(user=None, **defaults):
+    """APIClient sending `user`'s access token, or anonymous"""
+    client = APIClient(**defaults)
+    if user is not None:
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token(user)}')
+    return client
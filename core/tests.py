@@ -0,0 +1,591 @@
+import gzip
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import uuid
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO
+from unittest import mock
+from zoneinfo import ZoneInfo
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
+from rest_framework.exceptions import ParseError
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from appointments.models import Appointment
+from appointments.serializers import AppointmentSerializer
+from labs.models import LabTest
+from labs.serializers import LabTestSerializer
+from accounts.views import AsyncProfileView, get_user_profile
+from labs.views import LabTestViewSet
+from tests.views import TestViewSet
+from . import idempotency, log, testing
+from .async_views import AsyncReadView, ViewSetReadView
+from .models import IdempotencyKey
+from .middleware import GZipMiddleware, SingleFlightMiddleware
+from .parsers import FastJSONParser
+from .projections import get_projection
+from .throttling import IPTokenBucketThrottle
+from .renderers import FastJSONRenderer, stream_json_array
+
+
+def make_record(msg='hello %s', args=('world',), level=logging.INFO, **extra):
+    record = logging.LogRecord('core.tests', level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+class JsonFormatterTests(SimpleTestCase):
+    def format(self, record):
+        return json.loads(log.JsonFormatter().format(record))
+
+    def test_one_json_object_per_record(self):
+        token = log.set_request_id('req-1')
+        try:
+            record = make_record()
+            log.RequestIdFilter().filter(record)
+        finally:
+            log.reset_request_id(token)
+        payload = self.format(record)
+        self.assertEqual(payload['message'], 'hello world')
+        self.assertEqual(payload['level'], 'INFO')
+        self.assertEqual(payload['logger'], 'core.tests')
+        self.assertEqual(payload['request_id'], 'req-1')
+        self.assertTrue(payload['ts'].endswith('+00:00'))
+
+    def test_extra_fields_are_redacted(self):
+        payload = self.format(make_record(
+            password='hunter2', user='ann', data={'Token': 'abc', 'items': [{'refresh': 'r', 'n': 1}]},
+        ))
+        self.assertEqual(payload['password'], log.REDACTED)
+        self.assertEqual(payload['user'], 'ann')
+        self.assertEqual(payload['data'], {'Token': log.REDACTED, 'items': [{'refresh': log.REDACTED, 'n': 1}]})
+
+    def test_secrets_in_messages_are_redacted(self):
+        message = self.format(make_record('login %s', ({'username': 'ann', 'password': 'hunter2'},)))['message']
+        self.assertNotIn('hunter2', message)
+        self.assertIn('ann', message)
+        message = self.format(make_record('GET /x?token=abc123&page=2', ()))['message']
+        self.assertEqual(message, f'GET /x?token={log.REDACTED}&page=2')
+
+    def test_exceptions_are_included(self):
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            record = logging.LogRecord('core.tests', logging.ERROR, __file__, 1, 'failed', (), sys.exc_info())
+        self.assertIn('ValueError: boom', self.format(record)['exc'])
+
+
+class SamplingFilterTests(SimpleTestCase):
+    def test_only_low_levels_are_sampled(self):
+        never = log.SamplingFilter(rate=0, level='DEBUG')
+        self.assertFalse(never.filter(make_record(level=logging.DEBUG)))
+        self.assertTrue(never.filter(make_record(level=logging.INFO)))
+        self.assertTrue(log.SamplingFilter(rate=1).filter(make_record(level=logging.DEBUG)))
+
+
+class BackgroundQueueHandlerTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'test.log')
+        self.handler = log.BackgroundQueueHandler(filename=self.path, console=False)
+        self.addCleanup(self.handler.close)
+
+    def test_close_flushes_and_stops_the_listener(self):
+        listener = self.handler.listener
+        self.handler.handle(make_record(password='x'))
+        self.handler.handle(make_record('second', ()))
+        self.handler.close()
+        self.assertIsNone(self.handler.listener)
+        self.assertIsNone(listener._thread)
+        with open(self.path, encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line['message'] for line in lines], ['hello world', 'second'])
+        self.assertEqual(lines[0]['password'], log.REDACTED)
+        # A second close (atexit) is harmless
+        self.handler.close()
+
+    def test_arguments_are_merged_on_the_calling_thread(self):
+        items = ['before']
+        prepared = self.handler.prepare(make_record('value %s', (items,)))
+        items[0] = 'after'
+        self.assertEqual(prepared.getMessage(), "value ['before']")
+        self.assertIsNone(prepared.args)
+
+
+class ProjectionEquivalenceTests(TestCase):
+    """Projected rows must match the ModelSerializer field for field"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = testing.create_user('lab_owner')
+        lab = testing.create_lab(cls.owner)
+        cls.lab_tests = [
+            testing.create_lab_test(lab, price='12.50'),
+            testing.create_lab_test(lab, price='0.05', is_active=False),
+            testing.create_lab_test(price='1999.99'),
+        ]
+        start = timezone.now().replace(microsecond=123456)
+        for i, lab_test in enumerate(cls.lab_tests * 2):
+            testing.create_appointment(cls.owner, lab_test, start + timedelta(hours=i, minutes=7))
+        # Nullable columns must come out as None, not be converted
+        Appointment.objects.filter(pk=Appointment.objects.order_by('id').first().pk).update(price=None)
+
+    def assertSameOutput(self, serializer_class, queryset, fields=None):
+        projected = get_projection(serializer_class, fields).serialize(queryset)
+        serialized = serializer_class(queryset, many=True, fields=fields).data
+        self.assertEqual(projected, [dict(row) for row in serialized])
+        # And byte for byte once rendered
+        renderer = FastJSONRenderer()
+        self.assertEqual(renderer.render(projected), renderer.render(serialized))
+
+    def test_lab_tests(self):
+        self.assertSameOutput(LabTestSerializer, LabTest.objects.order_by('id'))
+
+    def test_appointments(self):
+        self.assertSameOutput(AppointmentSerializer, Appointment.objects.order_by('id'))
+
+    def test_appointments_in_another_time_zone(self):
+        with timezone.override('America/New_York'):
+            self.assertSameOutput(AppointmentSerializer, Appointment.objects.order_by('id'))
+
+    def test_field_subsets(self):
+        self.assertSameOutput(AppointmentSerializer, Appointment.objects.order_by('id'), ['id', 'price', 'appointment_time'])
+        self.assertSameOutput(LabTestSerializer, LabTest.objects.order_by('id'), ['lab', 'price'])
+
+    def test_list_endpoints_match_the_serializer(self):
+        client = testing.api_client(self.owner)
+        response = client.get(reverse('labtest-list'))
+        expected = LabTestSerializer(LabTest.objects.filter(lab__is_active=True).order_by('id'), many=True).data
+        self.assertEqual(sorted(response.json(), key=lambda row: row['id']), json.loads(FastJSONRenderer().render(expected)))
+
+        response = client.get(reverse('appointment-list'))
+        expected = AppointmentSerializer(Appointment.objects.order_by('appointment_time', 'id'), many=True).data
+        self.assertEqual(response.json(), json.loads(FastJSONRenderer().render(expected)))
+
+    def test_unprojectable_fields_are_rejected(self):
+        class Computed(LabTestSerializer):
+            label = serializers.SerializerMethodField()
+
+            class Meta(LabTestSerializer.Meta):
+                fields = ('id', 'label')
+
+            def get_label(self, obj):
+                return str(obj)
+
+        with self.assertRaises(ImproperlyConfigured):
+            get_projection(Computed)
+
+
+class RendererTests(SimpleTestCase):
+    def test_matches_the_stock_json_renderer(self):
+        data = {
+            'price': Decimal('12.50'),
+            'when': datetime(2026, 3, 29, 1, 30, 5, 123456, tzinfo=dt_timezone.utc),
+            'local': datetime(2026, 3, 29, 3, 30, tzinfo=ZoneInfo('Europe/Berlin')),
+            'day': date(2026, 3, 29),
+            'at': time(9, 15),
+            'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'text': 'café     </script>',
+            'nested': [{'n': 1, 'f': 1.5, 'none': None, 'ok': True}],
+            1: 'integer key',
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_indented_output_uses_the_stdlib_path(self):
+        data = {'a': [1, 2]}
+        rendered = FastJSONRenderer().render(data, 'application/json; indent=2')
+        self.assertEqual(rendered, JSONRenderer().render(data, 'application/json; indent=2'))
+        self.assertIn(b'\n  ', rendered)
+
+    def test_none_renders_empty(self):
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_stream_json_array(self):
+        renderer = FastJSONRenderer()
+        self.assertEqual(b''.join(stream_json_array(renderer, [[1, {'a': 2}], [], [3]])), b'[1,{"a":2},3]')
+        self.assertEqual(b''.join(stream_json_array(renderer, [])), b'[]')
+
+
+class ParserTests(SimpleTestCase):
+    def parse(self, body, encoding='utf-8'):
+        return FastJSONParser().parse(BytesIO(body), 'application/json', {'encoding': encoding})
+
+    def test_parses_utf8(self):
+        self.assertEqual(self.parse('{"name": "café", "n": [1, 2.5]}'.encode()), {'name': 'café', 'n': [1, 2.5]})
+
+    def test_other_encodings_use_the_stdlib_parser(self):
+        self.assertEqual(self.parse('{"name": "café"}'.encode('latin-1'), 'latin-1'), {'name': 'café'})
+
+    def test_invalid_json_is_a_parse_error(self):
+        with self.assertRaises(ParseError):
+            self.parse(b'{"name": ')
+
+
+class GZipThresholdTests(SimpleTestCase):
+    def respond(self, body, streaming=False):
+        def get_response(request):
+            if streaming:
+                return StreamingHttpResponse(iter([body]))
+            return HttpResponse(body, content_type='application/json')
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        return GZipMiddleware(get_response)(request)
+
+    @override_settings(GZIP_MIN_LENGTH=1024)
+    def test_small_bodies_are_sent_as_is(self):
+        response = self.respond(b'x' * 1023)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, b'x' * 1023)
+
+    @override_settings(GZIP_MIN_LENGTH=1024)
+    def test_large_and_streamed_bodies_are_compressed(self):
+        response = self.respond(b'x' * 1024)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), b'x' * 1024)
+        response = self.respond(b'x' * 10, streaming=True)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b'x' * 10)
+
+
+# Single flight buffers the routes it coalesces, streamed or not
+@override_settings(SINGLE_FLIGHT_ROUTES={})
+class StreamedListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = testing.create_user()
+        lab = testing.create_lab()
+        for price in ('1.00', '2.00', '3.00', '4.00', '5.00'):
+            testing.create_lab_test(lab, price=price)
+
+    def get(self, chunk_size):
+        with mock.patch.object(LabTestViewSet, 'stream_chunk_size', chunk_size):
+            return testing.api_client(self.user).get(reverse('labtest-list'))
+
+    def test_long_lists_are_streamed_with_the_same_content(self):
+        streamed = self.get(2)
+        self.assertTrue(streamed.streaming)
+        body = json.loads(b''.join(streamed.streaming_content))
+        whole = self.get(100)
+        self.assertFalse(whole.streaming)
+        self.assertEqual(body, whole.json())
+        self.assertEqual([row['price'] for row in body], ['1.00', '2.00', '3.00', '4.00', '5.00'])
+
+
+class SparseFieldsetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = testing.create_user()
+        cls.lab_test = testing.create_lab_test(price='30.00')
+        cls.appointment = testing.create_appointment(cls.user, cls.lab_test)
+
+    def setUp(self):
+        self.client = testing.api_client(self.user)
+
+    def get(self, name, params, **kwargs):
+        return self.client.get(reverse(name, kwargs=kwargs or None), params)
+
+    def test_fields_selects_columns(self):
+        response = self.get('labtest-list', {'fields': 'id,price'})
+        self.assertEqual(response.json(), [{'id': self.lab_test.pk, 'price': '30.00'}])
+        response = self.get('labtest-detail', {'fields': 'price'}, pk=self.lab_test.pk)
+        self.assertEqual(response.json(), {'price': '30.00'})
+
+    def test_expand_renders_relations(self):
+        row = self.get('labtest-list', {'expand': 'lab,test'}).json()[0]
+        self.assertEqual(row['lab']['name'], self.lab_test.lab.name)
+        self.assertEqual(row['test']['name'], self.lab_test.test.name)
+
+    def test_dotted_fields_reach_into_expanded_relations(self):
+        response = self.get('appointment-list', {
+            'fields': 'id,lab_test.price,lab_test.lab.name', 'expand': 'lab_test.lab',
+        })
+        self.assertEqual(response.json(), [{
+            'id': self.appointment.pk,
+            'lab_test': {'price': '30.00', 'lab': {'name': self.lab_test.lab.name}},
+        }])
+
+    def test_unknown_names_are_rejected(self):
+        response = self.get('labtest-list', {'fields': 'id,colour'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'fields': ['Unknown field colour.']})
+
+        response = self.get('labtest-list', {'expand': 'owner'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'expand': ['Cannot expand owner.']})
+
+        # Nested names are checked against the expanded serializer
+        response = self.get('appointment-list', {'fields': 'lab_test.lab.colour', 'expand': 'lab_test.lab'})
+        self.assertEqual(response.json(), {'fields': ['Unknown field lab_test.lab.colour.']})
+
+    def test_dotted_fields_need_the_relation_expanded(self):
+        response = self.get('labtest-list', {'fields': 'id,lab.name'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'fields': ['Unknown field lab.']})
+
+    def test_writes_ignore_the_parameters(self):
+        response = self.client.patch(
+            reverse('labtest-detail', kwargs={'pk': self.lab_test.pk}) + '?fields=colour', {'price': '31.00'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('lab', response.json())
+
+
+class IdempotencyTests(TestCase):
+    """Idempotency-Key on appointment booking"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = testing.create_user()
+        cls.lab_test = testing.create_lab_test()
+
+    def setUp(self):
+        self.client = testing.api_client(self.user)
+
+    def book(self, key, hours=24):
+        when = (timezone.now() + timedelta(hours=hours)).replace(minute=0, second=0, microsecond=0)
+        return self.client.post(
+            reverse('appointment-list'),
+            {'user': self.user.pk, 'lab_test': self.lab_test.pk, 'appointment_time': when.isoformat()},
+            format='json', HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retries_replay_the_first_response(self):
+        first = self.book('key-1')
+        self.assertEqual(first.status_code, 201)
+        retry = self.book('key-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json()['id'], first.json()['id'])
+        self.assertEqual(Appointment.objects.count(), 1)
+        self.assertEqual(retry['Content-Type'], first['Content-Type'])
+
+    def test_replays_keep_the_headers(self):
+        def request():
+            request = RequestFactory().post('/', b'{}', content_type='application/json', HTTP_IDEMPOTENCY_KEY='key-1')
+            request.user = self.user
+            return request
+
+        def handler():
+            headers = {'Location': '/things/1/', 'ETag': '"v1"', 'Retry-After': '5'}
+            return Response({'id': 1}, status=201, headers=headers, content_type='application/x-thing')
+
+        idempotency.run_idempotent(request(), handler)
+        retry = idempotency.run_idempotent(request(), handler)
+        self.assertEqual((retry['Location'], retry['ETag']), ('/things/1/', '"v1"'))
+        self.assertFalse(retry.has_header('Retry-After'))
+        self.assertEqual(retry.content_type, 'application/x-thing')
+
+    def test_keys_are_per_caller(self):
+        self.book('key-1')
+        self.client = testing.api_client(testing.create_user())
+        self.assertFalse(self.book('key-1').has_header('Idempotent-Replayed'))
+
+    def test_reusing_a_key_for_another_request_is_refused(self):
+        self.book('key-1')
+        response = self.book('key-1', hours=48)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY_RETRY_AFTER=3)
+    def test_duplicates_of_an_in_flight_request_are_told_to_retry(self):
+        def request():
+            request = RequestFactory().post('/', b'{}', content_type='application/json', HTTP_IDEMPOTENCY_KEY='key-1')
+            request.user = self.user
+            return request
+
+        duplicates = []
+
+        def handler():
+            # Arrives while the first request still holds the key
+            duplicates.append(idempotency.run_idempotent(request(), lambda: self.fail('ran twice')))
+            return Response({'ok': True}, status=201)
+
+        self.assertEqual(idempotency.run_idempotent(request(), handler).status_code, 201)
+        self.assertEqual(duplicates[0].status_code, 409)
+        self.assertEqual(duplicates[0]['Retry-After'], '3')
+        self.assertEqual(idempotency.run_idempotent(request(), handler)['Idempotent-Replayed'], 'true')
+
+    def test_failed_requests_release_the_key(self):
+        with mock.patch('appointments.views.AppointmentViewSet.perform_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.book('key-1')
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.book('key-1').status_code, 201)
+
+
+class AsyncTestThrottle(IPTokenBucketThrottle):
+    scope = 'async_test'
+
+
+@api_view(['GET'])
+@throttle_classes([AsyncTestThrottle])
+def throttled_view(request):
+    return Response({'path': 'sync'})
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def admin_view(request):
+    return Response({'path': 'sync'})
+
+
+class AsyncTestView(AsyncReadView):
+    async def get(self, request):
+        return self.render({'path': 'async'})
+
+
+class AsyncReadViewTests(TestCase):
+    """The async read paths answer exactly as the sync views do"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = testing.create_user(first_name='Ada')
+        cls.tests = [testing.create_test(), testing.create_test()]
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, view, user=None, path='/', **kwargs):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {testing.access_token(user)}'} if user else {}
+        if iscoroutinefunction(view):
+            view = async_to_sync(view)
+        response = view(RequestFactory().get(path, **headers), **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def assertSameResponse(self, sync_view, async_view, user=None, **kwargs):
+        expected, actual = self.get(sync_view, user, **kwargs), self.get(async_view, user, **kwargs)
+        self.assertEqual(actual.status_code, expected.status_code)
+        self.assertEqual(json.loads(actual.content), json.loads(expected.content))
+        for header in ('ETag', 'Allow', 'Content-Type'):
+            self.assertEqual(actual.get(header), expected.get(header))
+
+    def test_profile(self):
+        self.assertSameResponse(get_user_profile, AsyncProfileView.as_view(get_user_profile), self.user)
+
+    def test_viewset_list_and_retrieve(self):
+        for actions, kwargs in (({'get': 'list'}, {}), ({'get': 'retrieve'}, {'pk': str(self.tests[1].pk)})):
+            sync_view = TestViewSet.as_view(actions)
+            self.assertSameResponse(sync_view, ViewSetReadView.as_view(sync_view), self.user, **kwargs)
+
+    @mock.patch.dict(api_settings.DEFAULT_THROTTLE_RATES, {'async_test': '1/min'})
+    def test_throttles_apply_to_the_async_path(self):
+        view = AsyncTestView.as_view(throttled_view)
+        self.assertEqual(json.loads(self.get(view, self.user).content), {'path': 'async'})
+        response = self.get(view, self.user)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_permissions_apply_to_the_async_path(self):
+        view = AsyncTestView.as_view(admin_view)
+        self.assertEqual(self.get(view, self.user).status_code, 403)
+        self.assertEqual(json.loads(self.get(view, testing.create_admin()).content), {'path': 'async'})
+
+
+@override_settings(SINGLE_FLIGHT_ROUTES={'laboratory-list': 'shared', 'labtest-list': 'user'}, SINGLE_FLIGHT_TTL=1.0)
+class SingleFlightTests(TransactionTestCase):
+    def setUp(self):
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+        self.middleware = SingleFlightMiddleware(self.view)
+        self.users = {user_id: testing.create_user() for user_id in (1, 2)}
+
+    def view(self, request):
+        self.calls.append(request)
+        self.release.wait(5)
+        return HttpResponse(f"{len(self.calls)} {request.headers.get('Authorization', 'anonymous')}")
+
+    def request(self, route='laboratory-list', user_id=None, method='get', **headers):
+        if user_id is not None:
+            headers['HTTP_AUTHORIZATION'] = f'Bearer {testing.access_token(self.users[user_id])}'
+        return getattr(RequestFactory(), method)(reverse(route), **headers)
+
+    def concurrently(self, *requests):
+        """Send the requests together while the first one is still in the view"""
+        self.release.clear()
+        responses = [None] * len(requests)
+
+        def send(index, request):
+            responses[index] = self.middleware(request)
+
+        threads = [threading.Thread(target=send, args=item) for item in enumerate(requests)]
+        threads[0].start()
+        while not self.calls:
+            threading.Event().wait(0.001)
+        for thread in threads[1:]:
+            thread.start()
+        threading.Event().wait(0.05)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return [response.content.decode() for response in responses]
+
+    def test_identical_requests_share_one_response(self):
+        bodies = self.concurrently(*(self.request(user_id=1) for _ in range(4)))
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(len(set(bodies)), 1)
+
+    def test_shared_routes_are_shared_between_users(self):
+        self.concurrently(self.request(user_id=1), self.request(user_id=2))
+        self.assertEqual(len(self.calls), 1)
+
+    def test_per_user_routes_are_never_shared_between_users(self):
+        bodies = self.concurrently(self.request('labtest-list', 1), self.request('labtest-list', 2))
+        self.assertEqual(len(self.calls), 2)
+        self.assertNotEqual(bodies[0].split()[-1], bodies[1].split()[-1])
+
+    def test_anonymous_and_authenticated_callers_are_never_shared(self):
+        self.concurrently(self.request(user_id=1), self.request())
+        self.assertEqual(len(self.calls), 2)
+
+    def test_invalid_tokens_are_never_coalesced(self):
+        self.concurrently(self.request(user_id=1), self.request(HTTP_AUTHORIZATION='Bearer forged'))
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.middleware(self.request(HTTP_AUTHORIZATION='Bearer forged')).content.split()[0], b'3')
+
+    def test_inactive_users_never_join_a_flight(self):
+        inactive = self.request(user_id=2)
+        get_user_model().objects.filter(pk=self.users[2].pk).update(is_active=False)
+        self.concurrently(self.request(user_id=1), inactive)
+        self.assertEqual(len(self.calls), 2)
+        self.middleware(inactive)
+        self.assertEqual(len(self.calls), 3)
+
+    def test_error_responses_are_never_shared(self):
+        self.view = lambda request: self.calls.append(request) or HttpResponse(status=429)
+        self.middleware = SingleFlightMiddleware(self.view)
+        self.middleware(self.request(user_id=1))
+        self.assertEqual(self.middleware(self.request(user_id=2)).status_code, 429)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_negotiation_headers_are_part_of_the_key(self):
+        self.concurrently(
+            self.request(user_id=1), self.request(user_id=1, HTTP_ACCEPT_ENCODING='gzip'),
+            self.request(user_id=1, HTTP_IF_NONE_MATCH='"1.1"'),
+        )
+        self.assertEqual(len(self.calls), 3)
+
+    def test_responses_are_reused_until_a_write(self):
+        first = self.middleware(self.request(user_id=1))
+        self.assertEqual(self.middleware(self.request(user_id=2)).content, first.content)
+        self.middleware(self.request('labtest-list', user_id=1, method='post'))
+        self.assertNotEqual(self.middleware(self.request(user_id=1)).content, first.content)
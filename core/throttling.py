@@ -0,0 +1,109 @@
+"""
+Token-bucket throttling backed by the shared cache.
+
+Each bucket holds `capacity` tokens and refills at `rate` tokens per second.
+State lives in two cache keys, the bucket's start time and the number of
+tokens consumed since then, and consumption is a single atomic incr(), so
+concurrent requests across worker processes (with a shared backend such as
+Redis) never lose updates.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache as default_cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class TokenBucket:
+    """A token bucket per identifier, stored in a Django cache"""
+
+    def __init__(self, capacity, rate, cache=None, key_prefix='throttle'):
+        self.capacity = capacity
+        self.rate = rate
+        self.cache = cache or default_cache
+        self.key_prefix = key_prefix
+        # Buckets restart full once their keys expire, which allows at most
+        # one extra burst per ten refill periods.
+        self.timeout = max(60, int(10 * capacity / rate))
+
+    def consume(self, ident, tokens=1):
+        """Take tokens from ident's bucket; returns (allowed, seconds to wait)"""
+        now = time.time()
+        key = f'{self.key_prefix}:{ident}'
+        start_key, used_key = f'{key}:start', f'{key}:used'
+
+        if self.cache.add(start_key, now, self.timeout):
+            self.cache.set(used_key, 0, self.timeout)
+            start = now
+        else:
+            start = self.cache.get(start_key, now)
+        try:
+            used = self.cache.incr(used_key, tokens)
+        except ValueError:
+            self.cache.add(used_key, 0, self.timeout)
+            used = self.cache.incr(used_key, tokens)
+
+        credit = self.capacity + (now - start) * self.rate
+        # Tokens earned while the bucket was already full are forfeited. The
+        # short lock stops two requests from discarding the same surplus.
+        overflow = int(credit - (used - tokens) - self.capacity)
+        if overflow > 0 and self.cache.add(f'{key}:rebase', 1, 1):
+            used = self.cache.incr(used_key, overflow)
+
+        if used <= credit:
+            return True, 0
+        # Rejected requests do not consume tokens
+        self.cache.decr(used_key, tokens)
+        return False, (used - credit) / self.rate
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    DRF throttle over a TokenBucket. A rate of 'N/period' becomes a bucket
+    of N tokens refilled over one period, so short bursts up to N pass but
+    the sustained rate is capped. Rates come from DEFAULT_THROTTLE_RATES
+    keyed by `scope`.
+    """
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+
+    def get_rate(self):
+        return api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        bucket = TokenBucket(self.num_requests, self.num_requests / self.duration, self.cache, self.key)
+        allowed, self._wait = bucket.consume('bucket')
+        return allowed
+
+    def wait(self):
+        return self._wait
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    """One bucket per client address"""
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class UsernameTokenBucketThrottle(TokenBucketThrottle):
+    """
+    One bucket per target username, taken from the URL or the request body,
+    so a single account cannot be hammered from many addresses.
+    """
+    username_field = 'username'
+
+    def get_cache_key(self, request, view):
+        username = getattr(view, 'kwargs', {}).get(self.username_field)
+        if username is None and hasattr(request.data, 'get'):
+            username = request.data.get(self.username_field)
+        if not username or not isinstance(username, str):
+            return None
+        ident = hashlib.sha256(username.lower().encode()).hexdigest()
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
@@ -1,12 +1,65 @@
 from django.contrib import admin
-from .models import Laboratory, LabTest
+from . import catalog
+from .models import Laboratory, LabOffboarding, LabTest, LabTestPrice
 
 @admin.register(Laboratory)
 class LaboratoryAdmin(admin.ModelAdmin):
-    list_display = ('name', 'owner', 'address', 'created_at')
+    """
+    Laboratories cannot be deleted here: a delete would cascade through
+    every lab test and booking in one transaction. The offboard actions
+    deactivate them and queue a LabOffboarding job instead.
+    """
+    list_display = ('name', 'owner', 'address', 'is_active', 'created_at')
+    list_filter = ('is_active',)
     search_fields = ('name', 'owner__username')
+    actions = ['offboard_labs', 'archive_labs']
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def queue_offboarding(self, queryset, mode):
+        labs = list(queryset)
+        for lab in labs:
+            lab.offboard(mode)
+        return len(labs)
+
+    @admin.action(description='Offboard selected laboratories (removed in the background)')
+    def offboard_labs(self, request, queryset):
+        count = self.queue_offboarding(queryset, 'delete')
+        self.message_user(request, f'{count} laboratories deactivated and queued for removal.')
+
+    @admin.action(description='Archive selected laboratories (records kept, upcoming bookings cancelled)')
+    def archive_labs(self, request, queryset):
+        count = self.queue_offboarding(queryset, 'archive')
+        self.message_user(request, f'{count} laboratories deactivated and queued for archiving.')
+
+class LabTestPriceInline(admin.TabularInline):
+    model = LabTestPrice
+    fields = ('price', 'valid_from', 'valid_to')
+    readonly_fields = fields
+    ordering = ('-valid_from',)
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
 
 @admin.register(LabTest)
 class LabTestAdmin(admin.ModelAdmin):
+    inlines = [LabTestPriceInline]
     list_display = ('lab', 'test', 'price', 'is_active')
-    list_filter = ('lab',)
\ No newline at end of file
+    list_filter = ('lab',)
+
+    def delete_queryset(self, request, queryset):
+        catalog.delete(queryset)
+
+@admin.register(LabOffboarding)
+class LabOffboardingAdmin(admin.ModelAdmin):
+    list_display = ('lab_name', 'lab_id', 'mode', 'stage', 'processed', 'created_at', 'finished_at')
+    list_filter = ('mode', 'finished_at')
+    readonly_fields = ('lab_id', 'lab_name', 'stage', 'cursor', 'processed', 'error', 'finished_at')
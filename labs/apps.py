@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class LabsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'labs'
+
+    def ready(self):
+        from django.apps import apps
+        from django.db.models.signals import post_delete
+        from . import signals
+
+        for model in (apps.get_model('tests', 'Test'), self.get_model('Laboratory'), self.get_model('LabTest')):
+            post_delete.connect(signals.record_deletion, sender=model)
@@ -0,0 +1,199 @@
+"""
+Delta sync of the test catalog (Test, Laboratory, LabTest) for offline
+clients.
+
+Every catalog row carries an indexed updated_at and every delete leaves a
+CatalogTombstone, so the changes since a point in time are one index range
+per table. The four tables are read as a single stream ordered by
+(time, kind, id). A token is a position in that stream, so a page can end
+between rows that share a timestamp, and the next page carries on from
+exactly there.
+
+Without a token the client gets the whole active catalog, page by page.
+The last page of that download returns a delta token from when it began,
+so anything that changed while it was paging is sent again. The last page
+of a delta steps back settings.CATALOG_SYNC_OVERLAP, to catch
+transactions that committed late. Clients upsert and delete by id, so
+repeats are harmless.
+
+Offboarded labs, and lab tests that are inactive or belong to one, are
+reported as deletes. Bulk deletes go through delete(), which writes the
+tombstones in one insert instead of one per row from post_delete. Tokens
+older than settings.CATALOG_TOMBSTONE_RETENTION raise TokenExpired: the
+tombstones they would need may be gone.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from heapq import merge
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from core.projections import get_projection
+from tests.models import Test
+from tests.serializers import TestSerializer
+from .models import CatalogTombstone, Laboratory, LabTest
+from .signals import tombstones_recorded_for
+from .serializers import LaboratorySerializer, LabTestSerializer
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+# Stream order of rows that share a timestamp; also the response keys
+KINDS = ('tests', 'laboratories', 'lab_tests')
+TOMBSTONE_RANK = len(KINDS)
+_TOMBSTONE_KINDS = {'test': 'tests', 'laboratory': 'laboratories', 'lab_test': 'lab_tests'}
+
+
+class TokenExpired(Exception):
+    """The sync token predates the retained tombstones"""
+
+
+def delete(queryset):
+    """queryset.delete() for Test, Laboratory or LabTest rows, with their tombstones written in bulk"""
+    model = queryset.model
+    with transaction.atomic(using=queryset.db), tombstones_recorded_for(model):
+        ids = list(queryset.values_list('pk', flat=True))
+        result = queryset.filter(pk__in=ids).delete()
+        CatalogTombstone.objects.record(model, ids)
+    return result
+
+
+def _micros(moment):
+    return (moment - EPOCH) // MICROSECOND
+
+
+def _moment(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def make_token(position, started=None):
+    """
+    'd.<time>.<rank>.<id>' for a delta, 'f.<started>.<time>.<rank>.<id>'
+    while a full download is still paging
+    """
+    moment, rank, pk = position
+    if started is None:
+        return f'd.{_micros(moment)}.{rank}.{pk}'
+    return f'f.{_micros(started)}.{_micros(moment)}.{rank}.{pk}'
+
+
+def parse_token(token):
+    """(position, started) of a token; started is None for a delta"""
+    parts = token.split('.')
+    try:
+        if parts[0] == 'd' and len(parts) == 4:
+            started, (moment, rank, pk) = None, map(int, parts[1:])
+        elif parts[0] == 'f' and len(parts) == 5:
+            started, moment, rank, pk = map(int, parts[1:])
+            started = _moment(started)
+        else:
+            raise ValueError(token)
+        position = (_moment(moment), rank, pk)
+    except (ValueError, OverflowError):
+        raise ValidationError({'since': 'Invalid sync token.'})
+    if not 0 <= rank <= TOMBSTONE_RANK:
+        raise ValidationError({'since': 'Invalid sync token.'})
+    if (started or position[0]) < timezone.now() - settings.CATALOG_TOMBSTONE_RETENTION:
+        raise TokenExpired()
+    return position, started
+
+
+def _after(field, rank, position):
+    """Rows of stream rank `rank` that come after position, given their time column"""
+    if position is None:
+        return Q()
+    moment, at_rank, pk = position
+    if rank > at_rank:
+        return Q(**{f'{field}__gte': moment})
+    if rank == at_rank:
+        return Q(**{f'{field}__gt': moment}) | Q(**{field: moment, 'pk__gt': pk})
+    return Q(**{f'{field}__gt': moment})
+
+
+def _streams(position, limit, deltas):
+    """
+    One ordered list per table of (position, kind, deleted id, row); the
+    deleted id is None for rows to upsert
+    """
+    tests = get_projection(TestSerializer)
+    labs = get_projection(LaboratorySerializer)
+    lab_tests = get_projection(LabTestSerializer)
+
+    labs_queryset, lab_tests_queryset = Laboratory.objects.all(), LabTest.objects.all()
+    if not deltas:
+        # A fresh download only needs what is live
+        labs_queryset = labs_queryset.filter(is_active=True)
+        lab_tests_queryset = lab_tests_queryset.filter(is_active=True, lab__is_active=True)
+
+    def read(queryset, projection, rank, extra=(), live=None):
+        values = (
+            queryset.filter(_after('updated_at', rank, position)).order_by('updated_at', 'pk')
+            .values_list(*projection.lookups, *extra, 'updated_at', 'pk')[:limit]
+        )
+        kind = KINDS[rank]
+        # Trailing columns are ignored by the projection converter
+        return [
+            ((row[-2], rank, row[-1]), kind, None if live is None or live(row) else row[-1], row)
+            for row in values
+        ]
+
+    streams = [
+        read(Test.objects.all(), tests, 0),
+        read(labs_queryset, labs, 1, ('is_active',), live=lambda row: row[-3]),
+        read(lab_tests_queryset, lab_tests, 2, ('is_active', 'lab__is_active'), live=lambda row: row[-4] and row[-3]),
+    ]
+    if deltas:
+        tombstones = (
+            CatalogTombstone.objects.filter(_after('deleted_at', TOMBSTONE_RANK, position))
+            .order_by('deleted_at', 'pk').values_list('kind', 'object_id', 'deleted_at', 'pk')[:limit]
+        )
+        streams.append([
+            ((deleted_at, TOMBSTONE_RANK, pk), _TOMBSTONE_KINDS[kind], object_id, None)
+            for kind, object_id, deleted_at, pk in tombstones
+        ])
+    return streams, {kind: projection for kind, projection in zip(KINDS, (tests, labs, lab_tests))}
+
+
+def sync(token=None, page_size=None):
+    """
+    One page of catalog changes after token: upserted rows and deleted
+    ids per kind, the token to send next and whether more pages follow.
+    """
+    page_size = page_size or settings.CATALOG_SYNC_PAGE_SIZE
+    now = timezone.now()
+    position, started = parse_token(token) if token else (None, now)
+    deltas = token is not None and started is None
+
+    streams, projections = _streams(position, page_size + 1, deltas)
+    page = list(islice(merge(*streams, key=lambda item: item[0]), page_size + 1))
+    has_more = len(page) > page_size
+    page = page[:page_size]
+
+    upserts = {kind: [] for kind in KINDS}
+    deleted = {kind: [] for kind in KINDS}
+    for _, kind, deleted_id, row in page:
+        if deleted_id is None:
+            upserts[kind].append(row)
+        else:
+            deleted[kind].append(deleted_id)
+
+    if has_more:
+        next_token = make_token(page[-1][0], None if deltas else started)
+    elif deltas:
+        # Caught up: step back over transactions that may commit late
+        last = page[-1][0] if page else position
+        next_token = make_token(min(last, (now - settings.CATALOG_SYNC_OVERLAP, 0, 0)))
+    else:
+        # Download finished: resend whatever changed while it was paging
+        next_token = make_token((started - settings.CATALOG_SYNC_OVERLAP, 0, 0))
+
+    return {
+        **{kind: projections[kind].data(rows) for kind, rows in upserts.items()},
+        'deleted': deleted,
+        'token': next_token,
+        'has_more': has_more,
+    }
@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from labs.models import CatalogTombstone
+
+
+class Command(BaseCommand):
+    help = 'Delete catalog tombstones older than the retention period, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=None, metavar='DAYS',
+                            help='Retention in days (default settings.CATALOG_TOMBSTONE_RETENTION)')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        retention = settings.CATALOG_TOMBSTONE_RETENTION
+        if options['older_than'] is not None:
+            retention = timedelta(days=options['older_than'])
+        cutoff = timezone.now() - retention
+
+        total = 0
+        tombstones = CatalogTombstone.objects.filter(deleted_at__lt=cutoff)
+        while True:
+            ids = list(tombstones.order_by('id').values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            CatalogTombstone.objects.filter(id__in=ids).delete()
+            total += len(ids)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {total} catalog tombstones older than {cutoff:%Y-%m-%d %H:%M}'))
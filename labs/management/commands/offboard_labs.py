@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from labs import offboarding
+from labs.models import LabOffboarding
+
+
+class Command(BaseCommand):
+    help = "Delete or archive deactivated laboratories' data in batches, resuming unfinished jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Seconds to sleep between batches so other writers get the database')
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help='Stop each job after this many batches (the next run resumes it)')
+        parser.add_argument('--watch', type=float, default=None, metavar='SECONDS',
+                            help='Keep running, checking for new jobs every SECONDS')
+
+    def handle(self, *args, **options):
+        while True:
+            finished = offboarding.run_pending(options['batch_size'], options['pause'], options['max_batches'])
+            remaining = LabOffboarding.objects.filter(finished_at__isnull=True).count()
+            self.stdout.write(f'Finished {finished} offboarding job(s), {remaining} remaining')
+            if options['watch'] is None:
+                break
+            time.sleep(options['watch'])
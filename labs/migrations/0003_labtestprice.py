@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_prices(apps, schema_editor):
+    """Open one interval per lab test at today's price, from its lab's creation"""
+    LabTest = apps.get_model('labs', 'LabTest')
+    LabTestPrice = apps.get_model('labs', 'LabTestPrice')
+    alias = schema_editor.connection.alias
+    rows = LabTest.objects.using(alias).values_list('id', 'price', 'lab__created_at').iterator(chunk_size=2000)
+    batch = []
+    for lab_test_id, price, valid_from in rows:
+        batch.append(LabTestPrice(lab_test_id=lab_test_id, price=price, valid_from=valid_from))
+        if len(batch) >= 2000:
+            LabTestPrice.objects.using(alias).bulk_create(batch)
+            batch = []
+    LabTestPrice.objects.using(alias).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labs', '0002_labtest_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabTestPrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('valid_from', models.DateTimeField()),
+                ('valid_to', models.DateTimeField(blank=True, null=True)),
+                ('lab_test', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='prices', to='labs.labtest')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['lab_test', '-valid_from'], name='labtestprice_lookup_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('valid_to__isnull', True)), fields=('lab_test',), name='labtestprice_one_current')],
+            },
+        ),
+        migrations.RunPython(backfill_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labs', '0003_labtestprice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabOffboarding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lab_id', models.BigIntegerField(db_index=True)),
+                ('lab_name', models.CharField(max_length=255)),
+                ('mode', models.CharField(choices=[('delete', 'Delete the lab and everything booked against it'), ('archive', 'Keep the records, cancel upcoming bookings')], default='delete', max_length=10)),
+                ('stage', models.CharField(blank=True, max_length=50)),
+                ('cursor', models.BigIntegerField(default=0)),
+                ('processed', models.JSONField(default=dict)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='laboratory',
+            name='deactivated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='laboratory',
+            name='is_active',
+            field=models.BooleanField(db_index=True, default=True),
+        ),
+    ]
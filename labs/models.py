@@ -1,18 +1,184 @@
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import Q
 from django.conf import settings
+from django.utils import timezone
+from core.models import VersionedModel
 
 class Laboratory(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     address = models.TextField()
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='labs')
+    # Cleared when the lab is offboarded; inactive labs are hidden everywhere
+    is_active = models.BooleanField(default=True, db_index=True)
+    deactivated_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Catalog delta sync (labs.catalog) reads changes in this order
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
 
-class LabTest(models.Model):
+    def offboard(self, mode='delete'):
+        """
+        Deactivate the lab now and queue a LabOffboarding job that deletes
+        (or archives) its dependents in batches. Returns the job.
+        """
+        with transaction.atomic():
+            if self.is_active:
+                self.is_active, self.deactivated_at = False, timezone.now()
+                self.updated_at = self.deactivated_at
+                Laboratory.objects.filter(pk=self.pk).update(
+                    is_active=False, deactivated_at=self.deactivated_at, updated_at=self.updated_at,
+                )
+                # Synced catalogs drop the lab's tests along with it
+                LabTest.objects.filter(lab_id=self.pk).update(updated_at=self.updated_at)
+            job = LabOffboarding.objects.filter(lab_id=self.pk, finished_at__isnull=True).first()
+            if job is None:
+                job = LabOffboarding.objects.create(lab_id=self.pk, lab_name=self.name, mode=mode)
+        return job
+
+class LabTest(VersionedModel):
     lab = models.ForeignKey(Laboratory, on_delete= models.CASCADE, related_name='lab_tests')
     test = models.ForeignKey('tests.Test', on_delete=models.CASCADE)
     price = models.DecimalField(max_digits=10, decimal_places=2)
-    is_active = models.BooleanField(default=True)
\ No newline at end of file
+    is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    # Price as last read from the database, used to detect price changes
+    _loaded_price = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'price' in field_names:
+            instance._loaded_price = values[field_names.index('price')]
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using, fields, from_queryset)
+        # Loading another deferred field must not hide an unsaved price change
+        if fields is None or 'price' in fields:
+            self._loaded_price = self.price
+
+    def save(self, *args, **kwargs):
+        """Save, and record a new LabTestPrice interval when the price changes"""
+        update_fields = kwargs.get('update_fields')
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        saves_price = (update_fields is None or 'price' in update_fields) and 'price' not in self.get_deferred_fields()
+        if not self._state.adding and saves_price and self._loaded_price is None:
+            # Loaded with the price deferred
+            self._loaded_price = LabTest._base_manager.using(using).filter(pk=self.pk).values_list('price', flat=True).first()
+        price_changed = self._state.adding or (
+            saves_price and self._loaded_price is not None and self.price != self._loaded_price
+        )
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            if price_changed:
+                LabTestPrice.objects.db_manager(using).record(self)
+        if 'price' not in self.get_deferred_fields():
+            self._loaded_price = self.price
+
+
+class LabTestPriceManager(models.Manager):
+    def record(self, lab_test, when=None):
+        """Close the open interval of lab_test and open one at its current price"""
+        when = when or timezone.now()
+        self.filter(lab_test=lab_test, valid_to__isnull=True).update(valid_to=when)
+        return self.create(lab_test=lab_test, price=lab_test.price, valid_from=when)
+
+    def price_at(self, lab_test_id, when):
+        """Price of a lab test at `when`, or None if it was not offered yet"""
+        return (
+            self.filter(lab_test_id=lab_test_id, valid_from__lte=when)
+            .order_by('-valid_from').values_list('price', flat=True).first()
+        )
+
+
+class LabTestPrice(models.Model):
+    """
+    The price of a LabTest over [valid_from, valid_to); the current price has
+    no valid_to. Written by LabTest.save(), never edited, so price changes
+    made with QuerySet.update() are not recorded.
+    """
+    lab_test = models.ForeignKey(LabTest, on_delete=models.CASCADE, related_name='prices', db_index=False)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    valid_from = models.DateTimeField()
+    valid_to = models.DateTimeField(null=True, blank=True)
+
+    objects = LabTestPriceManager()
+
+    class Meta:
+        indexes = [
+            # Price at time T: seek to (lab_test, valid_from <= T), newest first
+            models.Index(fields=['lab_test', '-valid_from'], name='labtestprice_lookup_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['lab_test'], condition=Q(valid_to__isnull=True), name='labtestprice_one_current',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.lab_test_id}: {self.price} from {self.valid_from:%Y-%m-%d %H:%M}"
+
+
+class CatalogTombstoneManager(models.Manager):
+    KINDS = {'Test': 'test', 'Laboratory': 'laboratory', 'LabTest': 'lab_test'}
+
+    def record(self, model, ids, when=None):
+        """One tombstone per deleted id of a catalog model, in a single insert"""
+        when = when or timezone.now()
+        kind = self.KINDS[model.__name__]
+        return self.bulk_create([self.model(kind=kind, object_id=pk, deleted_at=when) for pk in ids])
+
+
+class CatalogTombstone(models.Model):
+    """
+    Record of a deleted Test, Laboratory or LabTest, so synced catalogs
+    can drop it (see labs.catalog). Written by post_delete signals for
+    single deletes and in bulk by labs.catalog.delete(), and removed by
+    compact_catalog_tombstones after settings.CATALOG_TOMBSTONE_RETENTION.
+    """
+    KIND_CHOICES = [
+        ('test', 'Test'),
+        ('laboratory', 'Laboratory'),
+        ('lab_test', 'Lab test'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    objects = CatalogTombstoneManager()
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} deleted {self.deleted_at:%Y-%m-%d %H:%M}"
+
+
+class LabOffboarding(models.Model):
+    """
+    Background removal of a deactivated laboratory's dependents, run in
+    keyset batches by the offboard_labs command (see labs.offboarding).
+    `stage` and `cursor` record how far it got, so a run that stops can be
+    resumed. The lab is kept as an id since 'delete' mode removes it.
+    """
+    MODE_CHOICES = [
+        ('delete', 'Delete the lab and everything booked against it'),
+        ('archive', 'Keep the records, cancel upcoming bookings'),
+    ]
+
+    lab_id = models.BigIntegerField(db_index=True)
+    lab_name = models.CharField(max_length=255)
+    mode = models.CharField(max_length=10, choices=MODE_CHOICES, default='delete')
+    stage = models.CharField(max_length=50, blank=True)
+    cursor = models.BigIntegerField(default=0)
+    processed = models.JSONField(default=dict)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        state = 'finished' if self.finished_at else self.stage or 'queued'
+        return f"{self.get_mode_display()} for {self.lab_name} ({state})"
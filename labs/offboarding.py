@@ -0,0 +1,123 @@
+"""
+Offboarding of deactivated laboratories.
+
+Deleting a Laboratory outright makes Django's collector load every lab
+test, price and appointment into memory and delete them in one transaction,
+which locks SQLite for as long as that takes. Laboratory.offboard() instead
+hides the lab at once and queues a LabOffboarding job; run() then works
+through the dependents stage by stage in keyset batches of `batch_size`
+rows, each in its own short transaction, saving its position after every
+batch so an interrupted run carries on where it stopped.
+"""
+import logging
+import time
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from appointments import sharding
+from appointments.models import Appointment, WaitlistEntry
+from . import catalog
+from .models import Laboratory, LabOffboarding, LabTest, LabTestPrice
+
+logger = logging.getLogger(__name__)
+
+
+def _delete(queryset):
+    return queryset.delete()[1].get(queryset.model._meta.label, 0)
+
+
+def _delete_catalog(queryset):
+    # Tombstones for the batch in one insert rather than a signal per row
+    return catalog.delete(queryset)[1].get(queryset.model._meta.label, 0)
+
+
+def _cancel(queryset):
+    return queryset.update(status='cancelled')
+
+
+def _deactivate(queryset):
+    return queryset.update(is_active=False, version=F('version') + 1, updated_at=timezone.now())
+
+
+def stages(job):
+    """(name, queryset, action) for each step of the job, in order"""
+    lab_test_ids = sharding.lab_test_ids(lab_id=job.lab_id)
+    waitlist = WaitlistEntry.objects.filter(lab_test_id__in=lab_test_ids)
+    lab_tests = LabTest.objects.filter(lab_id=job.lab_id)
+
+    if job.mode == 'archive':
+        result = [('waitlist', waitlist.filter(status='waiting'), _cancel)]
+        for alias in sharding.all_aliases():
+            upcoming = Appointment.objects.using(alias).filter(
+                lab_test_id__in=lab_test_ids, status='booked', appointment_time__gte=job.created_at,
+            )
+            result.append((f'appointments:{alias}', upcoming, _cancel))
+        result.append(('lab_tests', lab_tests.filter(is_active=True), _deactivate))
+        return result
+
+    result = [('waitlist', waitlist, _delete)]
+    for alias in sharding.all_aliases():
+        appointments = Appointment.objects.using(alias).filter(lab_test_id__in=lab_test_ids)
+        result.append((f'appointments:{alias}', appointments, _delete))
+    result += [
+        ('prices', LabTestPrice.objects.filter(lab_test__lab_id=job.lab_id), _delete),
+        ('lab_tests', lab_tests, _delete_catalog),
+        ('lab', Laboratory.objects.filter(pk=job.lab_id), _delete_catalog),
+    ]
+    return result
+
+
+def run(job, batch_size=500, pause=0, max_batches=None):
+    """
+    Process job until it finishes (returns True) or max_batches batches
+    have run (returns False). `pause` seconds between batches let other
+    writers take the database lock.
+    """
+    steps = stages(job)
+    names = [name for name, _, _ in steps]
+    start = names.index(job.stage) if job.stage in names else 0
+    batches = 0
+
+    for name, queryset, action in steps[start:]:
+        if job.stage != name:
+            job.stage, job.cursor = name, 0
+            job.save(update_fields=['stage', 'cursor', 'updated_at'])
+
+        while True:
+            ids = list(
+                queryset.filter(pk__gt=job.cursor).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic(using=queryset.db):
+                done = action(queryset.filter(pk__in=ids))
+            job.cursor = ids[-1]
+            job.processed[name] = job.processed.get(name, 0) + done
+            job.save(update_fields=['cursor', 'processed', 'updated_at'])
+
+            batches += 1
+            if max_batches and batches >= max_batches:
+                return False
+            if pause:
+                time.sleep(pause)
+
+    job.stage, job.cursor, job.error = 'done', 0, ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['stage', 'cursor', 'error', 'finished_at', 'updated_at'])
+    logger.info('Offboarded laboratory %s (%s): %s', job.lab_id, job.mode, job.processed)
+    return True
+
+
+def run_pending(batch_size=500, pause=0, max_batches=None):
+    """Run every unfinished job, oldest first; failures are recorded on the job"""
+    finished = 0
+    for job in LabOffboarding.objects.filter(finished_at__isnull=True).order_by('created_at'):
+        try:
+            finished += run(job, batch_size, pause, max_batches)
+        except Exception as e:
+            logger.exception('Offboarding of laboratory %s failed', job.lab_id)
+            LabOffboarding.objects.filter(pk=job.pk).update(error=str(e), updated_at=timezone.now())
+    return finished
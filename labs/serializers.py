@@ -1,12 +1,25 @@
 from rest_framework import serializers
-from .models import Laboratory, LabTest
+from core.serializers import DynamicFieldsMixin
+from .models import Laboratory, LabOffboarding, LabTest
 
-class LaboratorySerializer(serializers.ModelSerializer):
+class LaboratorySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Laboratory
         fields = '__all__'
+        read_only_fields = ('is_active', 'deactivated_at')
 
-class LabTestSerializer(serializers.ModelSerializer):
+class LabTestSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = LabTest
         fields = '__all__'
+        extra_kwargs = {'lab': {'queryset': Laboratory.objects.filter(is_active=True)}}
+        expandable_fields = {
+            'lab': LaboratorySerializer,
+            'test': 'tests.serializers.TestSerializer',
+        }
+
+
+class LabOffboardingSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LabOffboarding
+        fields = ('id', 'lab_id', 'mode', 'stage', 'processed', 'created_at', 'finished_at')
@@ -0,0 +1,28 @@
+import threading
+from contextlib import contextmanager
+
+from .models import CatalogTombstone
+
+_bulk = threading.local()
+
+
+@contextmanager
+def tombstones_recorded_for(model):
+    """
+    Within the block, deletes of `model` leave their tombstones to the
+    caller, which writes them in bulk; cascaded deletes of other catalog
+    models still get theirs here
+    """
+    models = getattr(_bulk, 'models', frozenset())
+    _bulk.models = models | {model}
+    try:
+        yield
+    finally:
+        _bulk.models = models
+
+
+def record_deletion(sender, instance, **kwargs):
+    """Leave a tombstone so synced catalogs drop the row (see labs.catalog)"""
+    if sender in getattr(_bulk, 'models', ()):
+        return
+    CatalogTombstone.objects.record(sender, [instance.pk])
@@ -1,3 +1,272 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.admin.sites import site
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from appointments.models import Appointment, AppointmentEvent, WaitlistEntry
+from core import testing
+from tests.models import Test
+from . import catalog, offboarding
+from .models import CatalogTombstone, Laboratory, LabOffboarding, LabTest, LabTestPrice
+
+
+class PriceHistoryTests(TestCase):
+    """Price changes close the current LabTestPrice row and open a new one"""
+
+    def setUp(self):
+        self.lab_test = testing.create_lab_test(price='25.00')
+
+    def history(self):
+        return list(LabTestPrice.objects.filter(lab_test=self.lab_test).order_by('valid_from', 'id'))
+
+    def change_price(self, price, lab_test=None):
+        lab_test = lab_test or LabTest.objects.get(pk=self.lab_test.pk)
+        lab_test.price = Decimal(price)
+        lab_test.save()
+        return lab_test
+
+    def test_new_lab_tests_open_an_interval(self):
+        [current] = self.history()
+        self.assertEqual(current.price, Decimal('25.00'))
+        self.assertIsNone(current.valid_to)
+
+    def test_price_change_closes_the_old_interval(self):
+        self.change_price('30.00')
+        old, current = self.history()
+        self.assertEqual((old.price, current.price), (Decimal('25.00'), Decimal('30.00')))
+        self.assertEqual(old.valid_to, current.valid_from)
+        self.assertIsNone(current.valid_to)
+        self.assertEqual(LabTestPrice.objects.price_at(self.lab_test.pk, old.valid_from), Decimal('25.00'))
+        self.assertEqual(LabTestPrice.objects.price_at(self.lab_test.pk, timezone.now()), Decimal('30.00'))
+        self.assertIsNone(LabTestPrice.objects.price_at(self.lab_test.pk, old.valid_from - timedelta(days=1)))
+
+    def test_other_changes_leave_the_history_alone(self):
+        lab_test = LabTest.objects.get(pk=self.lab_test.pk)
+        lab_test.is_active = False
+        lab_test.save()
+        self.change_price('25.00')
+        self.assertEqual(len(self.history()), 1)
+
+    def test_price_change_through_the_api(self):
+        response = testing.api_client(testing.create_admin()).patch(
+            reverse('labtest-detail', kwargs={'pk': self.lab_test.pk}), {'price': '40.00'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row.price for row in self.history()], [Decimal('25.00'), Decimal('40.00')])
+
+    def test_price_change_with_the_price_deferred(self):
+        lab_test = LabTest.objects.defer('price').get(pk=self.lab_test.pk)
+        self.change_price('30.00', lab_test)
+        self.assertEqual(len(self.history()), 2)
+
+    def test_loading_another_deferred_field_keeps_an_unsaved_change(self):
+        lab_test = LabTest.objects.defer('is_active').get(pk=self.lab_test.pk)
+        lab_test.price = Decimal('30.00')
+        lab_test.is_active  # loads the deferred field
+        lab_test.save()
+        self.assertEqual(len(self.history()), 2)
+
+
+class BookingPriceTests(TestCase):
+    """Appointments keep the price their lab test had when they were booked"""
+
+    def setUp(self):
+        self.lab_test = testing.create_lab_test(price='25.00')
+
+    def test_bookings_snapshot_the_price(self):
+        before = testing.create_appointment(lab_test=self.lab_test)
+        self.lab_test.price = Decimal('30.00')
+        self.lab_test.save()
+        after = testing.create_appointment(lab_test=LabTest.objects.get(pk=self.lab_test.pk))
+        before.refresh_from_db()
+        self.assertEqual(before.price, Decimal('25.00'))
+        self.assertEqual(after.price, Decimal('30.00'))
+
+    def test_bookings_through_the_api(self):
+        user = testing.create_user()
+        when = (timezone.now() + timedelta(days=1)).replace(microsecond=0)
+        response = testing.api_client(user).post(reverse('appointment-list'), {
+            'user': user.pk, 'lab_test': self.lab_test.pk, 'appointment_time': when.isoformat(), 'price': '1.00',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Decimal(response.json()['price']), Decimal('25.00'))
+
+
+class OffboardingTests(TestCase):
+    """offboard() hides the lab at once; the job then works through its dependents"""
+
+    def setUp(self):
+        self.lab = testing.create_lab()
+        self.lab_tests = [testing.create_lab_test(self.lab) for _ in range(3)]
+        self.other = testing.create_lab_test()
+        now = timezone.now()
+        self.past = testing.create_appointment(lab_test=self.lab_tests[0], when=now - timedelta(days=1))
+        self.upcoming = [
+            testing.create_appointment(lab_test=lab_test, when=now + timedelta(days=1)) for lab_test in self.lab_tests
+        ]
+        self.kept = testing.create_appointment(lab_test=self.other)
+        self.entry = WaitlistEntry.objects.create(
+            user=testing.create_user(), lab_test=self.lab_tests[1], day=timezone.localdate() + timedelta(days=1),
+        )
+
+    def test_offboard_hides_the_lab_and_queues_one_job(self):
+        job = self.lab.offboard()
+        self.lab.refresh_from_db()
+        self.assertFalse(self.lab.is_active)
+        self.assertIsNotNone(self.lab.deactivated_at)
+        self.assertEqual(self.lab.offboard().pk, job.pk)
+        self.assertEqual((job.mode, job.stage, job.finished_at), ('delete', '', None))
+
+    def test_delete_mode_removes_everything(self):
+        job = self.lab.offboard()
+        self.assertTrue(offboarding.run(job, batch_size=2))
+        job.refresh_from_db()
+        self.assertEqual(job.stage, 'done')
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(job.processed, {
+            'waitlist': 1, 'appointments:default': 4, 'prices': 3, 'lab_tests': 3, 'lab': 1,
+        })
+        self.assertFalse(Laboratory.objects.filter(pk=self.lab.pk).exists())
+        self.assertFalse(LabTest.objects.filter(lab_id=self.lab.pk).exists())
+        self.assertEqual(list(Appointment.objects.values_list('pk', flat=True)), [self.kept.pk])
+        self.assertFalse(WaitlistEntry.objects.exists())
+
+    def test_archive_mode_keeps_the_records(self):
+        job = self.lab.offboard('archive')
+        self.assertTrue(offboarding.run(job))
+        job.refresh_from_db()
+        self.assertEqual(job.processed, {'waitlist': 1, 'appointments:default': 3, 'lab_tests': 3})
+        statuses = dict(Appointment.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[self.past.pk], 'booked')
+        self.assertEqual({statuses[a.pk] for a in self.upcoming}, {'cancelled'})
+        self.assertEqual(statuses[self.kept.pk], 'booked')
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.status, 'cancelled')
+        self.assertFalse(LabTest.objects.filter(lab_id=self.lab.pk, is_active=True).exists())
+        self.assertTrue(Laboratory.objects.filter(pk=self.lab.pk).exists())
+        self.assertEqual(
+            AppointmentEvent.objects.filter(type='status_changed', status='cancelled', lab_id=self.lab.pk).count(), 3,
+        )
+
+    def test_interrupted_runs_resume(self):
+        job = self.lab.offboard()
+        self.assertFalse(offboarding.run(job, batch_size=1, max_batches=3))
+        job.refresh_from_db()
+        self.assertEqual(job.stage, 'appointments:default')
+        self.assertEqual(offboarding.run_pending(batch_size=1), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.processed['appointments:default'], 4)
+        self.assertFalse(Laboratory.objects.filter(pk=self.lab.pk).exists())
+
+    def test_api_delete_queues_a_job(self):
+        client = testing.api_client(testing.create_admin())
+        url = reverse('laboratory-detail', kwargs={'pk': self.lab.pk})
+        self.assertEqual(client.delete(url + '?mode=shred').status_code, 400)
+        response = client.delete(url + '?mode=archive')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['mode'], 'archive')
+        self.assertTrue(Laboratory.objects.filter(pk=self.lab.pk, is_active=False).exists())
+
+    def test_admin_offboards_instead_of_deleting(self):
+        admin = testing.create_admin()
+        request = RequestFactory().get('/')
+        request.user = admin
+        model_admin = site._registry[Laboratory]
+        self.assertFalse(model_admin.has_delete_permission(request, self.lab))
+        self.assertNotIn('delete_selected', model_admin.get_actions(request))
+
+        self.client.force_login(admin)
+        response = self.client.post(reverse('admin:labs_laboratory_changelist'), {
+            'action': 'archive_labs', '_selected_action': [self.lab.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(LabOffboarding.objects.values_list('lab_id', 'mode')), [(self.lab.pk, 'archive')])
+        response = self.client.get(reverse('admin:labs_laboratory_delete', args=[self.lab.pk]))
+        self.assertEqual(response.status_code, 403)
+
+
+class CatalogSyncTests(TestCase):
+    def setUp(self):
+        self.lab = testing.create_lab()
+        self.lab_tests = [testing.create_lab_test(self.lab) for _ in range(3)]
+        self.tests = [testing.create_test() for _ in range(3)]
+        # Everything changed at the same moment, an hour ago
+        self.moment = timezone.now() - timedelta(hours=1)
+        for model in (Test, Laboratory, LabTest):
+            model.objects.update(updated_at=self.moment)
+
+    def download(self, token=None, page_size=2):
+        """Every page from token on: ({kind: [ids]}, {kind: [deleted ids]}, final token)"""
+        ids = {kind: [] for kind in catalog.KINDS}
+        deleted = {kind: [] for kind in catalog.KINDS}
+        while True:
+            page = catalog.sync(token, page_size)
+            for kind in catalog.KINDS:
+                ids[kind] += [row['id'] for row in page[kind]]
+                deleted[kind] += page['deleted'][kind]
+            token = page['token']
+            if not page['has_more']:
+                return ids, deleted, token
+
+    def tombstones(self, kind):
+        return sorted(CatalogTombstone.objects.filter(kind=kind).values_list('object_id', flat=True))
+
+    def test_pages_that_end_inside_a_shared_timestamp(self):
+        ids, deleted, _ = self.download(page_size=2)
+        self.assertEqual(sorted(ids['tests']), sorted(Test.objects.values_list('pk', flat=True)))
+        self.assertEqual(ids['laboratories'], [self.lab.pk])
+        self.assertEqual(ids['lab_tests'], [lab_test.pk for lab_test in self.lab_tests])
+        self.assertEqual(deleted, {kind: [] for kind in catalog.KINDS})
+
+    def test_full_download_then_delta(self):
+        _, _, token = self.download()
+        changed = LabTest.objects.get(pk=self.lab_tests[0].pk)
+        changed.price = Decimal('30.00')
+        changed.save()
+        gone = self.tests[0].pk
+        self.tests[0].delete()
+        catalog.delete(LabTest.objects.filter(pk=self.lab_tests[1].pk))
+
+        ids, deleted, token = self.download(token)
+        self.assertEqual(ids, {'tests': [], 'laboratories': [], 'lab_tests': [changed.pk]})
+        self.assertEqual(deleted, {'tests': [gone], 'laboratories': [], 'lab_tests': [self.lab_tests[1].pk]})
+        # The last token steps back CATALOG_SYNC_OVERLAP, so repeats are expected but nothing new
+        ids, deleted, _ = self.download(token)
+        self.assertLessEqual(set(ids['lab_tests']), {changed.pk})
+
+    def test_expired_and_invalid_tokens(self):
+        client = testing.api_client(testing.create_user())
+        url = reverse('catalog-sync')
+        old = catalog.make_token((timezone.now() - timedelta(days=365), 0, 0))
+        self.assertEqual(client.get(url, {'since': old}).status_code, 410)
+        self.assertEqual(client.get(url, {'since': 'd.nope'}).status_code, 400)
+        self.assertEqual(client.get(url).status_code, 200)
+
+    def test_bulk_deletes_write_tombstones_in_one_insert(self):
+        ids = [test.pk for test in self.tests]
+        with CaptureQueriesContext(connection) as queries:
+            catalog.delete(Test.objects.filter(pk__in=ids))
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "labs_catalogtombstone"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(self.tombstones('test'), sorted(ids))
+
+    def test_cascaded_deletes_still_leave_tombstones(self):
+        test = self.lab_tests[0].test
+        catalog.delete(Test.objects.filter(pk=test.pk))
+        self.assertEqual(self.tombstones('test'), [test.pk])
+        self.assertEqual(self.tombstones('lab_test'), [self.lab_tests[0].pk])
+
+    def test_admin_bulk_delete(self):
+        request = RequestFactory().post('/')
+        site._registry[LabTest].delete_queryset(request, LabTest.objects.filter(lab=self.lab))
+        self.assertEqual(self.tombstones('lab_test'), [lab_test.pk for lab_test in self.lab_tests])
+
+    def test_offboarding_leaves_tombstones(self):
+        offboarding.run(self.lab.offboard(), batch_size=2)
+        self.assertEqual(self.tombstones('lab_test'), [lab_test.pk for lab_test in self.lab_tests])
+        self.assertEqual(self.tombstones('laboratory'), [self.lab.pk])
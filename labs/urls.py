@@ -1,11 +1,13 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import LaboratoryViewSet, LabTestViewSet
+from core.async_views import async_read_urls
+from .views import CatalogSyncView, LaboratoryViewSet, LabTestViewSet
 
 router = DefaultRouter()
 router.register(r'laboratories', LaboratoryViewSet)
 router.register(r'lab-tests', LabTestViewSet)
 
 urlpatterns = [
-    path('', include(router.urls)),
+    path('sync/', CatalogSyncView.as_view(), name='catalog-sync'),
+    path('', include(async_read_urls(router.urls))),
 ]
\ No newline at end of file
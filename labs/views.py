@@ -1,14 +1,54 @@
-from rest_framework import viewsets
-from .models import Laboratory, LabTest
-from .serializers import LaboratorySerializer, LabTestSerializer
+from django.conf import settings
+from rest_framework import status, viewsets
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from . import catalog
+from .models import Laboratory, LabOffboarding, LabTest
+from .serializers import LabOffboardingSerializer, LaboratorySerializer, LabTestSerializer
 from rest_framework import permissions
+from core.mixins import ConditionalUpdateMixin, ProjectionListMixin, SparseFieldsetMixin
 
-class LaboratoryViewSet(viewsets.ModelViewSet):
-    queryset = Laboratory.objects.all()
+class LaboratoryViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
+    queryset = Laboratory.objects.filter(is_active=True)
     serializer_class = LaboratorySerializer
     permission_classes = [permissions.IsAuthenticated]
 
-class LabTestViewSet(viewsets.ModelViewSet):
-    queryset = LabTest.objects.all()
+    def destroy(self, request, *args, **kwargs):
+        """
+        Deactivate the lab now; offboard_labs removes its data in the
+        background, or with ?mode=archive keeps it and cancels upcoming
+        bookings
+        """
+        mode = request.query_params.get('mode', 'delete')
+        if mode not in dict(LabOffboarding.MODE_CHOICES):
+            raise ValidationError({'mode': f"Choose one of: {', '.join(dict(LabOffboarding.MODE_CHOICES))}."})
+        job = self.get_object().offboard(mode)
+        return Response(LabOffboardingSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+class LabTestViewSet(ConditionalUpdateMixin, SparseFieldsetMixin, ProjectionListMixin, viewsets.ModelViewSet):
+    queryset = LabTest.objects.filter(lab__is_active=True)
     serializer_class = LabTestSerializer
-    permission_classes = [permissions.IsAuthenticated]
\ No newline at end of file
+    permission_classes = [permissions.IsAuthenticated]
+
+
+class CatalogSyncView(APIView):
+    """
+    Tests, laboratories and lab tests changed since ?since=<token>, the ids
+    deleted since, and the token for the next call (see labs.catalog).
+    Without a token, the whole catalog; keep calling while has_more is
+    true. 410 means the token is too old: start over without one.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        try:
+            page_size = int(request.query_params.get('page_size', settings.CATALOG_SYNC_PAGE_SIZE))
+        except ValueError:
+            raise ValidationError({'page_size': 'Enter a whole number.'})
+        if not 1 <= page_size <= settings.CATALOG_SYNC_MAX_PAGE_SIZE:
+            raise ValidationError({'page_size': f'Must be between 1 and {settings.CATALOG_SYNC_MAX_PAGE_SIZE}.'})
+        try:
+            return Response(catalog.sync(request.query_params.get('since') or None, page_size))
+        except catalog.TokenExpired:
+            return Response({'detail': 'Sync token expired; sync again without a token.'}, status=410)
@@ -1,7 +1,11 @@
 from django.contrib import admin
+from labs import catalog
 from .models import Test
 
 @admin.register(Test)
 class TestAdmin(admin.ModelAdmin):
     list_display = ('name', 'duration_minutes')
-    search_fields = ('name',)
+    search_fields = ('name', 'synonyms')
+
+    def delete_queryset(self, request, queryset):
+        catalog.delete(queryset)
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class TestsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tests'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from . import signals
+
+        Test = self.get_model('Test')
+        post_save.connect(signals.test_changed, sender=Test)
+        post_delete.connect(signals.test_changed, sender=Test)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tests', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='test',
+            name='synonyms',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+    ]
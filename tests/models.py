@@ -4,6 +4,13 @@ class Test(models.Model):
     name = models.CharField(max_length=255, unique=True)
     description = models.TextField(blank=True)
     duration_minutes= models.PositiveIntegerField(default=30)
+    # Other names the test is searched by, comma separated (e.g. "CBC, FBC")
+    synonyms = models.CharField(max_length=500, blank=True)
+    # Catalog delta sync (labs.catalog) reads changes in this order
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
+
+    def synonym_list(self):
+        return [name.strip() for name in self.synonyms.split(',') if name.strip()]
@@ -1,7 +1,8 @@
 from rest_framework import serializers
+from core.serializers import DynamicFieldsMixin
 from .models import Test
 
-class TestSerializer(serializers.ModelSerializer):
+class TestSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Test
         fields = '__all__'
@@ -0,0 +1,12 @@
+from django.db import transaction
+
+from .typeahead import bump_version
+
+
+def test_changed(sender, instance, **kwargs):
+    """
+    Tell every process to rebuild its typeahead index on next use, once
+    the change has committed: bumping earlier could have a process rebuild
+    from the old rows and keep them under the new version
+    """
+    transaction.on_commit(bump_version, using=kwargs.get('using'))
@@ -1,3 +1,38 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from core import testing
+from . import typeahead
+
+
+class TypeaheadVersionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_saves_bump_the_version_on_commit(self):
+        version = typeahead.current_version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            test = testing.create_test('Complete blood count')
+            self.assertEqual(typeahead.current_version(), version)
+        self.assertEqual(len(callbacks), 1)
+        self.assertNotEqual(typeahead.current_version(), version)
+        version = typeahead.current_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            test.delete()
+        self.assertNotEqual(typeahead.current_version(), version)
+
+    def test_new_tests_are_found_once_the_version_moves(self):
+        with mock.patch.object(typeahead, '_index', None), mock.patch.object(typeahead, '_checked_at', 0.0):
+            self.assertEqual(typeahead.search('ferritin'), [])
+            with self.captureOnCommitCallbacks(execute=True):
+                testing.create_test('Serum ferritin')
+            typeahead._checked_at = 0.0
+            self.assertEqual([row['name'] for row in typeahead.search('ferr')], ['Serum ferritin'])
+
+    @override_settings(TYPEAHEAD_MAX_AGE=600, TYPEAHEAD_UNSHARED_MAX_AGE=30)
+    def test_per_process_caches_shorten_the_max_age(self):
+        self.assertEqual(typeahead.max_age(), 30)
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}):
+            self.assertEqual(typeahead.max_age(), 600)
@@ -0,0 +1,154 @@
+"""
+Typeahead search over test names, served from memory.
+
+Each process keeps a sorted array of normalized keys: every word suffix of
+every test name and synonym ("complete blood count", "blood count",
+"count", ...), so a query matches the start of any word. A lookup is two
+bisects and a top-K over the matches, ranked by how many appointments each
+test had in the last settings.TYPEAHEAD_POPULARITY_DAYS; no query runs
+per keystroke.
+
+The index is built on first use and rebuilt when the version stamp in the
+shared cache moves (saving or deleting a Test bumps it), which is checked
+at most every settings.TYPEAHEAD_VERSION_CHECK_INTERVAL seconds, or when it
+is older than settings.TYPEAHEAD_MAX_AGE so popularity stays current.
+
+The version stamp only reaches other processes through a shared cache, so
+production needs Redis (REDIS_URL). With a per-process cache such as the
+LocMemCache fallback, a process never sees another one's bumps; the index
+is then rebuilt every settings.TYPEAHEAD_UNSHARED_MAX_AGE seconds instead.
+"""
+import bisect
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from appointments import sharding
+from appointments.models import Appointment
+from labs.models import LabTest
+from .models import Test
+
+VERSION_KEY = 'tests:typeahead:version'
+_PER_PROCESS_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+_SEPARATORS = re.compile(r'[\W_]+')
+# Sorts after any character that can follow a prefix
+_HIGHEST = '\U0010ffff'
+
+
+def normalize(text):
+    """Lower case, accents stripped, words separated by single spaces"""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char)).casefold()
+    return _SEPARATORS.sub(' ', text).strip()
+
+
+def popularity():
+    """Test id -> appointments booked over the popularity window, on every shard"""
+    since = timezone.now() - timedelta(days=settings.TYPEAHEAD_POPULARITY_DAYS)
+    per_lab_test = {}
+    for alias in sharding.all_aliases():
+        rows = (
+            Appointment.objects.using(alias).filter(appointment_time__gte=since)
+            .exclude(status='cancelled').order_by()
+            .values_list('lab_test_id').annotate(count=Count('id'))
+        )
+        for lab_test_id, count in rows:
+            per_lab_test[lab_test_id] = per_lab_test.get(lab_test_id, 0) + count
+    counts = {}
+    for lab_test_id, test_id in LabTest.objects.filter(pk__in=per_lab_test).values_list('id', 'test_id'):
+        counts[test_id] = counts.get(test_id, 0) + per_lab_test[lab_test_id]
+    return counts
+
+
+class TypeaheadIndex:
+    def __init__(self, tests, counts, version=None):
+        self.version = version
+        self.built_at = time.monotonic()
+        tests = sorted(tests, key=lambda test: (-counts.get(test.pk, 0), test.name))
+        # Position in this list is the rank
+        self.results = [
+            {'id': test.pk, 'name': test.name, 'duration_minutes': test.duration_minutes}
+            for test in tests
+        ]
+        entries = set()
+        for rank, test in enumerate(tests):
+            for name in [test.name, *test.synonym_list()]:
+                words = normalize(name).split()
+                for start in range(len(words)):
+                    entries.add((' '.join(words[start:]), rank))
+        entries = sorted(entries)
+        self.keys = [key for key, _ in entries]
+        self.ranks = [rank for _, rank in entries]
+
+    def search(self, query, limit=10):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + _HIGHEST, start)
+        return [self.results[rank] for rank in heapq.nsmallest(limit, set(self.ranks[start:end]))]
+
+
+def build(version=None):
+    return TypeaheadIndex(Test.objects.only('name', 'duration_minutes', 'synonyms'), popularity(), version)
+
+
+def bump_version():
+    cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def max_age():
+    """Seconds an index may serve, shorter when bumps cannot reach other processes"""
+    if settings.CACHES['default']['BACKEND'] in _PER_PROCESS_CACHES:
+        return min(settings.TYPEAHEAD_MAX_AGE, settings.TYPEAHEAD_UNSHARED_MAX_AGE)
+    return settings.TYPEAHEAD_MAX_AGE
+
+
+def current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # First use, or the cache lost it: start a new version everyone agrees on
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+_index = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_index():
+    """This process's index, rebuilt first if it is out of date"""
+    global _index, _checked_at
+    index, now = _index, time.monotonic()
+    if index is not None and now - _checked_at < settings.TYPEAHEAD_VERSION_CHECK_INTERVAL:
+        return index
+    version = current_version()
+    _checked_at = now
+    if index is not None and index.version == version and now - index.built_at < max_age():
+        return index
+    # While one thread rebuilds, the others keep answering from the old index
+    if not _lock.acquire(blocking=index is None):
+        return index
+    try:
+        if _index is index:
+            _index = build(version)
+        return _index
+    finally:
+        _lock.release()
+
+
+def search(query, limit=10):
+    return get_index().search(query, limit)
@@ -1,10 +1,13 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import TestViewSet
+from core.async_views import async_read_urls
+from .views import TestTypeaheadView, TestViewSet
 
 router = DefaultRouter()
 router.register(r'', TestViewSet)
 
 urlpatterns = [
-    path('', include(router.urls)),
+    # Before the router, whose detail route would take it for a pk
+    path('typeahead/', TestTypeaheadView.as_view(), name='test-typeahead'),
+    path('', include(async_read_urls(router.urls))),
 ]
\ No newline at end of file
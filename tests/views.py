@@ -1,7 +1,28 @@
+from django.conf import settings
 from rest_framework import viewsets
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from .models import Test
+from . import typeahead
 from .serializers import TestSerializer
+from core.mixins import SparseFieldsetMixin
 
-class TestViewSet(viewsets.ModelViewSet):
+class TestViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = Test.objects.all()
-    serializer_class = TestSerializer
\ No newline at end of file
+    serializer_class = TestSerializer
+
+
+class TestTypeaheadView(APIView):
+    """
+    Tests whose name or a synonym has a word starting with ?q=, most
+    booked first: [{"id", "name", "duration_minutes"}, ...]. Answered from
+    the in-memory index in tests.typeahead.
+    """
+
+    def get(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit', settings.TYPEAHEAD_LIMIT)), settings.TYPEAHEAD_MAX_LIMIT)
+        except ValueError:
+            raise ValidationError({'limit': 'Enter a whole number.'})
+        return Response(typeahead.search(request.query_params.get('q', ''), max(limit, 1)))